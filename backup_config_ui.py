@@ -8,6 +8,7 @@ import os
 # --- Configuration File Path ---
 CONFIG_FILE_PATH = os.path.expanduser("~/.backupvault/backupvault.conf")
 APP_DIR_BASE = os.path.dirname(CONFIG_FILE_PATH)
+IGNORE_DIR = os.path.join(APP_DIR_BASE, "ignore") # JOB_NAME.backupignore, read by the backup engine
 
 # --- Default Values (Ensure these match keys used in backupvault.sh) ---
 DEFAULT_CONFIG = {
@@ -27,7 +28,24 @@ DEFAULT_CONFIG = {
     'CLOUD_BACKUP_ENABLED': 'no',
     'RCLONE_REMOTE_NAME': '',
     'RCLONE_REMOTE_PATH': 'BackupVaultArchives/',
-    'DELETE_LOCAL_AFTER_UPLOAD': 'no'
+    'DELETE_LOCAL_AFTER_UPLOAD': 'no',
+    'LOW_SPACE_ACTION': 'abort',
+    'ARCHIVE_ENGINE': 'legacy',
+    'COMPRESSION_THREADS': '0',
+    'COMPRESSION_LEVEL': '',
+    'ZSTD_LONG': 'no',
+    'REPO_BLOOM_FP_RATE': '0.01',
+    'REPO_BLOOM_MEMORY_MB': '256',
+    'IGNORE_LARGER_THAN_MB': '',
+    'IGNORE_OLDER_THAN_DAYS': '',
+    'ARCHIVE_SHARDS': '1',
+    'THROTTLE_READ_MBPS': '',
+    'THROTTLE_WRITE_MBPS': '',
+    'THROTTLE_IOPS': '',
+    'THROTTLE_NICE': '',
+    'THROTTLE_IONICE': 'none',
+    'THROTTLE_CPU_WEIGHT': '',
+    'THROTTLE_IO_WEIGHT': ''
 }
 
 class BackupConfigApp:
@@ -54,6 +72,7 @@ class BackupConfigApp:
         self.vars['EMAIL_NOTIFY_BOOL'] = tk.BooleanVar()
         self.vars['CLOUD_BACKUP_ENABLED_BOOL'] = tk.BooleanVar()
         self.vars['DELETE_LOCAL_AFTER_UPLOAD_BOOL'] = tk.BooleanVar()
+        self.vars['ZSTD_LONG_BOOL'] = tk.BooleanVar()
 
         self.create_ui_widgets() 
         self.load_config_to_gui() 
@@ -214,12 +233,39 @@ class BackupConfigApp:
         options_frame.pack(fill=tk.X, expand=True, pady=(0, frame_pady[1])) # Use frame_pady for consistency
         options_frame.columnconfigure(1, weight=1)
         ttk.Label(options_frame, text="Compression:").grid(row=0, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
-        comp_options = ['tar.gz', 'zip', 'none'];
+        comp_options = ['tar.gz', 'tar.zst', 'tar.lz4', 'zip', 'repo', 'none'];
         if self.vars['COMPRESSION'].get() not in comp_options: self.vars['COMPRESSION'].set(comp_options[0])
-        ttk.OptionMenu(options_frame, self.vars['COMPRESSION'], self.vars['COMPRESSION'].get(), *comp_options).grid(row=0, column=1, sticky=(tk.W,tk.E), padx=col_pad, pady=row_pad)
+        ttk.OptionMenu(options_frame, self.vars['COMPRESSION'], self.vars['COMPRESSION'].get(), *comp_options, command=self.update_dependent_widget_states).grid(row=0, column=1, sticky=(tk.W,tk.E), padx=col_pad, pady=row_pad)
         ttk.Label(options_frame, text="Retention (Days):").grid(row=1, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
         vcmd = (self.root.register(self.validate_integer), '%P')
         ttk.Entry(options_frame, textvariable=self.vars['RETENTION_DAYS'], width=12, validate='key', validatecommand=vcmd).grid(row=1, column=1, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(options_frame, text="If Space Is Low:").grid(row=2, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        low_space_options = ['abort', 'defer', 'warn', 'ignore']
+        if self.vars['LOW_SPACE_ACTION'].get() not in low_space_options: self.vars['LOW_SPACE_ACTION'].set(low_space_options[0])
+        ttk.OptionMenu(options_frame, self.vars['LOW_SPACE_ACTION'], self.vars['LOW_SPACE_ACTION'].get(), *low_space_options).grid(row=2, column=1, sticky=(tk.W,tk.E), padx=col_pad, pady=row_pad)
+        ttk.Label(options_frame, text="Archive Engine:").grid(row=3, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        engine_options = ['legacy', 'python']
+        if self.vars['ARCHIVE_ENGINE'].get() not in engine_options: self.vars['ARCHIVE_ENGINE'].set(engine_options[0])
+        ttk.OptionMenu(options_frame, self.vars['ARCHIVE_ENGINE'], self.vars['ARCHIVE_ENGINE'].get(), *engine_options).grid(row=3, column=1, sticky=(tk.W,tk.E), padx=col_pad, pady=row_pad)
+        ttk.Label(options_frame, text="Compression Threads:").grid(row=4, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(options_frame, textvariable=self.vars['COMPRESSION_THREADS'], width=12, validate='key', validatecommand=vcmd).grid(row=4, column=1, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(options_frame, text="(0 = all cores)").grid(row=5, column=1, sticky=tk.W, padx=col_pad, pady=2)
+        ttk.Label(options_frame, text="Compression Level:").grid(row=6, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(options_frame, textvariable=self.vars['COMPRESSION_LEVEL'], width=12, validate='key', validatecommand=vcmd).grid(row=6, column=1, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(options_frame, text="(empty = default; gzip 1-9, zstd 1-19, lz4 1-12)").grid(row=7, column=1, sticky=tk.W, padx=col_pad, pady=2)
+        self.zstd_long_checkbox_widget = ttk.Checkbutton(options_frame, text="zstd long-distance matching", variable=self.vars['ZSTD_LONG_BOOL'])
+        self.zstd_long_checkbox_widget.grid(row=8, column=0, columnspan=2, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(options_frame, text="Backup Mode:").grid(row=9, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        mode_options = ['full', 'incremental', 'differential']
+        if self.vars['BACKUP_MODE'].get() not in mode_options: self.vars['BACKUP_MODE'].set(mode_options[0])
+        ttk.OptionMenu(options_frame, self.vars['BACKUP_MODE'], self.vars['BACKUP_MODE'].get(), *mode_options).grid(row=9, column=1, sticky=(tk.W,tk.E), padx=col_pad, pady=row_pad)
+        ttk.Label(options_frame, text="Repo Bloom FP Rate:").grid(row=10, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(options_frame, textvariable=self.vars['REPO_BLOOM_FP_RATE'], width=12).grid(row=10, column=1, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(options_frame, text="Repo Bloom Memory (MB):").grid(row=11, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(options_frame, textvariable=self.vars['REPO_BLOOM_MEMORY_MB'], width=12, validate='key', validatecommand=vcmd).grid(row=11, column=1, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(options_frame, text="Archive Shards:").grid(row=12, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(options_frame, textvariable=self.vars['ARCHIVE_SHARDS'], width=12, validate='key', validatecommand=vcmd).grid(row=12, column=1, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(options_frame, text="(1 = one archive; N = N archives in parallel, full backups only)").grid(row=13, column=1, sticky=tk.W, padx=col_pad, pady=2)
 
         security_frame = ttk.LabelFrame(col0_frame, text="Security (GPG Encryption)", padding="15")
         security_frame.pack(fill=tk.X, expand=True)
@@ -260,6 +306,44 @@ class BackupConfigApp:
         self.delete_local_checkbox_widget.grid(row=3, column=0, columnspan=2, sticky=tk.W, padx=col_pad, pady=row_pad)
         current_row +=1
 
+        # --- Exclusions Section (python engine archives and repositories) ---
+        ignore_frame = ttk.LabelFrame(main_frame, text="Exclusions (.backupignore)", padding="15")
+        ignore_frame.grid(row=current_row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=frame_pady)
+        ignore_frame.columnconfigure(1, weight=1)
+        ttk.Label(ignore_frame, text="Rules (gitignore syntax):").grid(row=0, column=0, sticky=(tk.W, tk.N), padx=col_pad, pady=row_pad)
+        self.ignore_rules_text = tk.Text(ignore_frame, height=5, width=65, background=self.surface_bg, foreground=self.text_color,
+                                         insertbackground=self.text_color, relief='flat')
+        self.ignore_rules_text.grid(row=0, column=1, columnspan=3, sticky=(tk.W, tk.E), padx=col_pad, pady=row_pad)
+        vcmd = (self.root.register(self.validate_integer), '%P')
+        ttk.Label(ignore_frame, text="Skip Files Larger Than (MB):").grid(row=1, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(ignore_frame, textvariable=self.vars['IGNORE_LARGER_THAN_MB'], width=12, validate='key', validatecommand=vcmd).grid(row=1, column=1, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(ignore_frame, text="Skip Files Older Than (Days):").grid(row=1, column=2, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(ignore_frame, textvariable=self.vars['IGNORE_OLDER_THAN_DAYS'], width=12, validate='key', validatecommand=vcmd).grid(row=1, column=3, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(ignore_frame, text="(e.g. node_modules/, .cache/, *.iso, !keep.iso; empty = no limit)").grid(row=2, column=1, columnspan=3, sticky=tk.W, padx=col_pad, pady=2)
+        current_row +=1
+
+        # --- Resource Limits Section (python engine archives, syncs and repositories) ---
+        throttle_frame = ttk.LabelFrame(main_frame, text="Resource Limits", padding="15")
+        throttle_frame.grid(row=current_row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=frame_pady)
+        ttk.Label(throttle_frame, text="Read Limit (MiB/s):").grid(row=0, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(throttle_frame, textvariable=self.vars['THROTTLE_READ_MBPS'], width=12, validate='key', validatecommand=vcmd).grid(row=0, column=1, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(throttle_frame, text="Write Limit (MiB/s):").grid(row=0, column=2, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(throttle_frame, textvariable=self.vars['THROTTLE_WRITE_MBPS'], width=12, validate='key', validatecommand=vcmd).grid(row=0, column=3, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(throttle_frame, text="Max IOPS:").grid(row=1, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(throttle_frame, textvariable=self.vars['THROTTLE_IOPS'], width=12, validate='key', validatecommand=vcmd).grid(row=1, column=1, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(throttle_frame, text="Nice (0-19):").grid(row=1, column=2, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(throttle_frame, textvariable=self.vars['THROTTLE_NICE'], width=12, validate='key', validatecommand=vcmd).grid(row=1, column=3, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(throttle_frame, text="I/O Class:").grid(row=2, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ionice_options = ['none', 'best-effort', 'idle']
+        if self.vars['THROTTLE_IONICE'].get() not in ionice_options: self.vars['THROTTLE_IONICE'].set(ionice_options[0])
+        ttk.OptionMenu(throttle_frame, self.vars['THROTTLE_IONICE'], self.vars['THROTTLE_IONICE'].get(), *ionice_options).grid(row=2, column=1, sticky=(tk.W,tk.E), padx=col_pad, pady=row_pad)
+        ttk.Label(throttle_frame, text="cgroup CPU Weight:").grid(row=3, column=0, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(throttle_frame, textvariable=self.vars['THROTTLE_CPU_WEIGHT'], width=12, validate='key', validatecommand=vcmd).grid(row=3, column=1, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(throttle_frame, text="cgroup IO Weight:").grid(row=3, column=2, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Entry(throttle_frame, textvariable=self.vars['THROTTLE_IO_WEIGHT'], width=12, validate='key', validatecommand=vcmd).grid(row=3, column=3, sticky=tk.W, padx=col_pad, pady=row_pad)
+        ttk.Label(throttle_frame, text="(empty = no limit; weights 1-10000, 100 = default; during a run, edit ~/.backupvault/throttle/JOB_NAME.limits)").grid(row=4, column=0, columnspan=4, sticky=tk.W, padx=col_pad, pady=2)
+        current_row +=1
+
         # Action Buttons
         button_frame = ttk.Frame(main_frame) 
         button_frame.grid(row=current_row, column=0, columnspan=3, sticky=tk.E, pady=(row_pad*2, 0)) # pady top only
@@ -278,6 +362,10 @@ class BackupConfigApp:
                 elif freq == "weekly": self.vars['CUSTOM_CRON_SCHEDULE'].set("0 2 * * 0")
                 elif freq == "monthly": self.vars['CUSTOM_CRON_SCHEDULE'].set("0 2 1 * *")
         
+        # zstd Long Matching
+        if hasattr(self, 'zstd_long_checkbox_widget'):
+            self.zstd_long_checkbox_widget.config(state=tk.NORMAL if self.vars['COMPRESSION'].get() == 'tar.zst' else tk.DISABLED)
+
         # GPG Recipient Entry
         if hasattr(self, 'gpg_recipient_entry_widget'):
             self.gpg_recipient_entry_widget.config(state=tk.NORMAL if self.vars['ENCRYPTION_BOOL'].get() else tk.DISABLED)
@@ -339,21 +427,38 @@ class BackupConfigApp:
             config_value = temp_config.get(tk_var_name.upper(), DEFAULT_CONFIG[tk_var_name])
             if tk_var_name in self.vars: self.vars[tk_var_name].set(config_value)
             if bool_var_name in self.vars:
-                if key_default in ['EMAIL_NOTIFY', 'CLOUD_BACKUP_ENABLED', 'DELETE_LOCAL_AFTER_UPLOAD']:
+                if key_default in ['EMAIL_NOTIFY', 'CLOUD_BACKUP_ENABLED', 'DELETE_LOCAL_AFTER_UPLOAD', 'ZSTD_LONG']:
                      self.vars[bool_var_name].set(config_value.lower() == 'yes')
                 elif key_default == 'ENCRYPTION': # Special for ENCRYPTION
                      self.vars['ENCRYPTION_BOOL'].set(config_value.lower() == 'gpg')
 
+        ignore_file_path = os.path.join(IGNORE_DIR, f"{self.vars['JOB_NAME'].get()}.backupignore")
+        if os.path.exists(ignore_file_path):
+            try:
+                with open(ignore_file_path, 'r', encoding='utf-8') as f: self.ignore_rules_text.insert('1.0', f.read())
+            except Exception as e: print(f"Error reading exclude rules '{ignore_file_path}': {e}")
+
     def save_config_and_exit(self):
         if not self.vars['SOURCE_FOLDERS'].get().strip(): messagebox.showerror("Validation Error", "Source Folders empty.", parent=self.root); return
         if not self.vars['DESTINATION_DIRECTORY'].get().strip(): messagebox.showerror("Validation Error", "Destination Directory empty.", parent=self.root); return
         try:
             if int(self.vars['RETENTION_DAYS'].get()) < 0: raise ValueError()
         except ValueError: messagebox.showerror("Validation Error", "Retention Days must be >= 0.", parent=self.root); return
+        try:
+            if not 0 < float(self.vars['REPO_BLOOM_FP_RATE'].get()) < 1: raise ValueError()
+        except ValueError: messagebox.showerror("Validation Error", "Repo Bloom FP Rate must be between 0 and 1.", parent=self.root); return
+        try:
+            if int(self.vars['ARCHIVE_SHARDS'].get()) < 1: raise ValueError()
+        except ValueError: messagebox.showerror("Validation Error", "Archive Shards must be >= 1.", parent=self.root); return
+        try:
+            if self.vars['THROTTLE_NICE'].get() and not 0 <= int(self.vars['THROTTLE_NICE'].get()) <= 19: raise ValueError()
+            for key in ('THROTTLE_CPU_WEIGHT', 'THROTTLE_IO_WEIGHT'):
+                if self.vars[key].get() and not 1 <= int(self.vars[key].get()) <= 10000: raise ValueError()
+        except ValueError: messagebox.showerror("Validation Error", "Nice must be 0-19 and cgroup weights 1-10000.", parent=self.root); return
         config_to_save = {}
         for key_default in DEFAULT_CONFIG:
             bool_var_name = key_default + "_BOOL"
-            if key_default in ['EMAIL_NOTIFY', 'CLOUD_BACKUP_ENABLED', 'DELETE_LOCAL_AFTER_UPLOAD']:
+            if key_default in ['EMAIL_NOTIFY', 'CLOUD_BACKUP_ENABLED', 'DELETE_LOCAL_AFTER_UPLOAD', 'ZSTD_LONG']:
                 config_to_save[key_default] = 'yes' if self.vars[bool_var_name].get() else 'no'
             elif key_default == 'ENCRYPTION':
                  config_to_save[key_default] = 'gpg' if self.vars['ENCRYPTION_BOOL'].get() else 'none'
@@ -378,6 +483,9 @@ class BackupConfigApp:
             os.makedirs(APP_DIR_BASE, exist_ok=True)
             with open(CONFIG_FILE_PATH, 'w', encoding='utf-8') as f:
                 for key, value in config_to_save.items(): f.write(f'{key.upper()}="{value}"\n') 
+            os.makedirs(IGNORE_DIR, exist_ok=True)
+            with open(os.path.join(IGNORE_DIR, f"{config_to_save['JOB_NAME']}.backupignore"), 'w', encoding='utf-8') as f:
+                rules_text = self.ignore_rules_text.get('1.0', 'end-1c').strip(); f.write(rules_text + '\n' if rules_text else '')
             messagebox.showinfo("Success", f"Configuration saved:\n{CONFIG_FILE_PATH}", parent=self.root)
             self.root.destroy() 
         except Exception as e: messagebox.showerror("Save Error", f"Failed to save config:\n{e}", parent=self.root)
@@ -14,6 +14,8 @@ set -o pipefail
 # --- Configuration & Log Paths ---
 APP_DIR_BASE="$HOME/.backupvault"
 CONFIG_FILE="$APP_DIR_BASE/backupvault.conf"
+IGNORE_DIR="$APP_DIR_BASE/ignore" # JOB_NAME.backupignore: gitignore-style exclude rules per job
+THROTTLE_DIR="$APP_DIR_BASE/throttle" # JOB_NAME.limits: READ_MBPS= / WRITE_MBPS= / IOPS=, re-read by the engine during a run
 LOG_DIR_BASE="$APP_DIR_BASE/logs"
 RUNS_LOG_CSV="$LOG_DIR_BASE/backup_runs.csv"
 DETAILED_LOGS_DIR="$LOG_DIR_BASE/details"
@@ -32,7 +34,7 @@ FREQUENCY="daily"; CUSTOM_CRON_SCHEDULE="0 2 * * *"; COMPRESSION="tar.gz"
 BACKUP_MODE="full"; RETENTION_DAYS="30"; ENCRYPTION="none"; GPG_RECIPIENT=""
 EMAIL_NOTIFY="no"; EMAIL_ADDRESS=""; EMAIL_SUBJECT_PREFIX="[BackupVault]"
 CLOUD_BACKUP_ENABLED="no"; RCLONE_REMOTE_NAME=""; RCLONE_REMOTE_PATH="BackupVault/"
-DELETE_LOCAL_AFTER_UPLOAD="no"
+DELETE_LOCAL_AFTER_UPLOAD="no"; LOW_SPACE_ACTION="abort"; ARCHIVE_ENGINE="legacy"; COMPRESSION_THREADS="0"; COMPRESSION_LEVEL=""; ZSTD_LONG="no"; REPO_BLOOM_FP_RATE="0.01"; REPO_BLOOM_MEMORY_MB="256"; IGNORE_LARGER_THAN_MB=""; IGNORE_OLDER_THAN_DAYS=""; ARCHIVE_SHARDS="1"; THROTTLE_READ_MBPS=""; THROTTLE_WRITE_MBPS=""; THROTTLE_IOPS=""; THROTTLE_NICE=""; THROTTLE_IONICE="none"; THROTTLE_CPU_WEIGHT=""; THROTTLE_IO_WEIGHT=""
 
 # --- Ensure Base Directories Exist ---
 ensure_dir_exists() {
@@ -73,7 +75,7 @@ load_config() {
     BACKUP_MODE="full"; RETENTION_DAYS="30"; ENCRYPTION="none"; GPG_RECIPIENT=""
     EMAIL_NOTIFY="no"; EMAIL_ADDRESS=""; EMAIL_SUBJECT_PREFIX="[BackupVault]"
     CLOUD_BACKUP_ENABLED="no"; RCLONE_REMOTE_NAME=""; RCLONE_REMOTE_PATH="BackupVault/"
-    DELETE_LOCAL_AFTER_UPLOAD="no"
+    DELETE_LOCAL_AFTER_UPLOAD="no"; LOW_SPACE_ACTION="abort"; ARCHIVE_ENGINE="legacy"; COMPRESSION_THREADS="0"; COMPRESSION_LEVEL=""; ZSTD_LONG="no"; REPO_BLOOM_FP_RATE="0.01"; REPO_BLOOM_MEMORY_MB="256"; IGNORE_LARGER_THAN_MB=""; IGNORE_OLDER_THAN_DAYS=""; ARCHIVE_SHARDS="1"; THROTTLE_READ_MBPS=""; THROTTLE_WRITE_MBPS=""; THROTTLE_IOPS=""; THROTTLE_NICE=""; THROTTLE_IONICE="none"; THROTTLE_CPU_WEIGHT=""; THROTTLE_IO_WEIGHT=""
     if [[ -f "$CONFIG_FILE" ]]; then
         log_message_detailed "[INFO] Attempting to load config from $CONFIG_FILE"
         while IFS= read -r line || [[ -n "$line" ]]; do
@@ -82,7 +84,7 @@ load_config() {
             if [[ "$line_clean" =~ ^([A-Z_][A-Z0-9_]*)\s*=\s*\"(.*)\"\s*$ ]]; then
                 local key="${BASH_REMATCH[1]}"; local value="${BASH_REMATCH[2]}"
                 case "$key" in
-                    JOB_NAME|SOURCE_FOLDERS|DESTINATION_DIRECTORY|FREQUENCY|CUSTOM_CRON_SCHEDULE|COMPRESSION|BACKUP_MODE|RETENTION_DAYS|ENCRYPTION|GPG_RECIPIENT|EMAIL_NOTIFY|EMAIL_ADDRESS|EMAIL_SUBJECT_PREFIX|CLOUD_BACKUP_ENABLED|RCLONE_REMOTE_NAME|RCLONE_REMOTE_PATH|DELETE_LOCAL_AFTER_UPLOAD)
+                    JOB_NAME|SOURCE_FOLDERS|DESTINATION_DIRECTORY|FREQUENCY|CUSTOM_CRON_SCHEDULE|COMPRESSION|BACKUP_MODE|RETENTION_DAYS|ENCRYPTION|GPG_RECIPIENT|EMAIL_NOTIFY|EMAIL_ADDRESS|EMAIL_SUBJECT_PREFIX|CLOUD_BACKUP_ENABLED|RCLONE_REMOTE_NAME|RCLONE_REMOTE_PATH|DELETE_LOCAL_AFTER_UPLOAD|LOW_SPACE_ACTION|ARCHIVE_ENGINE|COMPRESSION_THREADS|COMPRESSION_LEVEL|ZSTD_LONG|REPO_BLOOM_FP_RATE|REPO_BLOOM_MEMORY_MB|IGNORE_LARGER_THAN_MB|IGNORE_OLDER_THAN_DAYS|ARCHIVE_SHARDS|THROTTLE_READ_MBPS|THROTTLE_WRITE_MBPS|THROTTLE_IOPS|THROTTLE_NICE|THROTTLE_IONICE|THROTTLE_CPU_WEIGHT|THROTTLE_IO_WEIGHT)
                         printf -v "$key" '%s' "$value" ;;
                     *) log_message_detailed "[WARNING] Unknown key in config: '$key'" ;;
                 esac
@@ -108,13 +110,18 @@ run_wizard() {
     if [[ "$schedule_now" -eq 1 ]]; then schedule_backup; else log_message_detailed "[INFO] Scheduling skipped."; fi; return 0
 }
 
+# --- Python Engine Helpers (backupvault_engine/) ---
+run_engine() { PYTHONPATH="$SCRIPT_DIR${PYTHONPATH:+:$PYTHONPATH}" python3 -m backupvault_engine "$@"; }
+
 # --- Email Notification, Cloud Upload, Local Cleanup ---
 # (send_email, upload_to_cloud_rclone, cleanup_old_local_backups are the same as the last complete version)
 send_email() { local s="$1" b="$2" r="$EMAIL_ADDRESS"; if [[ "$EMAIL_NOTIFY" != "yes" || -z "$r" ]]; then log_message_detailed "[INFO] Email skip."; return 0; fi; if ! command -v mail &>/dev/null; then log_message_detailed "[ERROR] 'mail' missing."; return 1; fi; log_message_detailed "[INFO] Emailing $r..."; if printf '%s\n' "$b" | mail -s "$s" "$r"; then log_message_detailed "[INFO] Email handoff OK."; else log_message_detailed "[ERROR] Email handoff FAIL."; return 1; fi; return 0; }
-upload_to_cloud_rclone() { local lfp="$1" ab; if [[ -z "$lfp" || ! -e "$lfp" ]]; then log_message_detailed "[ERROR] Cloud: Invalid local path '$lfp'."; return 1; fi; ab=$(basename "$lfp"); if [[ "$CLOUD_BACKUP_ENABLED" != "yes" || -z "$RCLONE_REMOTE_NAME" || -z "$RCLONE_REMOTE_PATH" ]]; then log_message_detailed "[INFO] Cloud skip: disabled/config."; return 2; fi; if ! command -v rclone &>/dev/null; then log_message_detailed "[ERROR] 'rclone' missing."; return 1; fi; local rbp="${RCLONE_REMOTE_PATH%/}" rfp="$RCLONE_REMOTE_NAME:$rbp/" ca="copy" dm=""; if [[ "$DELETE_LOCAL_AFTER_UPLOAD" == "yes" ]]; then ca="moveto"; dm=" (will delete local)"; fi; log_message_detailed "[INFO] Using 'rclone $ca'$dm."; local rdp="$rfp"; if [[ -d "$lfp" ]]; then rdp="$rfp$ab/"; fi; log_message_detailed "[INFO] Cloud upload of '$ab' to '$rdp'..."; log_message_detailed "[CMD] rclone $ca -v --stats-one-line --stats 10s \"$lfp\" \"$rdp\""; local rlt; rlt=$(mktemp); if rclone "$ca" -v --stats-one-line --stats 10s "$lfp" "$rdp" > "$rlt" 2>&1; then cat "$rlt" >> "$CURRENT_RUN_DETAILED_LOG"; rm "$rlt"; log_message_detailed "[INFO] Cloud upload ($ca) OK for '$ab'."; return 0; else local rc=$?; cat "$rlt" >> "$CURRENT_RUN_DETAILED_LOG"; rm "$rlt"; log_message_detailed "[ERROR] Cloud upload ($ca) FAIL for '$ab'. rclone code: $rc."; return 1; fi; }
-cleanup_old_local_backups() { local dd="$1" rd="$2" jp="$3-*"; log_message_detailed "[INFO] Local cleanup check..."; if [[ ! "$rd" =~ ^[1-9][0-9]*$ ]]; then log_message_detailed "[INFO] Retention invalid ($rd days). Skip cleanup."; return 0; fi; if [[ ! -d "$dd" ]]; then log_message_detailed "[ERROR] Cleanup FAIL: Dest '$dd' not found."; return 1; fi; log_message_detailed "[INFO] Checking for backups older than $rd days in '$dd' matching '$jp'..."; local ftd; if ! ftd=$(find "$dd" -maxdepth 1 -name "$jp" -mtime "+$rd" -print); then log_message_detailed "[ERROR] 'find' FAIL during cleanup. Skip."; return 1; fi; if [[ -n "$ftd" ]]; then log_message_detailed "[INFO] Old backups to delete (Deletion COMMENTED OUT):"; printf '%s\n' "$ftd" >> "$CURRENT_RUN_DETAILED_LOG"; log_message_detailed "[WARNING] Actual deletion in cleanup_old_local_backups is COMMENTED for safety."; else log_message_detailed "[INFO] No old local backups to delete."; fi; return 0; }
+upload_to_cloud_rclone() { local lfp="$1" ab; local extra_args=("${@:2}"); if [[ -z "$lfp" || ! -e "$lfp" ]]; then log_message_detailed "[ERROR] Cloud: Invalid local path '$lfp'."; return 1; fi; ab=$(basename "$lfp"); if [[ "$CLOUD_BACKUP_ENABLED" != "yes" || -z "$RCLONE_REMOTE_NAME" || -z "$RCLONE_REMOTE_PATH" ]]; then log_message_detailed "[INFO] Cloud skip: disabled/config."; return 2; fi; if ! command -v rclone &>/dev/null; then log_message_detailed "[ERROR] 'rclone' missing."; return 1; fi; local rbp="${RCLONE_REMOTE_PATH%/}" rfp="$RCLONE_REMOTE_NAME:$rbp/" ca="copy" dm=""; if [[ "$DELETE_LOCAL_AFTER_UPLOAD" == "yes" ]]; then ca="moveto"; dm=" (will delete local)"; fi; log_message_detailed "[INFO] Using 'rclone $ca'$dm."; local rdp="$rfp"; if [[ -d "$lfp" ]]; then rdp="$rfp$ab/"; fi; log_message_detailed "[INFO] Cloud upload of '$ab' to '$rdp'..."; log_message_detailed "[CMD] rclone $ca -v --stats-one-line --stats 10s ${extra_args[*]} \"$lfp\" \"$rdp\""; local rlt; rlt=$(mktemp); if rclone "$ca" -v --stats-one-line --stats 10s "${extra_args[@]}" "$lfp" "$rdp" > "$rlt" 2>&1; then cat "$rlt" >> "$CURRENT_RUN_DETAILED_LOG"; rm "$rlt"; log_message_detailed "[INFO] Cloud upload ($ca) OK for '$ab'."; return 0; else local rc=$?; cat "$rlt" >> "$CURRENT_RUN_DETAILED_LOG"; rm "$rlt"; log_message_detailed "[ERROR] Cloud upload ($ca) FAIL for '$ab'. rclone code: $rc."; return 1; fi; }
+cleanup_old_local_backups() { local dd="$1" rd="$2" jn="$3" jp="$3-*"; log_message_detailed "[INFO] Local cleanup check..."; if [[ ! "$rd" =~ ^[1-9][0-9]*$ ]]; then log_message_detailed "[INFO] Retention invalid ($rd days). Skip cleanup."; return 0; fi; if [[ ! -d "$dd" ]]; then log_message_detailed "[ERROR] Cleanup FAIL: Dest '$dd' not found."; return 1; fi; log_message_detailed "[INFO] Checking for backups older than $rd days in '$dd' for job '$jn'..."; local ftd; if ! ftd=$(run_engine inventory list "$dd" --job "$jn" --older-than-days "$rd" --format paths 2>>"$CURRENT_RUN_DETAILED_LOG"); then log_message_detailed "[WARNING] Artifact inventory unavailable. Falling back to 'find' matching '$jp'."; if ! ftd=$(find "$dd" -maxdepth 1 -name "$jp" -mtime "+$rd" -print); then log_message_detailed "[ERROR] 'find' FAIL during cleanup. Skip."; return 1; fi; fi; if [[ -n "$ftd" ]]; then log_message_detailed "[INFO] Old backups to delete (Deletion COMMENTED OUT):"; printf '%s\n' "$ftd" >> "$CURRENT_RUN_DETAILED_LOG"; local ftd_array rcb; mapfile -t ftd_array <<< "$ftd"; if rcb=$(run_engine reclaimable "${ftd_array[@]}" 2>>"$CURRENT_RUN_DETAILED_LOG"); then log_message_detailed "[INFO] Deleting them would free $rcb bytes (files hardlinked into newer snapshots stay)."; fi; log_message_detailed "[WARNING] Actual deletion in cleanup_old_local_backups is COMMENTED for safety."; else log_message_detailed "[INFO] No old local backups to delete."; fi; return 0; }
 
 # --- Backup Logic (perform_backup) ---
+restore_backup() { local artifact="$1" target="$2"; if [[ -z "$artifact" || -z "$target" ]]; then echo "Usage: $0 restore ARTIFACT TARGET_DIR [MEMBER...]" >&2; return 1; fi; local member_args=(); local m; for m in "${@:3}"; do member_args+=(--member "$m"); done; log_message_detailed "[INFO] Restoring '$artifact' into '$target'..."; if run_engine restore "$artifact" "$target" "${member_args[@]}" 2>&1 | tee -a "${CURRENT_RUN_DETAILED_LOG:-$LOG_DIR_BASE/backupvault_script_operations.log}"; then log_message_detailed "[INFO] Restore OK."; else log_message_detailed "[ERROR] Restore FAIL for '$artifact'."; return 1; fi; }
+
 perform_backup() {
     load_config 
     if [[ -z "$SOURCE_FOLDERS" ]] || [[ -z "$DESTINATION_DIRECTORY" ]]; then
@@ -136,9 +143,9 @@ perform_backup() {
     # ... (Log all config details: JOB_NAME, SOURCES, DESTINATION_DIRECTORY, etc. - same as previous version) ...
     log_message_detailed "[INFO] Job Name: $JOB_NAME"; log_message_detailed "[INFO] Run ID: $run_id"
     log_message_detailed "[INFO] Sources: $SOURCE_FOLDERS"; log_message_detailed "[INFO] Destination Base: $DESTINATION_DIRECTORY"
-    log_message_detailed "[INFO] Compression: $COMPRESSION, Encryption: $ENCRYPTION"
+    log_message_detailed "[INFO] Compression: $COMPRESSION, Encryption: $ENCRYPTION, Archive Engine: $ARCHIVE_ENGINE, Threads: $COMPRESSION_THREADS, Level: ${COMPRESSION_LEVEL:-default}, zstd long: $ZSTD_LONG, Backup Mode: $BACKUP_MODE"
     log_message_detailed "[INFO] Cloud Upload: $CLOUD_BACKUP_ENABLED, Remote: $RCLONE_REMOTE_NAME, Path: $RCLONE_REMOTE_PATH"
-    log_message_detailed "[INFO] Delete Local After Upload: $DELETE_LOCAL_AFTER_UPLOAD"
+    log_message_detailed "[INFO] Delete Local After Upload: $DELETE_LOCAL_AFTER_UPLOAD, Low Space Action: $LOW_SPACE_ACTION"
     log_message_detailed "[INFO] Email Notify: $EMAIL_NOTIFY, Recipient: $EMAIL_ADDRESS"
 
     local local_backup_status="pending"; local cloud_upload_status_code=2; local backup_size_bytes=0
@@ -170,41 +177,184 @@ perform_backup() {
         return 1;
     fi
 
+    # --- Backup mode: archives need the python engine and a manifest baseline; rsync snapshots
+    # hardlink unchanged files to the job's previous snapshot (--link-dest) ---
+    local effective_backup_mode="full"; local backup_mode_infix=""; local link_dest_snapshot=""
+    if [[ "$BACKUP_MODE" == "incremental" || "$BACKUP_MODE" == "differential" ]]; then
+        if [[ "$COMPRESSION" == "none" ]]; then
+            link_dest_snapshot=$(run_engine inventory list "$DESTINATION_DIRECTORY" --job "$JOB_NAME" --type rsync --format paths 2>>"$CURRENT_RUN_DETAILED_LOG" | head -n 1)
+            if [[ -n "$link_dest_snapshot" ]]; then effective_backup_mode="$BACKUP_MODE"; log_message_detailed "[INFO] Hardlink snapshot against '$link_dest_snapshot'."
+            else log_message_detailed "[INFO] No earlier snapshot of '$JOB_NAME' to link against. Copying everything."; fi
+        elif [[ "$COMPRESSION" == "repo" ]]; then
+            log_message_detailed "[INFO] Repository snapshots always store only new chunks; BACKUP_MODE=$BACKUP_MODE is not needed."
+        elif [[ "$ARCHIVE_ENGINE" != "python" ]]; then
+            log_message_detailed "[WARNING] BACKUP_MODE=$BACKUP_MODE needs ARCHIVE_ENGINE=python for $COMPRESSION artifacts. Running a full backup."
+        elif [[ "${ARCHIVE_SHARDS:-1}" -gt 1 ]]; then
+            log_message_detailed "[WARNING] Sharded archives (ARCHIVE_SHARDS=$ARCHIVE_SHARDS) are always full backups. Running a full backup."
+        else
+            effective_backup_mode=$(run_engine backup-mode --job "$JOB_NAME" --mode "$BACKUP_MODE" --sources "$SOURCE_FOLDERS" 2>>"$CURRENT_RUN_DETAILED_LOG") || effective_backup_mode="full"
+            if [[ "$effective_backup_mode" != "$BACKUP_MODE" ]]; then
+                effective_backup_mode="full"; log_message_detailed "[INFO] No $BACKUP_MODE baseline yet (first run, lost manifest or changed sources). Running a full backup."
+            fi
+        fi
+        if [[ "$effective_backup_mode" == "incremental" ]]; then backup_mode_infix=".incr"; elif [[ "$effective_backup_mode" == "differential" ]]; then backup_mode_infix=".diff"; fi
+    fi
+    log_message_detailed "[INFO] Effective backup mode: $effective_backup_mode"
+
+    # --- Exclude rules (.backupignore, size/age): applied by the engine's walk ---
+    local ignore_args=(); local ignore_file="$IGNORE_DIR/$JOB_NAME.backupignore"
+    if [[ -s "$ignore_file" ]]; then ignore_args+=(--ignore-file "$ignore_file"); fi
+    if [[ -n "$IGNORE_LARGER_THAN_MB" ]]; then ignore_args+=(--larger-than-mb "$IGNORE_LARGER_THAN_MB"); fi
+    if [[ -n "$IGNORE_OLDER_THAN_DAYS" ]]; then ignore_args+=(--older-than-days "$IGNORE_OLDER_THAN_DAYS"); fi
+    if [[ ${#ignore_args[@]} -gt 0 ]] && [[ "$COMPRESSION" != "repo" ]] && [[ "$ARCHIVE_ENGINE" != "python" ]]; then
+        log_message_detailed "[WARNING] Exclude rules are applied by ARCHIVE_ENGINE=python and repositories only; this run includes everything."
+    fi
+
+    # --- Resource limits (bandwidth/IOPS caps, priorities): applied by the engine, adjustable during the run ---
+    local throttle_control="$THROTTLE_DIR/$JOB_NAME.limits"; local throttle_args=(--throttle-control "$throttle_control")
+    if [[ -n "$THROTTLE_READ_MBPS" ]]; then throttle_args+=(--read-mbps "$THROTTLE_READ_MBPS"); fi
+    if [[ -n "$THROTTLE_WRITE_MBPS" ]]; then throttle_args+=(--write-mbps "$THROTTLE_WRITE_MBPS"); fi
+    if [[ -n "$THROTTLE_IOPS" ]]; then throttle_args+=(--iops "$THROTTLE_IOPS"); fi
+    if [[ -n "$THROTTLE_NICE" ]]; then throttle_args+=(--nice "$THROTTLE_NICE"); fi
+    if [[ -n "$THROTTLE_IONICE" ]] && [[ "$THROTTLE_IONICE" != "none" ]]; then throttle_args+=(--ionice "$THROTTLE_IONICE"); fi
+    if [[ -n "$THROTTLE_CPU_WEIGHT" ]]; then throttle_args+=(--cpu-weight "$THROTTLE_CPU_WEIGHT"); fi
+    if [[ -n "$THROTTLE_IO_WEIGHT" ]]; then throttle_args+=(--io-weight "$THROTTLE_IO_WEIGHT"); fi
+    if [[ ${#throttle_args[@]} -gt 2 ]]; then
+        if [[ "$COMPRESSION" != "repo" ]] && [[ "$ARCHIVE_ENGINE" != "python" ]]; then
+            log_message_detailed "[WARNING] Resource limits are applied by ARCHIVE_ENGINE=python and repositories only; this run is not throttled."
+        else
+            log_message_detailed "[INFO] Resource limits: read ${THROTTLE_READ_MBPS:+$THROTTLE_READ_MBPS MiB/s}${THROTTLE_READ_MBPS:-no limit}, write ${THROTTLE_WRITE_MBPS:+$THROTTLE_WRITE_MBPS MiB/s}${THROTTLE_WRITE_MBPS:-no limit}, IOPS ${THROTTLE_IOPS:-no limit}, nice ${THROTTLE_NICE:-unchanged}, I/O class ${THROTTLE_IONICE:-none} (caps can be changed during the run in $throttle_control)"
+        fi
+    fi
+
+    local link_dest_args=(); if [[ -n "$link_dest_snapshot" ]]; then link_dest_args=(--link-dest="$link_dest_snapshot"); fi
+
+    # --- Preflight: stop before any bytes are written if the artifact is not going to fit ---
+    if [[ "$LOW_SPACE_ACTION" != "ignore" ]]; then
+        log_message_detailed "[STEP] Preflight capacity check..."
+        local preflight_encryption="none"; if [[ "$ENCRYPTION" == "gpg" ]] && [[ -n "$GPG_RECIPIENT" ]] && [[ "$COMPRESSION" != "repo" ]]; then preflight_encryption="gpg"; fi
+        local preflight_output=""; local preflight_exit_code=0
+        local preflight_ignore_args=(); if [[ "$COMPRESSION" == "repo" ]] || [[ "$ARCHIVE_ENGINE" == "python" ]]; then preflight_ignore_args=("${ignore_args[@]}"); fi
+        preflight_output=$(run_engine preflight "$DESTINATION_DIRECTORY" --job "$JOB_NAME" --sources "$SOURCE_FOLDERS" --compression "$COMPRESSION" --encryption "$preflight_encryption" --archive-engine "$ARCHIVE_ENGINE" --mode "$effective_backup_mode" "${link_dest_args[@]}" "${preflight_ignore_args[@]}" --run-id "$run_id" 2>>"$CURRENT_RUN_DETAILED_LOG") || preflight_exit_code=$?
+        log_message_detailed "[INFO] Preflight: ${preflight_output:-no estimate}"
+        if [[ "$preflight_exit_code" -eq 3 ]] && [[ "$LOW_SPACE_ACTION" == "warn" ]]; then
+            log_message_detailed "[WARNING] Destination may run out of space. Continuing (LOW_SPACE_ACTION=warn)."
+        elif [[ "$preflight_exit_code" -eq 3 ]]; then
+            local preflight_status="failed_insufficient_space"; if [[ "$LOW_SPACE_ACTION" == "defer" ]]; then preflight_status="deferred_insufficient_space"; fi
+            log_message_detailed "[ERROR] Not enough free space on '$DESTINATION_DIRECTORY'. Status: $preflight_status. Nothing was written."
+            email_body+="Overall Status: $preflight_status\nPreflight: $preflight_output\n\nDetailed log: $CURRENT_RUN_DETAILED_LOG"
+            log_run_summary "$run_id" "$JOB_NAME" "$start_time_iso" "$(date --iso-8601=seconds)" "$preflight_status" "0" "$SOURCE_FOLDERS" "$DESTINATION_DIRECTORY" "${run_id}.log" "Preflight: $preflight_output"
+            send_email "$EMAIL_SUBJECT_PREFIX Job '$JOB_NAME' Not Run - Status: $preflight_status" "$email_body" || true
+            run_engine storage-sample "$DESTINATION_DIRECTORY" >> "$CURRENT_RUN_DETAILED_LOG" 2>&1 || true
+            CURRENT_RUN_DETAILED_LOG=""
+            # A deferred run is left for the next scheduled slot rather than reported as a failure
+            if [[ "$preflight_status" == deferred* ]]; then return 0; else return 1; fi
+        elif [[ "$preflight_exit_code" -ne 0 ]]; then
+            log_message_detailed "[WARNING] Preflight check could not run (code: $preflight_exit_code). Continuing without it."
+        fi
+    fi
+
     log_message_detailed "[STEP] Creating local backup artifact..."
     local local_artifact_created=false
 
     if [[ "$COMPRESSION" == "none" ]]; then
         final_backup_artifact_path="$DESTINATION_DIRECTORY/$backup_instance_name_prefix"
-        email_body+="Action: Direct Sync (rsync)\nTarget Dir: $final_backup_artifact_path\n"
+        email_body+="Action: Direct Sync (rsync, $effective_backup_mode)\nTarget Dir: $final_backup_artifact_path\n"
         if ! mkdir -p "$final_backup_artifact_path"; then log_message_detailed "[ERROR] Failed to create subdir '$final_backup_artifact_path'."; local_backup_status="failed_mkdir"; else
-            log_message_detailed "[INFO] Performing direct rsync..."
-            log_message_detailed "[CMD] rsync -avh --delete \"${sources_to_process_array[@]}\" \"$final_backup_artifact_path/\""
-            local rsync_log_tmp; rsync_log_tmp=$(mktemp); local rsync_exit_code=1
-            # Pass array correctly to rsync
-            rsync -avh --delete "${sources_to_process_array[@]}" "$final_backup_artifact_path/" > "$rsync_log_tmp" 2>&1 || rsync_exit_code=$?
-            cat "$rsync_log_tmp" >> "$CURRENT_RUN_DETAILED_LOG"; rm "$rsync_log_tmp"
+            local rsync_log_tmp; rsync_log_tmp=$(mktemp); local rsync_exit_code=0
+            if [[ "$ARCHIVE_ENGINE" == "python" ]]; then
+                # Same snapshot as rsync -a --link-dest, but copies are reflinks / in-kernel copies where the filesystem allows
+                log_message_detailed "[INFO] Performing direct sync (backupvault_engine)..."
+                local sync_args=(sync "$final_backup_artifact_path" --sources "$SOURCE_FOLDERS" --exclude "$DESTINATION_DIRECTORY" "${link_dest_args[@]}" "${ignore_args[@]}" "${throttle_args[@]}")
+                log_message_detailed "[CMD] python3 -m backupvault_engine ${sync_args[*]}"
+                run_engine "${sync_args[@]}" > "$rsync_log_tmp" 2>&1 || rsync_exit_code=$?
+                email_body+="$(grep -hE '^INFO: (Synced|Ignore rules|Throttle:)' "$rsync_log_tmp" | cut -c7- | sed 's/$/\\n/' | tr -d '\n')"
+            else
+                log_message_detailed "[INFO] Performing direct rsync..."
+                log_message_detailed "[CMD] rsync -avh --itemize-changes --delete ${link_dest_args[*]} \"${sources_to_process_array[@]}\" \"$final_backup_artifact_path/\""
+                # Pass array correctly to rsync; itemized changes let the sizing step rescan only what changed
+                rsync -avh --itemize-changes --delete "${link_dest_args[@]}" "${sources_to_process_array[@]}" "$final_backup_artifact_path/" > "$rsync_log_tmp" 2>&1 || rsync_exit_code=$?
+            fi
+            cat "$rsync_log_tmp" >> "$CURRENT_RUN_DETAILED_LOG"
             if [[ "$rsync_exit_code" -eq 0 ]]; then
-                local_backup_status="success"; log_message_detailed "[INFO] rsync completed."
+                local_backup_status="success"; log_message_detailed "[INFO] Direct sync completed."
                 local_artifact_created=true
-                if [[ -d "$final_backup_artifact_path" ]]; then backup_size_bytes=$(du -sb "$final_backup_artifact_path" | cut -f1); fi
+                if [[ -d "$final_backup_artifact_path" ]]; then
+                    if ! backup_size_bytes=$(run_engine treesize "$final_backup_artifact_path" --rsync-log "$rsync_log_tmp" "${link_dest_args[@]}" 2>>"$CURRENT_RUN_DETAILED_LOG"); then
+                        log_message_detailed "[WARNING] Parallel sizing failed. Falling back to 'du -sb'."
+                        backup_size_bytes=$(du -sb "$final_backup_artifact_path" | cut -f1)
+                    fi
+                    # A hardlink snapshot only costs what is not shared with the one it linked against
+                    local snapshot_new_bytes=""
+                    if [[ -n "$link_dest_snapshot" ]] && snapshot_new_bytes=$(run_engine reclaimable "$final_backup_artifact_path" 2>>"$CURRENT_RUN_DETAILED_LOG"); then
+                        log_message_detailed "[INFO] Snapshot tree: $backup_size_bytes bytes, new on disk: $snapshot_new_bytes bytes."
+                        backup_size_bytes="$snapshot_new_bytes"
+                    fi
+                fi
+                rm "$rsync_log_tmp"
             else
-                log_message_detailed "[ERROR] rsync failed. Exit code: $rsync_exit_code."; local_backup_status="failed_rsync"
+                rm "$rsync_log_tmp"
+                log_message_detailed "[ERROR] Direct sync failed. Exit code: $rsync_exit_code."; local_backup_status="failed_rsync"
             fi
         fi
-    else # tar.gz or zip
+    elif [[ "$COMPRESSION" == "repo" ]]; then
+        # Deduplicating repository: only chunks the repository does not have yet are written
+        local repo_path="$DESTINATION_DIRECTORY/backupvault-repo"
+        final_backup_artifact_path="$repo_path/snapshots/${backup_instance_name_prefix}.snapshot"
+        email_body+="Action: Repository snapshot\nSnapshot: $final_backup_artifact_path\n"
+        if [[ "$ENCRYPTION" == "gpg" ]]; then log_message_detailed "[WARNING] Repository chunks are not GPG encrypted."; fi
+        local repo_args=(repo backup "$repo_path" --name "$backup_instance_name_prefix" --job "$JOB_NAME" --sources "$SOURCE_FOLDERS" --exclude "$DESTINATION_DIRECTORY" --workers "${COMPRESSION_THREADS:-0}" --bloom-fp-rate "${REPO_BLOOM_FP_RATE:-0.01}" --bloom-memory-mb "${REPO_BLOOM_MEMORY_MB:-256}" "${ignore_args[@]}" "${throttle_args[@]}")
+        log_message_detailed "[CMD] python3 -m backupvault_engine ${repo_args[*]}"
+        local repo_log_tmp; repo_log_tmp=$(mktemp); local repo_exit_code=0
+        run_engine "${repo_args[@]}" > "$repo_log_tmp" 2>&1 || repo_exit_code=$?
+        cat "$repo_log_tmp" >> "$CURRENT_RUN_DETAILED_LOG"
+        if [[ "$repo_exit_code" -eq 0 ]] && [[ -f "$final_backup_artifact_path" ]]; then
+            local_backup_status="success"; local_artifact_created=true
+            # The run's cost is what it added to the repository
+            backup_size_bytes=$(grep -o '[0-9]* bytes stored' "$repo_log_tmp" | tail -n 1 | cut -d' ' -f1); backup_size_bytes="${backup_size_bytes:-0}"
+            email_body+="$(grep -hE '^INFO: (Chunk index|Ignore rules|Sparse files|Compression|Throttle:)' "$repo_log_tmp" | cut -c7-)\n"
+        else
+            log_message_detailed "[ERROR] Repository backup failed. Exit code: $repo_exit_code."; local_backup_status="failed_repo"; final_backup_artifact_path=""
+        fi
+        rm "$repo_log_tmp"
+    else # tar.gz, tar.zst, tar.lz4 or zip
         local archive_filename_unencrypted=""; local comp_tool=""
-        if [[ "$COMPRESSION" == "tar.gz" ]]; then archive_filename_unencrypted="${backup_instance_name_prefix}.tar.gz"; comp_tool="tar";
-        elif [[ "$COMPRESSION" == "zip" ]]; then archive_filename_unencrypted="${backup_instance_name_prefix}.zip"; comp_tool="zip"; fi
+        if [[ "$COMPRESSION" == tar.* ]]; then archive_filename_unencrypted="${backup_instance_name_prefix}${backup_mode_infix}.${COMPRESSION}"; comp_tool="tar";
+        elif [[ "$COMPRESSION" == "zip" ]]; then archive_filename_unencrypted="${backup_instance_name_prefix}${backup_mode_infix}.zip"; comp_tool="zip"; fi
         local archive_full_path_unencrypted="$DESTINATION_DIRECTORY/$archive_filename_unencrypted"
         final_backup_artifact_path="$archive_full_path_unencrypted" 
-        email_body+="Action: Archive ($COMPRESSION)\nTarget File: $archive_full_path_unencrypted\n"
+        email_body+="Action: Archive ($COMPRESSION, $effective_backup_mode)\nTarget File: $archive_full_path_unencrypted\n"
         log_message_detailed "[INFO] Creating archive: $archive_full_path_unencrypted"
 
-        local archive_command_ok=false; local archive_exit_code=1; local tool_log_tmp; tool_log_tmp=$(mktemp)
+        local archive_command_ok=false; local archive_exit_code=0; local tool_log_tmp; tool_log_tmp=$(mktemp)
+        local archive_output_path="$archive_full_path_unencrypted"; local encrypted_in_stream=false
 
-        if [[ "$comp_tool" == "tar" ]]; then
-             log_message_detailed "[CMD] tar -czvf \"$archive_full_path_unencrypted\" --exclude=\"$(basename "$DESTINATION_DIRECTORY")\" \"${sources_to_process_array[@]}\""
-             tar -czvf "$archive_full_path_unencrypted" --exclude="$(basename "$DESTINATION_DIRECTORY")" "${sources_to_process_array[@]}" > "$tool_log_tmp" 2>&1 || archive_exit_code=$?
+        if [[ "$ARCHIVE_ENGINE" == "python" ]]; then
+            # Single pass: walk -> tar/zip -> compress -> gpg -> file; no plaintext copy lands on the destination
+            local engine_args=(archive --format "$COMPRESSION" --sources "$SOURCE_FOLDERS" --exclude "$DESTINATION_DIRECTORY" --threads "${COMPRESSION_THREADS:-0}"
+                         --mode "$effective_backup_mode" --job "$JOB_NAME" --run-id "$run_id" "${ignore_args[@]}" "${throttle_args[@]}")
+            if [[ -n "$COMPRESSION_LEVEL" ]]; then engine_args+=(--level "$COMPRESSION_LEVEL"); fi
+            if [[ "$ZSTD_LONG" == "yes" ]]; then engine_args+=(--long); fi
+            if [[ "$ENCRYPTION" == "gpg" ]] && [[ -n "$GPG_RECIPIENT" ]] && command -v gpg &> /dev/null; then
+                archive_output_path="${archive_full_path_unencrypted}.gpg"; encrypted_in_stream=true
+                engine_args+=(--gpg-recipient "$GPG_RECIPIENT")
+            fi
+            if [[ "${ARCHIVE_SHARDS:-1}" -gt 1 ]]; then
+                # N archives written in parallel into one JOB-STAMP.FORMAT[.gpg].shards directory
+                archive_output_path+=".shards"; engine_args+=(--shards "$ARCHIVE_SHARDS")
+            fi
+            log_message_detailed "[CMD] python3 -m backupvault_engine ${engine_args[*]} \"$archive_output_path\""
+            run_engine "${engine_args[@]}" "$archive_output_path" > "$tool_log_tmp" 2>&1 || archive_exit_code=$?
+            email_body+="$(grep -hE '^INFO: (Ignore rules|Sparse files|Compression|Throttle:)' "$tool_log_tmp" | cut -c7- | sed 's/$/\\n/' | tr -d '\n')"
+            if [[ -d "$archive_output_path" ]]; then email_body+="$(grep -h '^INFO: Shard ' "$tool_log_tmp" | cut -c7-)\n"; fi
+        elif [[ "$comp_tool" == "tar" ]]; then
+             local tar_compress_args=(-z)
+             if [[ "$COMPRESSION" == "tar.zst" ]]; then
+                 local zstd_cmd="zstd -q -T${COMPRESSION_THREADS:-0} -${COMPRESSION_LEVEL:-3}"; if [[ "$ZSTD_LONG" == "yes" ]]; then zstd_cmd+=" --long=27"; fi
+                 tar_compress_args=(-I "$zstd_cmd")
+             elif [[ "$COMPRESSION" == "tar.lz4" ]]; then tar_compress_args=(-I "lz4 -q -${COMPRESSION_LEVEL:-1}"); fi
+             log_message_detailed "[CMD] tar -cvf \"$archive_full_path_unencrypted\" ${tar_compress_args[*]} --exclude=\"$(basename "$DESTINATION_DIRECTORY")\" \"${sources_to_process_array[@]}\""
+             tar -cvf "$archive_full_path_unencrypted" "${tar_compress_args[@]}" --exclude="$(basename "$DESTINATION_DIRECTORY")" "${sources_to_process_array[@]}" > "$tool_log_tmp" 2>&1 || archive_exit_code=$?
         elif [[ "$comp_tool" == "zip" ]]; then
             if ! command -v zip &> /dev/null; then log_message_detailed "[ERROR] 'zip' missing."; local_backup_status="failed_zip_missing"; else
                  log_message_detailed "[CMD] zip -r \"$archive_full_path_unencrypted\" \"${sources_to_process_array[@]}\" -x \"$DESTINATION_DIRECTORY/*\""
@@ -213,19 +363,25 @@ perform_backup() {
         fi
         cat "$tool_log_tmp" >> "$CURRENT_RUN_DETAILED_LOG"; rm "$tool_log_tmp"
 
+        if [[ "$ARCHIVE_ENGINE" == "python" ]]; then comp_tool="backupvault_engine"; fi
         if [[ "$local_backup_status" != "failed_zip_missing" ]]; then
-            if [[ "$archive_exit_code" -eq 0 ]] && [[ -f "$archive_full_path_unencrypted" ]]; then
-                if [[ -s "$archive_full_path_unencrypted" ]]; then archive_command_ok=true;
-                else log_message_detailed "[ERROR] $comp_tool succeeded but created EMPTY archive."; rm "$archive_full_path_unencrypted" 2>/dev/null || true; fi
+            if [[ "$archive_exit_code" -eq 0 ]] && [[ -d "$archive_output_path" ]]; then archive_command_ok=true # sharded: the engine only renames a complete set into place
+            elif [[ "$archive_exit_code" -eq 0 ]] && [[ -f "$archive_output_path" ]]; then
+                if [[ -s "$archive_output_path" ]]; then archive_command_ok=true;
+                else log_message_detailed "[ERROR] $comp_tool succeeded but created EMPTY archive."; rm "$archive_output_path" 2>/dev/null || true; fi
             else log_message_detailed "[ERROR] $comp_tool failed (code: $archive_exit_code) OR file not created."; fi
         fi
 
         if [[ "$archive_command_ok" = true ]]; then
             log_message_detailed "[INFO] Archiving successful."
-            local_backup_status="success_unencrypted"; backup_size_bytes=$(stat -c%s "$archive_full_path_unencrypted"); local_artifact_created=true
+            local_backup_status="success_unencrypted"; local_artifact_created=true
+            if [[ -d "$archive_output_path" ]]; then backup_size_bytes=$(du -sb "$archive_output_path" | cut -f1); else backup_size_bytes=$(stat -c%s "$archive_output_path"); fi
             # --- Encryption Step ---
             # (Encryption logic as before, ensure it updates local_backup_status, final_backup_artifact_path correctly)
-            if [[ "$ENCRYPTION" == "gpg" ]] && [[ -n "$GPG_RECIPIENT" ]]; then
+            if [[ "$encrypted_in_stream" = true ]]; then
+                log_message_detailed "[INFO] Encrypted in the archive stream for '$GPG_RECIPIENT'."; email_body+="Encryption: GPG for '$GPG_RECIPIENT'\n"
+                final_backup_artifact_path="$archive_output_path"; local_backup_status="success"
+            elif [[ "$ENCRYPTION" == "gpg" ]] && [[ -n "$GPG_RECIPIENT" ]]; then
                 # ... (GPG logic - same as previous version which was fairly robust) ...
                 log_message_detailed "[STEP] Encrypting..."; email_body+="Encryption: GPG for '$GPG_RECIPIENT'\n"
                 if ! command -v gpg &> /dev/null; then log_message_detailed "[ERROR] gpg missing."; local_backup_status="success_unencrypted_gpg_missing"; else
@@ -257,7 +413,14 @@ perform_backup() {
     cloud_summary="N/A"
     if [[ "$local_backup_status" == success* ]] && [[ -e "$final_backup_artifact_path" ]]; then
         log_message_detailed "[STEP] Processing cloud upload..."
-        if upload_to_cloud_rclone "$final_backup_artifact_path"; then cloud_upload_status_code=0; else cloud_upload_status_code=$?; fi 
+        if [[ "$COMPRESSION" == "repo" ]]; then
+            # The whole repository is copied (rclone skips packs the remote has); it is never moved away.
+            # Each pack is one object; the local chunk index is left out, it is rebuilt from the packs.
+            if DELETE_LOCAL_AFTER_UPLOAD="no" upload_to_cloud_rclone "$repo_path" --exclude "/index/**"; then cloud_upload_status_code=0; else cloud_upload_status_code=$?; fi
+        elif [[ -d "$final_backup_artifact_path" ]] && [[ "$COMPRESSION" != "none" ]]; then
+            # Sharded archive: the shards go up in parallel, one transfer each
+            if upload_to_cloud_rclone "$final_backup_artifact_path" --transfers "$ARCHIVE_SHARDS"; then cloud_upload_status_code=0; else cloud_upload_status_code=$?; fi
+        elif upload_to_cloud_rclone "$final_backup_artifact_path"; then cloud_upload_status_code=0; else cloud_upload_status_code=$?; fi 
         if [[ "$cloud_upload_status_code" -eq 0 ]]; then cloud_summary="OK"; email_body+="Cloud Upload: SUCCESSFUL\n"
         elif [[ "$cloud_upload_status_code" -eq 1 ]]; then cloud_summary="FAIL"; email_body+="Cloud Upload: FAILED\n"
         else cloud_summary="SKIPPED"; email_body+="Cloud Upload: SKIPPED (config)\n"; fi
@@ -275,6 +438,10 @@ perform_backup() {
     log_message_detailed "[INFO] Cloud Status: $cloud_summary (Code: $cloud_upload_status_code)"; log_message_detailed "[INFO] Run Finished: $end_time_iso"; log_message_detailed "[INFO] =============================="
     log_run_summary "$run_id" "$JOB_NAME" "$start_time_iso" "$end_time_iso" "$overall_status" "$backup_size_bytes" "$SOURCE_FOLDERS" "$(dirname "${final_backup_artifact_path:-$DESTINATION_DIRECTORY}")" "${run_id}.log" "$final_summary_message"
     send_email "$EMAIL_SUBJECT_PREFIX Job '$JOB_NAME' Finished - Status: $overall_status" "$email_body"
+    if [[ -n "$final_backup_artifact_path" ]] && [[ -e "$final_backup_artifact_path" ]]; then
+        run_engine inventory update "$DESTINATION_DIRECTORY" --name "$(basename "$final_backup_artifact_path")" >> "$CURRENT_RUN_DETAILED_LOG" 2>&1 || log_message_detailed "[WARNING] Could not update artifact inventory."
+    fi
+    run_engine storage-sample "$DESTINATION_DIRECTORY" >> "$CURRENT_RUN_DETAILED_LOG" 2>&1 || log_message_detailed "[WARNING] Could not record storage usage sample."
     log_message_detailed "[STEP] Processing local retention policy..."; cleanup_old_local_backups "$DESTINATION_DIRECTORY" "$RETENTION_DAYS" "$JOB_NAME" || log_message_detailed "[WARNING] Cleanup reported an error."
     CURRENT_RUN_DETAILED_LOG=""; log_message_detailed "[INFO] Backup process finished."
     if [[ "$overall_status" == success* ]]; then return 0; else return 1; fi 
@@ -290,7 +457,7 @@ main() {
     for cmd in "${essential_cmds[@]}"; do if ! command -v "$cmd" &> /dev/null; then local e="[FATAL] '$cmd' missing."; echo "$e" >&2; cmd_missing=1; if [[ "$cmd" != "zenity" ]] && command -v zenity &>/dev/null; then zenity --error --title="Missing" --text="<span color='red'>Fatal:</span> '$cmd' missing." || true; fi; fi; done
     if [[ "$cmd_missing" -eq 1 ]]; then exit 1; fi
     if [[ -z "$CURRENT_RUN_DETAILED_LOG" ]]; then CURRENT_RUN_DETAILED_LOG="$LOG_DIR_BASE/backupvault_script_operations.log"; fi
-    case "$1" in config|wizard) log_message_detailed "[INFO] Cmd: '$1'. Start GUI."; run_wizard ;; run) log_message_detailed "[INFO] Cmd: 'run'. Start backup."; perform_backup ;; schedule) log_message_detailed "[INFO] Cmd: 'schedule'."; schedule_backup ;; ""|--help|-h) echo "BackupVault Usage: $0 [cmd]"; echo "config | run | schedule | --help"; if [[ -z "$1" ]]; then log_message_detailed "[INFO] No cmd. Start GUI."; run_wizard; fi ;; *) log_message_detailed "[ERROR] Unknown cmd: '$1'."; echo "Error: Unknown cmd '$1'." >&2; exit 1 ;; esac
+    case "$1" in config|wizard) log_message_detailed "[INFO] Cmd: '$1'. Start GUI."; run_wizard ;; run) log_message_detailed "[INFO] Cmd: 'run'. Start backup."; perform_backup ;; schedule) log_message_detailed "[INFO] Cmd: 'schedule'."; schedule_backup ;; restore) log_message_detailed "[INFO] Cmd: 'restore'."; restore_backup "${@:2}" ;; ""|--help|-h) echo "BackupVault Usage: $0 [cmd]"; echo "config | run | schedule | restore ARTIFACT TARGET_DIR [MEMBER...] | --help"; if [[ -z "$1" ]]; then log_message_detailed "[INFO] No cmd. Start GUI."; run_wizard; fi ;; *) log_message_detailed "[ERROR] Unknown cmd: '$1'."; echo "Error: Unknown cmd '$1'." >&2; exit 1 ;; esac
     local ec=$?; if [[ "$ec" -eq 0 ]]; then log_message_detailed "[INFO] Script cmd OK (Exit $ec)."; else log_message_detailed "[ERROR] Script cmd FAIL (Exit $ec)."; fi; exit $ec
 }
 
@@ -0,0 +1,7 @@
+# backupvault_engine/__init__.py
+# Python side of the local backup tooling, shared by backupvault.sh (python3 -m backupvault_engine ...)
+# and the web dashboard.
+import os
+
+APP_DIR_BASE = os.path.join(os.path.expanduser("~"), ".backupvault")
+CACHE_DIR = os.path.join(APP_DIR_BASE, "cache")
@@ -0,0 +1,319 @@
+# backupvault_engine/__main__.py
+# Command line entry point used by backupvault.sh:  python3 -m backupvault_engine <command> ...
+import argparse
+import json
+import os
+import sys
+
+from backupvault_engine import (archive, benchmark, chunkindex, ignore, inventory, localcopy, manifest, preflight, readahead,
+                                repository, restore, shards, storage_history, throttle, treesize)
+
+EXIT_INSUFFICIENT_SPACE = 3
+EXIT_PARTIAL_TRANSFER = 23 # rsync's code for "some files were not transferred"
+
+def cmd_inventory(args):
+    inv = inventory.get_inventory(args.destination, refresh=False)
+    if args.action == "refresh":
+        inv.refresh(force=args.force)
+        print(f"INFO: {len(inv.artifacts)} artifacts in {inv.destination} ({inv.total_bytes()} bytes)")
+        return 0
+    if args.action == "update":
+        if not args.name: print("ERROR: 'inventory update' needs --name", file=sys.stderr); return 2
+        inv.update_artifact(args.name); return 0
+    inv.refresh()
+    records = inv.list(args.job, args.older_than_days, args.type)
+    if args.format == "json": print(json.dumps(records, indent=2))
+    elif args.format == "paths": sys.stdout.write("".join(f"{r['path']}\n" for r in records))
+    else:
+        for r in records: print(f"{r['name']}\t{r['type']}\t{r['size_bytes']}\t{r['mtime']}")
+    return 0
+
+def cmd_storage_sample(args):
+    sample = storage_history.get_history(args.destination).record()
+    print(f"INFO: Storage sample for {args.destination}: {sample['used']} used, {sample['free']} free of {sample['total']} bytes")
+    return 0
+
+def cmd_treesize(args):
+    changed = None
+    if args.rsync_log:
+        with open(args.rsync_log, "r", encoding="utf-8", errors="surrogateescape") as f:
+            changed = treesize.parse_rsync_changes(f)
+    print(treesize.measure(args.root, changed=changed, workers=args.workers, persist=not args.no_cache,
+                           link_dest=args.link_dest))
+    return 0
+
+def cmd_reclaimable(args):
+    print(treesize.reclaimable_bytes(args.paths))
+    return 0
+
+def cmd_preflight(args):
+    sources = [s for s in args.sources.split(":") if s]
+    result = preflight.check(args.destination, args.job, sources, args.compression, args.encryption,
+                             args.run_id, args.archive_engine, args.mode, args.link_dest, _ignore_rules(args))
+    if args.format == "json": print(json.dumps(result, indent=2))
+    else:
+        mib = lambda n: f"{n / 1024**2:.1f} MiB"
+        print(f"{'OK' if result['fits'] else 'INSUFFICIENT_SPACE'}: need {mib(result['required_bytes'])} "
+              f"(artifact ~{mib(result['artifact_bytes'])}, peak {mib(result['peak_bytes'])}, {result['kind']} {result['mode']}, "
+              f"ratio {result['ratio']:.2f} by {result['method']}, sources {mib(result['source_bytes'])}), "
+              f"free {mib(result['free_bytes'])} on {args.destination}")
+    return 0 if result["fits"] else EXIT_INSUFFICIENT_SPACE
+
+def cmd_backup_mode(args):
+    sources = [s for s in args.sources.split(":") if s]
+    print(manifest.JobManifest.load(args.job).effective_mode(args.mode, sources))
+    return 0
+
+def _print_sparse(stats):
+    if stats["sparse_files"]: print(f"INFO: Sparse files: {stats['sparse_files']}, {stats['hole_bytes']} bytes of holes not read")
+
+def _print_compression(stats, fmt=None):
+    # CPU saved: what the raw bytes would have cost at the rate the compressed ones did
+    raw = stats.get("bytes_raw", 0); compressed = stats.get("bytes_compressed", 0); cpu = stats.get("compress_cpu_seconds", 0)
+    if not raw and not compressed: return
+    if fmt in ("tar.zst", "tar.lz4"): # compressed all the same, so nothing was saved; no CPU time from zstd threads or CLIs
+        print(f"INFO: Compression: {raw} bytes incompressible and {compressed} bytes compressible, all through "
+              f"{'zstd' if fmt == 'tar.zst' else 'lz4'}"
+              + (f" in {cpu:.2f}s CPU" if cpu else "")); return
+    saved = raw * cpu / compressed if compressed else 0
+    print(f"INFO: Compression: {raw} bytes left uncompressed, {compressed} bytes compressed in {cpu:.2f}s CPU, ~{saved:.2f}s CPU saved")
+
+def _throttle(args):
+    # Priorities first, while this is the only thread; then the process-wide limits
+    control = args.throttle_control and os.path.basename(args.throttle_control)
+    job = getattr(args, "job", None) or (control[:-len(".limits")] if control and control.endswith(".limits") else None)
+    throttle.set_priority(args.nice, args.ionice, args.cpu_weight, args.io_weight, job)
+    return throttle.install(throttle.Throttle(args.read_mbps, args.write_mbps, args.iops, args.throttle_control))
+
+def _print_throttle():
+    if throttle.current(): print(f"INFO: Throttle: {throttle.current().summary()}")
+
+def _ignore_rules(args):
+    return ignore.Rules.load(args.ignore_file, args.larger_than_mb * 1024 * 1024 if args.larger_than_mb else None,
+                             args.older_than_days)
+
+def cmd_archive(args):
+    sources = [s for s in args.sources.split(":") if s]
+    rules = _ignore_rules(args); _throttle(args)
+    if args.shards > 1: return _archive_sharded(args, sources, rules)
+    job_manifest = manifest.JobManifest.load(args.job) if args.job else None
+    baseline = job_manifest.baseline(args.mode, sources) if job_manifest else None
+    if args.mode != "full" and baseline is None:
+        print(f"ERROR: No {args.mode} baseline for job '{args.job}'; run a full backup first", file=sys.stderr); return 1
+    selection = manifest.Selection(baseline)
+    try: stats = archive.create_archive(args.output, args.format, sources, args.exclude, args.gpg_recipient, args.threads,
+                                        args.level, args.long, selection, args.readahead, rules)
+    except Exception as e:
+        print(f"ERROR: Archive pipeline failed: {e}", file=sys.stderr); return 1
+    if job_manifest:
+        try: job_manifest.record(args.run_id, os.path.basename(args.output), args.mode, sources, selection.entries)
+        except OSError as e: print(f"Warning: Could not save the backup manifest for '{args.job}': {e}")
+    print(f"INFO: Wrote {args.output}: {stats['files']} entries, {stats['bytes_in']} bytes in, "
+          f"{stats['bytes_out']} bytes out in {stats['seconds']}s")
+    print(f"INFO: Read-ahead: {stats['file_latency_ms']} ms per file, up to {stats['readahead_window']} files in flight")
+    _print_sparse(stats); _print_compression(stats, args.format); _print_throttle()
+    if rules: print(f"INFO: Ignore rules: {rules.summary()}")
+    if args.mode != "full":
+        print(f"INFO: {args.mode.capitalize()} against {baseline['artifact']}: {selection.changed} changed, "
+              f"{selection.unchanged} unchanged, {stats['deleted']} deleted")
+    return 0
+
+def _archive_sharded(args, sources, rules):
+    if args.mode != "full":
+        print("ERROR: Sharded archives are full backups only (--mode full)", file=sys.stderr); return 2
+    try: stats = shards.create_sharded(args.output, args.format, sources, args.shards, args.exclude, args.gpg_recipient,
+                                       args.threads, args.level, args.long, args.readahead, rules)
+    except Exception as e:
+        print(f"ERROR: Sharded archive failed: {e}", file=sys.stderr); return 1
+    print(f"INFO: Wrote {args.output}: {stats['files']} entries, {stats['bytes_in']} bytes in, "
+          f"{stats['bytes_out']} bytes out in {stats['seconds']}s")
+    for k, shard in enumerate(stats["shards"]):
+        print(f"INFO: Shard {k + 1}/{args.shards}: {shard['files']} entries, {shard['bytes_in']} bytes in, "
+              f"{shard['bytes_out']} bytes out in {shard['seconds']}s")
+    _print_sparse(stats); _print_compression(stats, args.format); _print_throttle()
+    if rules: print(f"INFO: Ignore rules: {rules.summary()}")
+    return 0
+
+def cmd_repo(args):
+    if args.action == "snapshots":
+        repo = repository.Repository.open(args.repository)
+        for name in repo.snapshot_names(args.job): print(repo.snapshot_path(name))
+        return 0
+    if not (args.name and args.job and args.sources):
+        print("ERROR: 'repo backup' needs --name, --job and --sources", file=sys.stderr); return 2
+    sources = [s for s in args.sources.split(":") if s]
+    if not 0 < args.bloom_fp_rate < 1:
+        print("ERROR: --bloom-fp-rate must be between 0 and 1", file=sys.stderr); return 2
+    rules = _ignore_rules(args); _throttle(args)
+    try: stats = repository.backup(args.repository, args.name, args.job, sources, args.exclude, args.workers,
+                                   args.bloom_fp_rate, args.bloom_memory_mb * 1024 * 1024, rules)
+    except Exception as e:
+        print(f"ERROR: Repository backup failed: {e}", file=sys.stderr); return 1
+    print(f"INFO: Snapshot {args.name}: {stats['files']} files ({stats['files_unchanged']} unchanged since "
+          f"{stats['parent'] or 'no parent'}), {stats['bytes_in']} bytes read, {stats['chunks_new']} new chunks, "
+          f"{stats['chunks_deduplicated']} deduplicated, {stats['bytes_new']} bytes new, "
+          f"{stats['bytes_stored']} bytes stored in {stats['seconds']}s")
+    print(f"INFO: Chunk index: {stats['index_hits']} hits, {stats['index_misses']} misses "
+          f"({stats['bloom_negatives']} answered by the Bloom filter, {stats['bloom_false_positives']} false positives), "
+          f"Bloom filter {stats['bloom_bytes']} bytes at ~{stats['bloom_fp_rate']:.4%} false positives")
+    _print_sparse(stats); _print_compression(stats); _print_throttle()
+    if rules: print(f"INFO: Ignore rules: {rules.summary()}")
+    return 0
+
+def cmd_sync(args):
+    sources = [s for s in args.sources.split(":") if s]; rules = _ignore_rules(args)
+    if args.link_dest and not os.path.isdir(args.link_dest):
+        print(f"ERROR: --link-dest {args.link_dest} is not a directory", file=sys.stderr); return 2
+    _throttle(args)
+    try: stats = localcopy.sync_tree(sources, args.dest, args.link_dest, args.exclude, rules)
+    except Exception as e:
+        print(f"ERROR: Sync failed: {e}", file=sys.stderr); return 1
+    print(f"INFO: Synced {args.dest}: {stats['files']} files copied ({stats['bytes']} bytes; {stats['reflink']} reflinked, "
+          f"{stats['copy_file_range']} copied in the kernel, {stats['userspace']} through userspace), "
+          f"{stats['hardlinked']} unchanged files ({stats['bytes_hardlinked']} bytes) hardlinked"
+          + (f", {stats['skipped']} entries skipped" if stats["skipped"] else ""))
+    _print_throttle()
+    if rules: print(f"INFO: Ignore rules: {rules.summary()}")
+    if stats["skipped"]:
+        print(f"ERROR: {stats['skipped']} entries could not be copied completely; see the warnings above", file=sys.stderr)
+        return EXIT_PARTIAL_TRANSFER
+    return 0
+
+def cmd_restore(args):
+    try: count = restore.restore(args.artifact, args.target, args.member)
+    except Exception as e:
+        print(f"ERROR: Restore failed: {e}", file=sys.stderr); return 1
+    print(f"INFO: Restored {count} entries from {args.artifact} into {args.target}")
+    return 0
+
+def _add_ignore_arguments(p):
+    p.add_argument("--ignore-file", help="the job's .backupignore (gitignore syntax, relative to each source folder)")
+    p.add_argument("--larger-than-mb", type=int, help="skip files larger than this")
+    p.add_argument("--older-than-days", type=int, help="skip files not modified for this many days")
+
+def _add_throttle_arguments(p):
+    p.add_argument("--read-mbps", type=float, help="cap on source reads, MiB/s")
+    p.add_argument("--write-mbps", type=float, help="cap on artifact / repository writes, MiB/s")
+    p.add_argument("--iops", type=float, help="cap on read and write operations per second")
+    p.add_argument("--throttle-control", help="file whose READ_MBPS= / WRITE_MBPS= / IOPS= lines change the caps during the run")
+    p.add_argument("--nice", type=int, help="CPU niceness of the run (and gpg)")
+    p.add_argument("--ionice", choices=sorted(throttle.IONICE_CLASSES), help="I/O scheduling class of the run")
+    p.add_argument("--cpu-weight", type=int, help="cgroup v2 cpu.weight (1-10000, 100 = as everything else)")
+    p.add_argument("--io-weight", type=int, help="cgroup v2 io.weight (1-10000, 100 = as everything else)")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="backupvault_engine", description="BackupVault engine helpers")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("inventory", help="list or refresh the artifact inventory of a destination")
+    p.add_argument("action", choices=["list", "refresh", "update"])
+    p.add_argument("destination")
+    p.add_argument("--job", help="only artifacts of this JOB_NAME")
+    p.add_argument("--name", help="artifact name for 'update'")
+    p.add_argument("--older-than-days", type=float, help="only artifacts whose mtime is older than this")
+    p.add_argument("--type", help="only artifacts of this type (e.g. rsync, tar.zst.gpg)")
+    p.add_argument("--format", choices=["tsv", "json", "paths"], default="tsv")
+    p.add_argument("--force", action="store_true", help="ignore the persisted inventory and rescan")
+    p.set_defaults(func=cmd_inventory)
+
+    p = sub.add_parser("storage-sample", help="record one usage sample for the destination volume")
+    p.add_argument("destination")
+    p.set_defaults(func=cmd_storage_sample)
+
+    p = sub.add_parser("treesize", help="print the size of a tree in bytes (du -sb semantics)")
+    p.add_argument("root")
+    p.add_argument("--rsync-log", help="rsync --itemize-changes output; only the changed subtrees are rescanned")
+    p.add_argument("--link-dest", help="snapshot ROOT was hardlinked against; its index seeds ROOT's")
+    p.add_argument("--workers", type=int, default=treesize.DEFAULT_WORKERS)
+    p.add_argument("--no-cache", action="store_true", help="do not read or write the per-directory index")
+    p.set_defaults(func=cmd_treesize)
+
+    p = sub.add_parser("reclaimable", help="print the bytes deleting these artifacts would free (hardlink aware)")
+    p.add_argument("paths", nargs="+")
+    p.set_defaults(func=cmd_reclaimable)
+
+    p = sub.add_parser("preflight", help="estimate the next artifact and check it fits on the destination")
+    p.add_argument("destination")
+    p.add_argument("--job", required=True)
+    p.add_argument("--sources", required=True, help="SOURCE_FOLDERS, colon separated")
+    p.add_argument("--compression", default="tar.gz")
+    p.add_argument("--encryption", default="none")
+    p.add_argument("--run-id", help="record this run's source size for later estimates")
+    p.add_argument("--archive-engine", choices=["python", "legacy"], default="python")
+    p.add_argument("--mode", choices=manifest.MODES, default="full", help="BACKUP_MODE the run will use")
+    p.add_argument("--link-dest", help="snapshot an rsync-mode run hardlinks unchanged files to")
+    p.add_argument("--format", choices=["text", "json"], default="text")
+    _add_ignore_arguments(p)
+    p.set_defaults(func=cmd_preflight)
+
+    p = sub.add_parser("backup-mode", help="print the mode a run can use (full when there is no usable baseline)")
+    p.add_argument("--job", required=True)
+    p.add_argument("--mode", choices=manifest.MODES, required=True)
+    p.add_argument("--sources", required=True, help="SOURCE_FOLDERS, colon separated")
+    p.set_defaults(func=cmd_backup_mode)
+
+    p = sub.add_parser("archive", help="write a tar.gz/zip artifact (optionally GPG encrypted) in one streaming pass")
+    p.add_argument("output", help="artifact path, including .gpg when --gpg-recipient is given")
+    p.add_argument("--format", choices=archive.FORMATS, default="tar.gz")
+    p.add_argument("--sources", required=True, help="SOURCE_FOLDERS, colon separated")
+    p.add_argument("--exclude", action="append", default=[], help="path to leave out (e.g. the destination)")
+    p.add_argument("--gpg-recipient")
+    p.add_argument("--threads", type=int, default=0, help="compression threads (0 = one per available core)")
+    p.add_argument("--level", type=int, help="compression level (default depends on the format)")
+    p.add_argument("--long", action="store_true", help="zstd long-distance matching (128 MiB window)")
+    p.add_argument("--mode", choices=manifest.MODES, default="full", help="only files changed since the job's baseline")
+    p.add_argument("--job", help="JOB_NAME whose manifest is compared against and updated")
+    p.add_argument("--run-id", help="recorded in the manifest with this run's state")
+    p.add_argument("--readahead", type=int, default=readahead.MAX_WORKERS,
+                   help="most small files opened and read ahead of the writer at once (0 = off; sized from per-file latency)")
+    p.add_argument("--shards", type=int, default=1,
+                   help="write OUTPUT.shards/ as this many size-balanced archives built in parallel (full backups only)")
+    _add_ignore_arguments(p); _add_throttle_arguments(p)
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("repo", help="back up into / list a deduplicating chunk repository")
+    p.add_argument("action", choices=["backup", "snapshots"])
+    p.add_argument("repository", help="repository directory (created on the first backup)")
+    p.add_argument("--name", help="snapshot name, JOB_NAME-YYYYMMDD_HHMMSS")
+    p.add_argument("--job", help="JOB_NAME (for 'snapshots': only this job's)")
+    p.add_argument("--sources", help="SOURCE_FOLDERS, colon separated")
+    p.add_argument("--exclude", action="append", default=[], help="path to leave out (e.g. the destination)")
+    p.add_argument("--workers", type=int, default=0, help="compression threads (0 = one per available core)")
+    p.add_argument("--bloom-fp-rate", type=float, default=chunkindex.BLOOM_FP_RATE, help="target false-positive rate of the chunk index's Bloom filter")
+    p.add_argument("--bloom-memory-mb", type=int, default=chunkindex.BLOOM_MAX_BYTES // (1024 * 1024), help="memory cap of the Bloom filter")
+    _add_ignore_arguments(p); _add_throttle_arguments(p)
+    p.set_defaults(func=cmd_repo)
+
+    p = sub.add_parser("sync", help="copy the sources into a snapshot directory, like rsync -a --link-dest")
+    p.add_argument("dest", help="snapshot directory (created if missing)")
+    p.add_argument("--sources", required=True, help="SOURCE_FOLDERS, colon separated (a trailing / copies the folder's contents)")
+    p.add_argument("--exclude", action="append", default=[], help="path to leave out")
+    p.add_argument("--link-dest", help="previous snapshot: unchanged files are hardlinked to it")
+    _add_ignore_arguments(p); _add_throttle_arguments(p)
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser("restore", help="extract an artifact (any format, encrypted or not) into a directory")
+    p.add_argument("artifact")
+    p.add_argument("target")
+    p.add_argument("--member", action="append", default=[], help="only this path (and what is below it)")
+    p.set_defaults(func=cmd_restore)
+
+    p = sub.add_parser("benchmark", help="measure compressor throughput")
+    p.add_argument("kind", choices=["gzip", "compression", "chunkindex"])
+    p.add_argument("--source", action="append", default=[], help="also benchmark on a tar stream of this tree")
+    p.add_argument("--no-synthetic", action="store_true", help="only benchmark the --source trees")
+    p.add_argument("--size-mib", type=int, default=64)
+    p.add_argument("--workers", help="comma separated worker counts (default: powers of two up to the core count)")
+    p.add_argument("--level", type=int)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--entries", type=int, default=1_000_000, help="chunkindex: ids to insert")
+    p.add_argument("--batch", type=int, default=4096, help="chunkindex: ids per batched lookup")
+    p.add_argument("--dir", help="chunkindex: where to build the index (default: the temp directory)")
+    p.set_defaults(func=benchmark.run)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
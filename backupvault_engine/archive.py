@@ -0,0 +1,339 @@
+# backupvault_engine/archive.py
+# Streaming archive writer for perform_backup: walk -> tar/zip stream -> compressor ->
+# gpg -> file, each stage in its own thread (compressors may use a pool of their own),
+# connected by bounded queues of ~1 MiB chunks. The source data is read once and only
+# the final artifact is written to the destination (no plaintext .tar.gz next to the
+# .gpg), under a .part name that is renamed into place when every stage has finished.
+# The tar/zip stage takes its small files from readahead.py's pool, which opens and reads
+# them ahead of the writer (what bounds the run on NFS/SMB sources is per-file latency).
+# Files with holes (sparse.py) are read extent by extent and go into tar as GNU sparse
+# members; zip has no such member, so their holes are deflated as zeros but never read.
+# Files that are already compressed (compressibility.py) go into the tar stream as
+# RawChunks, which gzip stores instead of deflating, and into zip uncompressed.
+# Source reads and artifact writes go through throttle.py's limits when the run has any.
+import io
+import os
+import posixpath
+import queue
+import shutil
+import stat
+import subprocess
+import tarfile
+import threading
+import time
+import zipfile
+
+from backupvault_engine import compressibility, compressors, manifest, readahead, sparse, throttle
+
+CHUNK_SIZE = 1024 * 1024
+QUEUE_DEPTH = 8          # chunks in flight between two stages
+ZIP_LEVEL = 6            # zip's default
+FORMATS = ("tar.gz", "tar.zst", "tar.lz4", "zip")
+
+class PipelineAborted(Exception):
+    pass
+
+class _Channel:
+    # Bounded hand-off between two stages; every blocking call wakes up when the run is aborted
+    def __init__(self, abort, depth=QUEUE_DEPTH):
+        self._queue = queue.Queue(depth); self._abort = abort
+
+    def put(self, item):
+        while True:
+            if self._abort.is_set(): raise PipelineAborted()
+            try: self._queue.put(item, timeout=0.1); return
+            except queue.Full: pass
+
+    def get(self):
+        while True:
+            if self._abort.is_set(): raise PipelineAborted()
+            try: return self._queue.get(timeout=0.1)
+            except queue.Empty: pass
+
+    def close(self): self.put(None)
+
+    def __iter__(self):
+        while True:
+            chunk = self.get()
+            if chunk is None: return
+            yield chunk
+
+class _ChannelWriter(io.RawIOBase):
+    # File-like sink for tarfile/zipfile that batches their small writes into channel chunks
+    def __init__(self, channel):
+        self._channel = channel; self._buffer = bytearray(); self.bytes_written = 0; self._raw = False
+
+    def writable(self): return True
+
+    def _put(self):
+        data = bytes(self._buffer); self._buffer.clear()
+        self._channel.put(compressibility.RawChunk(data) if self._raw else data)
+
+    def set_raw(self, raw):
+        # What is written from now on is (not) worth compressing; a chunk never holds both.
+        # tarfile's stream keeps up to a record (10 KiB) of its own, so the switch lands
+        # that close to the member boundary, which only matters for the ratio.
+        if raw != self._raw and self._buffer: self._put()
+        self._raw = raw
+
+    def write(self, data):
+        self._buffer += data; self.bytes_written += len(data)
+        if len(self._buffer) >= CHUNK_SIZE: self._put()
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                if self._buffer: self._put()
+                self._channel.close()
+            except PipelineAborted: pass
+        super().close()
+
+def _excluded_ids(exclude):
+    # (st_dev, st_ino) of the excluded paths that exist, resolved once per walk
+    ids = set()
+    for path in exclude:
+        if not path: continue
+        try: st = os.stat(path)
+        except OSError: continue
+        ids.add((st.st_dev, st.st_ino))
+    return ids
+
+def iter_source_entries(sources, exclude=(), rules=None, shard=None):
+    # (path, arcname, lstat) for every entry under the sources, parents before children.
+    # Leading "/" is dropped from member names, as tar and zip do. exclude: paths left
+    # out (and, for directories, not entered), matched by inode against the walk's own
+    # lstat, so wherever they are reached from costs no extra syscall. rules:
+    # ignore.Rules, the same for what it excludes. shard: shards.ShardFilter, the same
+    # for what belongs to other shards.
+    excluded = _excluded_ids(exclude)
+    for source in sources:
+        stack = [(source, "")]
+        while stack:
+            path, rel = stack.pop()
+            if shard is not None and not shard.owns(path): continue
+            try: st = os.lstat(path)
+            except OSError as e: print(f"Warning: Skipping {path}: {e}"); continue
+            if (st.st_dev, st.st_ino) in excluded: continue
+            if rules and rules.excluded(rel, st): continue
+            yield path, path.lstrip("/") or ".", st
+            if stat.S_ISDIR(st.st_mode):
+                try:
+                    with os.scandir(path) as it: children = sorted((entry.path, entry.name) for entry in it)
+                except OSError as e: print(f"Warning: Cannot list {path}: {e}"); continue
+                stack.extend((child, f"{rel}/{name}" if rel else name) for child, name in reversed(children))
+
+def _selected(sources, exclude, selection, stats, readahead_workers, rules, shard, regular_only=False):
+    # The walk, minus what the rules and the selection leave out, with small files prefetched
+    def entries():
+        for path, arcname, st in iter_source_entries(sources, exclude, rules, shard):
+            if regular_only and not (stat.S_ISREG(st.st_mode) or stat.S_ISDIR(st.st_mode) or stat.S_ISLNK(st.st_mode)):
+                print(f"Warning: Skipping special file {path}"); continue
+            if selection.wants(arcname, st): yield path, arcname, st
+    return readahead.prefetch(entries(), readahead_workers, stats=stats)
+
+def _open_sparse(path, st):
+    # -> (file, data extents) for a file with holes, else None (it is archived as usual)
+    if not sparse.might_have_holes(st): return None
+    f = _open_regular(path)
+    extents = sparse.file_extents(f.fileno(), os.fstat(f.fileno()))
+    if extents is None: f.close(); return None
+    return f, extents
+
+def _add_sparse_tar(tar, f, extents, arcname, stats):
+    # GNU sparse format 1.0: a PAX header carries the real name and size, and the member's
+    # data is the extent map (decimal, padded to a block) followed by the extents only.
+    # A file that ends in a hole gets a final empty (size, 0) extent, as GNU tar writes
+    # it: GNU tar sizes the extracted file by the map, not by realsize.
+    info = tar.gettarinfo(arcname=arcname, fileobj=f)
+    if not info.isreg(): tar.addfile(info); return # a hardlink to a member already written
+    entries = list(extents)
+    if not entries or entries[-1][0] + entries[-1][1] < info.size: entries.append((info.size, 0))
+    sparse_map = f"{len(entries)}\n" + "".join(f"{offset}\n{length}\n" for offset, length in entries)
+    sparse_map = sparse_map.encode("ascii"); sparse_map += bytes(-len(sparse_map) % tarfile.BLOCKSIZE)
+    info.pax_headers = {"GNU.sparse.major": "1", "GNU.sparse.minor": "0",
+                        "GNU.sparse.name": info.name, "GNU.sparse.realsize": str(info.size)}
+    info.name = posixpath.join(posixpath.dirname(info.name), "GNUSparseFile.0", posixpath.basename(info.name))
+    info.size = len(sparse_map) + sum(length for _, length in extents)
+    tar.format = tarfile.PAX_FORMAT # for this member's headers only
+    try: tar.addfile(info, io.BufferedReader(sparse.ExtentReader(f.fileno(), extents, sparse_map), CHUNK_SIZE))
+    finally: tar.format = tarfile.GNU_FORMAT
+    stats["sparse_files"] += 1; stats["hole_bytes"] += sparse.hole_bytes(extents, int(info.pax_headers["GNU.sparse.realsize"]))
+
+def _add_sparse_zip(zf, f, extents, path, arcname, stats):
+    zinfo = zipfile.ZipInfo.from_file(path, arcname); zinfo.compress_type = zf.compression
+    size = os.fstat(f.fileno()).st_size; position = 0
+    with zf.open(zinfo, "w", force_zip64=size > zipfile.ZIP64_LIMIT) as member:
+        for offset, length in extents + [(size, 0)]:
+            while position < offset: # the hole, as zeros
+                n = min(offset - position, CHUNK_SIZE); member.write(bytes(n)); position += n
+            for block in sparse.iter_extents(f.fileno(), [(offset, length)]): member.write(block)
+            position += length
+    stats["sparse_files"] += 1; stats["hole_bytes"] += sparse.hole_bytes(extents, size)
+
+def _add_zip_file(zf, f, path, arcname, compress_type):
+    # zf.write(path), with the data read from f (already open, and through the throttle)
+    zinfo = zipfile.ZipInfo.from_file(path, arcname); zinfo.compress_type = compress_type
+    zinfo._compresslevel = zf.compresslevel # as zf.write sets it
+    with zf.open(zinfo, "w") as member: shutil.copyfileobj(throttle.wrap(f), member, CHUNK_SIZE)
+
+class _PaddedReader:
+    # Exactly `size` bytes of f for tarfile.addfile, whose header already announced that
+    # size: a file that shrank or failed to read while it was archived (a log rotated
+    # mid-run) is padded with zeros, as GNU tar does, so the member and everything after
+    # it stay readable
+    def __init__(self, f, size, path):
+        self._f = f; self._left = size; self._path = path; self._short = False
+
+    def read(self, n=-1):
+        n = self._left if n is None or n < 0 else min(n, self._left)
+        data = b""
+        while not self._short and len(data) < n:
+            try: piece = self._f.read(n - len(data))
+            except OSError as e: piece = b""; print(f"Warning: {self._path}: read failed, padded with zeros: {e}")
+            if not piece:
+                self._short = True; print(f"Warning: {self._path}: file shrank by {self._left - len(data)} bytes; padded with zeros")
+                break
+            data += piece
+        if len(data) < n: data += bytes(n - len(data))
+        self._left -= n
+        return data
+
+def _open_regular(path):
+    return open(path, "rb", opener=lambda p, flags: os.open(p, flags | os.O_NOFOLLOW | os.O_NONBLOCK))
+
+def _tar_stage(sources, exclude, out, stats, selection, readahead_workers, rules, shard):
+    writer = _ChannelWriter(out)
+    with tarfile.open(fileobj=writer, mode="w|", format=tarfile.GNU_FORMAT, copybufsize=CHUNK_SIZE) as tar:
+        for path, arcname, st, prefetched in _selected(sources, exclude, selection, stats, readahead_workers, rules, shard):
+            try:
+                opened = _open_sparse(path, st) if prefetched is None else None
+                if opened is not None:
+                    with opened[0]: _add_sparse_tar(tar, opened[0], opened[1], arcname, stats)
+                elif prefetched is not None:
+                    with prefetched:
+                        info = tar.gettarinfo(arcname=arcname, fileobj=prefetched.file)
+                        if info.isreg(): info.size = len(prefetched.data) # as read, if it changed since
+                        writer.set_raw(info.isreg() and compressibility.incompressible_data(arcname, prefetched.data))
+                        tar.addfile(info, io.BytesIO(prefetched.data) if info.isreg() else None)
+                elif stat.S_ISREG(st.st_mode):
+                    with _open_regular(path) as f:
+                        info = tar.gettarinfo(arcname=arcname, fileobj=f)
+                        writer.set_raw(info.isreg() and compressibility.incompressible_file(arcname, f.fileno(), info.size))
+                        tar.addfile(info, _PaddedReader(throttle.wrap(f), info.size, path) if info.isreg() else None)
+                else: tar.add(path, arcname=arcname, recursive=False)
+                writer.set_raw(False)
+                selection.archived(arcname, st); stats["files"] += 1; print(arcname)
+            except OSError as e: writer.set_raw(False); selection.failed(arcname); print(f"Warning: Skipping {path}: {e}")
+        deleted = selection.deleted()
+        if deleted:
+            data = "".join(f"{name}\n" for name in deleted).encode("utf-8", "surrogateescape")
+            info = tarfile.TarInfo(manifest.DELETED_MEMBER); info.size = len(data); info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+        stats["deleted"] = len(deleted)
+    writer.close(); stats["bytes_in"] = writer.bytes_written
+
+def _zip_stage(sources, exclude, out, stats, selection, readahead_workers, rules, shard, level=None):
+    writer = _ChannelWriter(out)
+    with zipfile.ZipFile(writer, "w", zipfile.ZIP_DEFLATED, compresslevel=level or ZIP_LEVEL) as zf:
+        for path, arcname, st, prefetched in _selected(sources, exclude, selection, stats, readahead_workers, rules, shard, regular_only=True):
+            try:
+                opened = _open_sparse(path, st) if prefetched is None else None
+                cpu = time.thread_time()
+                if opened is not None:
+                    with opened[0]: _add_sparse_zip(zf, opened[0], opened[1], path, arcname, stats)
+                    raw = False
+                elif prefetched is None and not stat.S_ISREG(st.st_mode): zf.write(path, arcname=arcname); raw = False
+                elif prefetched is None:
+                    with _open_regular(path) as f:
+                        raw = compressibility.incompressible_file(arcname, f.fileno(), st.st_size)
+                        _add_zip_file(zf, f, path, arcname, zipfile.ZIP_STORED if raw else zf.compression)
+                else:
+                    with prefetched:
+                        # What ZipInfo.from_file would build, from the prefetch's fstat
+                        zinfo = zipfile.ZipInfo(arcname, time.localtime(prefetched.st.st_mtime)[:6])
+                        zinfo.external_attr = (prefetched.st.st_mode & 0xFFFF) << 16
+                        raw = compressibility.incompressible_data(arcname, prefetched.data)
+                        zf.writestr(zinfo, prefetched.data, zipfile.ZIP_STORED if raw else zf.compression, zf.compresslevel)
+                if raw: stats["bytes_raw"] += st.st_size
+                elif stat.S_ISREG(st.st_mode): stats["bytes_compressed"] += st.st_size; stats["compress_cpu_seconds"] += time.thread_time() - cpu
+                selection.archived(arcname, st); stats["files"] += 1; stats["bytes_in"] += st.st_size; print(arcname)
+            except OSError as e: selection.failed(arcname); print(f"Warning: Skipping {path}: {e}")
+        deleted = selection.deleted()
+        if deleted: zf.writestr(manifest.DELETED_MEMBER, "".join(f"{name}\n" for name in deleted))
+        stats["deleted"] = len(deleted)
+    writer.close()
+
+def _compress_stage(inp, out, archive_format, level, threads, long_distance, stats):
+    for data in compressors.compress_chunks(archive_format, inp, level, threads, long_distance, stats):
+        if data: out.put(data)
+    out.close()
+
+def _file_stage(inp, path, stats):
+    with open(path, "wb") as f:
+        for chunk in inp: throttle.write(len(chunk)); f.write(chunk); stats["bytes_out"] += len(chunk)
+        f.flush(); os.fsync(f.fileno())
+
+def _gpg_stage(inp, path, recipient, stats):
+    gpg = shutil.which("gpg")
+    if gpg is None: raise RuntimeError("gpg not found")
+    proc = subprocess.Popen([gpg, "--batch", "--yes", "--encrypt", "--recipient", recipient, "--output", path], stdin=subprocess.PIPE)
+    try:
+        for chunk in inp: throttle.write(len(chunk)); proc.stdin.write(chunk)
+    except BrokenPipeError: pass # gpg exited early; its exit code below says why
+    finally:
+        try: proc.stdin.close()
+        except BrokenPipeError: pass
+        returncode = proc.wait()
+    if returncode != 0: raise RuntimeError(f"gpg exited with code {returncode}")
+    stats["bytes_out"] = os.path.getsize(path)
+
+def create_archive(output_path, archive_format, sources, exclude=(), gpg_recipient=None, threads=0,
+                   level=None, long_distance=False, selection=None, readahead_workers=readahead.MAX_WORKERS, rules=None,
+                   shard=None):
+    # Writes the artifact at output_path (callers add the .gpg suffix when encrypting) and
+    # returns the run statistics; on any stage error the partial file is removed and the
+    # first error is raised. threads: compression workers, 0 = one per available core;
+    # level: None for the format's default; long_distance: zstd long-distance matching;
+    # selection: manifest.Selection deciding which entries go in (default: all of them);
+    # readahead_workers: most files read ahead of the writer at once, 0 = none;
+    # rules: ignore.Rules pruning the walk (its counters say what was skipped); shard:
+    # shards.ShardFilter when this is one shard of a sharded backup.
+    if archive_format not in FORMATS: raise ValueError(f"Unsupported archive format: {archive_format}")
+    if archive_format != "zip" and compressors.backend(archive_format) is None:
+        raise RuntimeError(f"{archive_format} needs the '{archive_format[4:]}' command or Python module")
+    part_path = output_path + ".part"
+    abort = threading.Event(); errors = []
+    stats = {"files": 0, "bytes_in": 0, "bytes_out": 0, "deleted": 0, "sparse_files": 0, "hole_bytes": 0,
+             "bytes_raw": 0, "bytes_compressed": 0, "compress_cpu_seconds": 0.0}
+    if selection is None: selection = manifest.Selection()
+
+    def run_stage(target, *args):
+        def runner():
+            try: target(*args)
+            except PipelineAborted: pass
+            except Exception as e: errors.append(e); abort.set()
+        return threading.Thread(target=runner, name=f"archive-{target.__name__.strip('_')}", daemon=True)
+
+    archived = _Channel(abort)
+    stages = []
+    if archive_format == "zip": # zipfile deflates each member itself
+        compressed = archived
+        stages.append(run_stage(_zip_stage, sources, exclude, archived, stats, selection, readahead_workers, rules, shard, level))
+    else:
+        compressed = _Channel(abort)
+        stages.append(run_stage(_tar_stage, sources, exclude, archived, stats, selection, readahead_workers, rules, shard))
+        stages.append(run_stage(_compress_stage, archived, compressed, archive_format, level, threads, long_distance, stats))
+    if gpg_recipient: stages.append(run_stage(_gpg_stage, compressed, part_path, gpg_recipient, stats))
+    else: stages.append(run_stage(_file_stage, compressed, part_path, stats))
+
+    started = time.monotonic()
+    for thread in stages: thread.start()
+    for thread in stages: thread.join()
+    if errors:
+        try: os.remove(part_path)
+        except OSError: pass
+        raise errors[0]
+    os.replace(part_path, output_path)
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    return stats
@@ -0,0 +1,160 @@
+# backupvault_engine/benchmark.py
+# Throughput benchmarks for the archive engine's compressors, on a synthetic corpus and/or
+# on tar streams of real trees:
+#   python3 -m backupvault_engine benchmark gzip --workers 1,2,4,8
+#   python3 -m backupvault_engine benchmark compression --source ~/Documents
+# and for the repository's on-disk chunk index:
+#   python3 -m backupvault_engine benchmark chunkindex --entries 100000000 --dir /mnt/backup
+import hashlib
+import io
+import os
+import random
+import shutil
+import tarfile
+import tempfile
+import time
+import zlib
+
+from backupvault_engine import archive, chunkindex, compressors, pgzip
+
+SEGMENT_SIZE = 1024 * 1024
+
+def synthetic_corpus(size, seed=1):
+    # Roughly what home/project directories look like to a compressor: prose-like text,
+    # log/CSV-like records and already-compressed (random) data, interleaved per MiB
+    rng = random.Random(seed)
+    vocab = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 10))) for _ in range(4000)]
+    out = bytearray()
+    while len(out) < size:
+        kind = rng.random()
+        if kind < 0.5:
+            words = rng.choices(vocab, k=SEGMENT_SIZE // 6)
+            out += " ".join(words).encode()[:SEGMENT_SIZE]
+        elif kind < 0.8:
+            start = rng.randint(1_600_000_000, 1_700_000_000)
+            lines = (f"{start + i},{rng.choice(vocab)},{rng.randint(0, 99999)},{rng.random():.6f}\n" for i in range(SEGMENT_SIZE // 30))
+            out += "".join(lines).encode()[:SEGMENT_SIZE]
+        else: out += rng.randbytes(SEGMENT_SIZE)
+    return bytes(out[:size])
+
+def tree_corpus(path, limit):
+    # Uncompressed tar stream of a real tree (capped at `limit` bytes), as the compressor sees it
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w|", format=tarfile.GNU_FORMAT) as tar:
+        for entry_path, arcname, st in archive.iter_source_entries([path]):
+            if buffer.tell() >= limit: break
+            try: tar.add(entry_path, arcname=arcname, recursive=False)
+            except OSError: pass
+    return buffer.getvalue()[:limit]
+
+def load_corpora(sources=(), size_mib=64, synthetic=True):
+    size = size_mib * 1024 * 1024
+    if synthetic: yield synthetic_corpus(size), "synthetic"
+    for source in sources: yield tree_corpus(source, size), source
+
+def _chunks(data):
+    for offset in range(0, len(data), archive.CHUNK_SIZE): yield data[offset:offset + archive.CHUNK_SIZE]
+
+def time_best(fn, repeat):
+    best = None; result = None
+    for _ in range(repeat):
+        started = time.perf_counter(); result = fn(); elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def print_table(title, columns, rows):
+    print(title)
+    widths = [max(len(str(c)), *(len(str(r[i])) for r in rows)) for i, c in enumerate(columns)]
+    print("  ".join(str(c).rjust(w) for c, w in zip(columns, widths)))
+    for row in rows: print("  ".join(str(v).rjust(w) for v, w in zip(row, widths)))
+
+def bench_gzip(data, worker_counts, level=compressors.DEFAULT_LEVELS["tar.gz"], repeat=3):
+    rows = []; mb = len(data) / 1e6
+    seconds, out = time_best(lambda: zlib.compress(data, level, wbits=31), repeat)
+    rows.append(("zlib (1 thread)", f"{mb / seconds:.1f}", f"{len(out) / len(data):.3f}", "1.00x"))
+    baseline = seconds
+    for workers in worker_counts:
+        seconds, out = time_best(lambda: b"".join(pgzip.compress_chunks(_chunks(data), level, workers)), repeat)
+        if zlib.decompress(out, 31) != data: raise RuntimeError(f"pgzip output with {workers} workers does not round-trip")
+        rows.append((f"pgzip {workers} workers", f"{mb / seconds:.1f}", f"{len(out) / len(data):.3f}", f"{baseline / seconds:.2f}x"))
+    return rows
+
+# (label, format, level, threads, long distance); threads 0 = all cores
+COMPRESSION_CASES = [
+    ("gzip -6, 1 thread", "tar.gz", 6, 1, False),
+    ("gzip -6", "tar.gz", 6, 0, False),
+    ("zstd -1", "tar.zst", 1, 0, False),
+    ("zstd -3", "tar.zst", 3, 0, False),
+    ("zstd -3 --long", "tar.zst", 3, 0, True),
+    ("zstd -9", "tar.zst", 9, 0, False),
+    ("zstd -19 --long", "tar.zst", 19, 0, True),
+    ("lz4 -1", "tar.lz4", 1, 0, False),
+    ("lz4 -9", "tar.lz4", 9, 0, False),
+]
+
+def bench_compression(data, repeat=3, threads=0):
+    rows = []; mb = len(data) / 1e6
+    for label, fmt, level, case_threads, long_distance in COMPRESSION_CASES:
+        if compressors.backend(fmt) is None:
+            rows.append((label, "-", "-", "-", "unavailable")); continue
+        workers = case_threads or threads
+        seconds, out = time_best(lambda: b"".join(compressors.compress_chunks(fmt, _chunks(data), level, workers, long_distance)), repeat)
+        d_seconds, back = time_best(lambda: b"".join(compressors.decompress_chunks(fmt, _chunks(out))), repeat)
+        if back != data: raise RuntimeError(f"{label} output does not round-trip")
+        rows.append((label, f"{mb / seconds:.1f}", f"{mb / d_seconds:.1f}", f"{len(out) / len(data):.3f}", compressors.backend(fmt)))
+    return rows
+
+def _digest(i): return hashlib.sha256(i.to_bytes(8, "little")).digest()
+
+def bench_chunkindex(entries, batch=4096, lookups=200_000, directory=None):
+    # Inserts `entries` synthetic chunk ids (merges included), then times batched lookups
+    # of ids that are present and ids that are not, on the table alone and behind the Bloom filter
+    path = tempfile.mkdtemp(prefix="bv-chunkindex-", dir=directory); rows = []
+    try:
+        index = chunkindex.ChunkIndex.open(path, writable=True)
+        started = time.perf_counter()
+        for i in range(entries): index.add(_digest(i), ("00" * 16, i & 0xffffffff, 1024, 1024, 0))
+        index.merge(); seconds = time.perf_counter() - started
+        rows.append(("insert + merge", entries, f"{entries / seconds:,.0f}", f"{seconds:.1f}"))
+        index.close(); index = chunkindex.ChunkIndex.open(path) # cold: only the mmap'ed table
+        rng = random.Random(1); lookups = min(lookups, entries)
+        for label, ids in (("lookup (hits)", [rng.randrange(entries) for _ in range(lookups)]),
+                           ("lookup (misses)", [entries + rng.randrange(entries) for _ in range(lookups)])):
+            digests = [_digest(i) for i in ids]; started = time.perf_counter(); found = 0; distinct = 0
+            for start in range(0, len(digests), batch):
+                result = index.lookup_many(digests[start:start + batch])
+                found += sum(1 for v in result.values() if v is not None); distinct += len(result)
+            seconds = time.perf_counter() - started
+            expected = distinct if label == "lookup (hits)" else 0
+            if found != expected: raise RuntimeError(f"chunk index {label}: found {found}, expected {expected}")
+            rows.append((label, len(digests), f"{len(digests) / seconds:,.0f}", f"{seconds:.1f}"))
+        table_bytes = index.table.capacity * chunkindex.SLOT.size if index.table else 0
+        index.close(); index = chunkindex.ChunkIndex.open(path, writable=True) # with the Bloom filter in front
+        digests = [_digest(entries + rng.randrange(entries)) for _ in range(lookups)]; started = time.perf_counter()
+        for start in range(0, len(digests), batch): index.lookup_many(digests[start:start + batch])
+        seconds = time.perf_counter() - started; counters = index.counters
+        rows.append((f"lookup (misses, Bloom: {counters['bloom_false_positives']} false pos.)", len(digests),
+                     f"{len(digests) / seconds:,.0f}", f"{seconds:.1f}"))
+        index.close()
+        return rows, table_bytes
+    finally: shutil.rmtree(path, ignore_errors=True)
+
+def run(args):
+    if args.kind == "chunkindex":
+        print(f"INFO: {args.entries:,} chunk ids, lookups in batches of {args.batch}")
+        rows, table_bytes = bench_chunkindex(args.entries, args.batch, directory=args.dir)
+        print_table(f"chunk index (table file {table_bytes / 1024**2:,.0f} MiB)", ["operation", "count", "ops/s", "seconds"], rows)
+        return 0
+    cores = pgzip.default_workers()
+    for data, label in load_corpora(args.source, args.size_mib, not args.no_synthetic):
+        print(f"INFO: {len(data) / 1e6:.1f} MB of {label} data, {cores} usable cores, best of {args.repeat}")
+        if args.kind == "gzip":
+            worker_counts = [int(w) for w in args.workers.split(",")] if args.workers else \
+                            sorted({w for w in (1, 2, 4, 8, 16, 32) if w < cores} | {cores})
+            rows = bench_gzip(data, worker_counts, args.level or compressors.DEFAULT_LEVELS["tar.gz"], args.repeat)
+            print_table("gzip throughput (MB/s of input)", ["compressor", "MB/s", "ratio", "speedup"], rows)
+        else:
+            rows = bench_compression(data, args.repeat)
+            print_table("compression (MB/s of uncompressed data)", ["compressor", "compress MB/s", "decompress MB/s", "ratio", "backend"], rows)
+        print()
+    return 0
@@ -0,0 +1,93 @@
+# backupvault_engine/bloom.py
+# Scalable Bloom filter kept in memory in front of the repository's chunk index, so that
+# most lookups of chunks the repository does not have (nearly all of them on a first
+# backup) never touch the on-disk table. Keys are SHA-256 digests, so the bit positions
+# come straight from the digest (double hashing over its first 16 bytes). When a layer
+# holds its capacity a new one twice as large is added with half the false-positive rate,
+# keeping the combined rate under twice the configured one; when the memory budget runs
+# out the new layer gets what is left and the rate it can reach is reported instead.
+import math
+import os
+import struct
+
+MAGIC = b"BVBLOOM1"
+HEADER = struct.Struct("<8sdQI") # magic, target false-positive rate, max bytes, layers
+LAYER = struct.Struct("<QQQI")   # capacity, entries, bits, hashes
+MIN_LAYER_BITS = 8 * 1024 * 8    # 8 KiB
+MIN_CAPACITY = 1 << 20
+
+class _Layer:
+    def __init__(self, capacity, bits, hashes, entries=0, data=None):
+        self.capacity = capacity; self.bits = bits; self.hashes = hashes; self.entries = entries
+        self.data = data if data is not None else bytearray((bits + 7) // 8)
+
+    @classmethod
+    def sized(cls, capacity, fp_rate, max_bits):
+        bits = max(MIN_LAYER_BITS, min(max_bits, int(-capacity * math.log(fp_rate) / math.log(2) ** 2)))
+        # The optimal hash count for the target rate; a layer cut short by the memory cap
+        # gets the (lower) optimum for the bits it has
+        return cls(capacity, bits, max(1, min(round(-math.log2(fp_rate)), round(bits / capacity * math.log(2)))))
+
+    def __contains__(self, digest):
+        data = self.data; bits = self.bits
+        p = int.from_bytes(digest[:8], "little"); step = int.from_bytes(digest[8:16], "little") | 1
+        for _ in range(self.hashes):
+            p %= bits
+            if not data[p >> 3] & (1 << (p & 7)): return False
+            p += step
+        return True
+
+    def add(self, digest):
+        data = self.data; bits = self.bits
+        p = int.from_bytes(digest[:8], "little"); step = int.from_bytes(digest[8:16], "little") | 1
+        for _ in range(self.hashes):
+            p %= bits; data[p >> 3] |= 1 << (p & 7); p += step
+        self.entries += 1
+
+    def fp_rate(self):
+        return (1 - math.exp(-self.hashes * self.entries / self.bits)) ** self.hashes
+
+class BloomFilter:
+    def __init__(self, capacity, fp_rate=0.01, max_bytes=256 * 1024**2):
+        self.fp_rate = fp_rate; self.max_bytes = max_bytes; self.layers = []
+        self._add_layer(max(capacity, MIN_CAPACITY))
+
+    def _add_layer(self, capacity):
+        # Layer i targets fp_rate / 2^(i+1): the sum over all layers stays below fp_rate
+        budget_bits = max(MIN_LAYER_BITS, (self.max_bytes - self.memory_bytes()) * 8)
+        self.layers.append(_Layer.sized(capacity, self.fp_rate / 2 ** (len(self.layers) + 1), budget_bits))
+
+    def __len__(self): return sum(layer.entries for layer in self.layers)
+
+    def __contains__(self, digest): return any(digest in layer for layer in self.layers)
+
+    def add(self, digest):
+        layer = self.layers[-1]
+        if layer.entries >= layer.capacity: self._add_layer(layer.capacity * 2); layer = self.layers[-1]
+        layer.add(digest)
+
+    def memory_bytes(self): return sum(len(layer.data) for layer in self.layers)
+
+    def estimated_fp_rate(self): return 1 - math.prod(1 - layer.fp_rate() for layer in self.layers)
+
+    def save(self, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.fp_rate, self.max_bytes, len(self.layers)))
+            for layer in self.layers:
+                f.write(LAYER.pack(layer.capacity, layer.entries, layer.bits, layer.hashes)); f.write(layer.data)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            magic, fp_rate, max_bytes, count = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC: raise ValueError(f"Not a Bloom filter: {path}")
+            bloom = cls.__new__(cls); bloom.fp_rate = fp_rate; bloom.max_bytes = max_bytes; bloom.layers = []
+            for _ in range(count):
+                capacity, entries, bits, hashes = LAYER.unpack(f.read(LAYER.size))
+                data = bytearray(f.read((bits + 7) // 8))
+                if len(data) != (bits + 7) // 8: raise ValueError(f"Truncated Bloom filter: {path}")
+                bloom.layers.append(_Layer(capacity, bits, hashes, entries, data))
+        return bloom
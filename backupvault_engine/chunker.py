@@ -0,0 +1,79 @@
+# backupvault_engine/chunker.py
+# Content-defined chunking for the deduplicating repository, after FastCDC: no cut point
+# in the first MIN_SIZE bytes of a chunk, a stricter boundary condition before AVG_SIZE
+# and a looser one after it ("normalized chunking"), and a hard cut at MAX_SIZE. Cut
+# points depend only on the bytes just before them, so an insert or delete early in a
+# file only changes the chunks next to it and everything after still deduplicates.
+# A per-byte rolling hash loop runs at a few MB/s in Python, so the boundary hash is built
+# from whole-buffer operations instead: an 8-byte windowed hash is computed for every
+# position with bytes.translate and big-int XORs (window doubling, 1 + 3 passes), and
+# the ~1/256 positions where it is zero are confirmed with a CRC-32 of the 48 bytes
+# before them against the size-dependent mask.
+import hashlib
+import zlib
+
+from backupvault_engine import sparse, throttle
+
+MIN_SIZE = 256 * 1024
+AVG_SIZE = 1024 * 1024
+MAX_SIZE = 4 * 1024 * 1024
+SCAN_SIZE = 16 * 1024 * 1024 # bytes hashed per pass over the buffer
+NORMALIZATION = 2 # mask bits added before / removed after the average size
+CANDIDATE_BITS = 8 # the windowed hash is one byte: zero at 1/256 of the positions
+CONFIRM_WINDOW = 48
+# Fixed for the repository format: different tables move every cut point
+_TABLES = [bytes(sorted(range(256), key=lambda b, t=t: hashlib.sha256(b"backupvault-cdc-%d-%d" % (t, b)).digest())) for t in range(4)]
+
+def _marks(data):
+    # One byte per position of `data`: the hash of the 8 bytes ending there (positions
+    # below 7 see a shorter window and are never used as cut points)
+    marks = data.translate(_TABLES[0]); n = len(data)
+    for step, table in ((1, _TABLES[1]), (2, _TABLES[2]), (4, _TABLES[3])):
+        # h'[i] = h[i] ^ P(h[i - step]): doubles the window each pass
+        mixed = int.from_bytes(marks, "big") ^ (int.from_bytes(marks.translate(table), "big") >> (8 * step))
+        marks = mixed.to_bytes(n, "big")
+    return marks
+
+def _masks(avg_size):
+    bits = max(avg_size.bit_length() - 1 - CANDIDATE_BITS, NORMALIZATION + 1)
+    return (1 << (bits + NORMALIZATION)) - 1, (1 << (bits - NORMALIZATION)) - 1
+
+def _cut(data, marks, start, end_of_data, min_size, avg_size, max_size):
+    # Length of the chunk starting at `start`
+    if end_of_data - start <= min_size: return end_of_data - start
+    end = min(start + max_size, end_of_data); normal = min(start + avg_size, end)
+    view = memoryview(data); mask_s, mask_l = _masks(avg_size)
+    for lo, hi, mask in ((start + min_size, normal, mask_s), (normal, end, mask_l)):
+        i = marks.find(0, lo - 1, hi - 1) # i: last byte of the chunk
+        while i != -1:
+            if not zlib.crc32(view[i + 1 - CONFIRM_WINDOW:i + 1]) & mask: return i + 1 - start
+            i = marks.find(0, i + 1, hi - 1)
+    return end - start
+
+def iter_chunks(blocks, min_size=MIN_SIZE, avg_size=AVG_SIZE, max_size=MAX_SIZE):
+    # Iterable of byte blocks (e.g. file reads) in, content-defined chunks out
+    buffer = b""; blocks = iter(blocks)
+    while True:
+        block = next(blocks, None)
+        if block is not None:
+            buffer += block
+            if len(buffer) < SCAN_SIZE: continue
+        marks = _marks(buffer); start = 0
+        # Without more input only chunks that are certain to end inside the buffer are cut
+        while start < len(buffer) and (block is None or len(buffer) - start >= max_size):
+            n = _cut(buffer, marks, start, len(buffer), min_size, avg_size, max_size)
+            yield buffer[start:start + n]; start += n
+        buffer = buffer[start:]
+        if block is None: return
+
+def file_chunks(path, min_size=MIN_SIZE, avg_size=AVG_SIZE, max_size=MAX_SIZE, extents=None):
+    # extents: for a sparse file, only these (offset, length) ranges are read, back to back
+    def blocks():
+        with open(path, "rb") as f:
+            if extents is not None: yield from sparse.iter_extents(f.fileno(), extents); return
+            source = throttle.wrap(f)
+            while True:
+                block = source.read(SCAN_SIZE)
+                if not block: return
+                yield block
+    return iter_chunks(blocks(), min_size, avg_size, max_size)
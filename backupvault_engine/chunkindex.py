@@ -0,0 +1,283 @@
+# backupvault_engine/chunkindex.py
+# On-disk chunk index of a repository (backupvault-repo/index/): chunk SHA-256 -> pack id,
+# offset, stored length, plain length, codec. The bulk of it is an open-addressed hash
+# table in one file that is mmap'ed read-only, so a lookup is a few page reads whatever
+# the repository size and memory holds only what was added since the last merge:
+#   table-G       64-byte slots, linear probing; the slot is the top bits of the digest,
+#                 so the table is ordered by digest and sorted batches probe sequentially
+#   journal-N     append-only log of new entries, one CRC-32 per record
+#   CURRENT       generation G of the table; journals N >= G are replayed on open
+# Once the journals hold MERGE_THRESHOLD entries they are frozen, a new journal is started
+# and a background thread inserts the frozen entries into the table in place, so a merge
+# writes only the new slots. The merged table is then linked as table-(N+1) and CURRENT
+# switched to it. A crash before that leaves CURRENT on the old generation with all its
+# journals on disk: replaying them finds the entries the torn merge already inserted and
+# counts them into the table. Only a table past MAX_LOAD is rewritten, into one of twice
+# the capacity, so the total rewrite cost stays linear in the number of entries. The
+# packs' own indexes stay the source of truth: a missing index is rebuilt from them.
+# A writable index also keeps bloom.py's filter over every digest in front of all this
+# (saved as `bloom` on close, rebuilt when it does not cover the index), so most lookups
+# of new chunks are answered without reading the table; `counters` tracks how it does.
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from backupvault_engine import bloom as bloom_filter
+
+MAGIC = b"BVCIDX1\0"
+HEADER = struct.Struct("<8sQQ") # magic, capacity, entries
+HEADER_SIZE = 64
+SLOT = struct.Struct("<32s16sIIIB3x") # digest, pack id, offset, stored length, plain length, codec
+RECORD_CRC = struct.Struct("<I")
+EMPTY = bytes(32)
+MIN_CAPACITY = 1 << 16
+MAX_LOAD = 0.7
+MERGE_THRESHOLD = 1 << 18 # journal entries kept in memory (~250 bytes each) before a background merge
+BLOOM_FP_RATE = 0.01
+BLOOM_MAX_BYTES = 256 * 1024 * 1024
+
+def _pack_slot(digest, record):
+    pack_id, offset, length, plain_length, codec = record
+    return SLOT.pack(digest, bytes.fromhex(pack_id), offset, length, plain_length, codec)
+
+def _unpack_slot(data, offset=0):
+    digest, pack_id, offset, length, plain_length, codec = SLOT.unpack_from(data, offset)
+    return digest, (pack_id.hex(), offset, length, plain_length, codec)
+
+def _capacity_for(entries):
+    capacity = MIN_CAPACITY
+    while entries > capacity * MAX_LOAD / 2: capacity *= 2 # half full after a resize
+    return capacity
+
+class _Table:
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.file = open(path, "r+b" if writable else "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        magic, self.capacity, self.entries = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC: raise ValueError(f"Not a chunk index table: {path}")
+        self.shift = 64 - (self.capacity.bit_length() - 1); self.mask = self.capacity - 1
+
+    @classmethod
+    def create(cls, path, capacity):
+        with open(path, "wb") as f:
+            f.truncate(HEADER_SIZE + capacity * SLOT.size) # sparse: empty slots are zeros
+            f.write(HEADER.pack(MAGIC, capacity, 0))
+        return cls(path, writable=True)
+
+    def _slot(self, digest): return int.from_bytes(digest[:8], "big") >> self.shift
+
+    def find(self, digest):
+        mm = self.map; slot = self._slot(digest)
+        while True:
+            offset = HEADER_SIZE + slot * SLOT.size; key = mm[offset:offset + 32]
+            if key == digest: return _unpack_slot(mm, offset)[1]
+            if key == EMPTY: return None
+            slot = (slot + 1) & self.mask
+
+    def insert(self, digest, packed):
+        mm = self.map; slot = self._slot(digest)
+        while True:
+            offset = HEADER_SIZE + slot * SLOT.size; key = mm[offset:offset + 32]
+            if key == EMPTY:
+                # The digest last: a reader of the shared map never sees a key without its record
+                mm[offset + 32:offset + SLOT.size] = packed[32:]; mm[offset:offset + 32] = packed[:32]
+                self.entries += 1; return
+            if key == digest: return
+            slot = (slot + 1) & self.mask
+
+    def slots(self):
+        # (digest, packed slot) of every occupied slot, in table order
+        with memoryview(self.map) as view:
+            for fields in SLOT.iter_unpack(view[HEADER_SIZE:]):
+                if fields[0] != EMPTY: yield fields[0], SLOT.pack(*fields)
+
+    def commit(self):
+        HEADER.pack_into(self.map, 0, MAGIC, self.capacity, self.entries)
+        self.map.flush(); os.fsync(self.file.fileno())
+
+    def close(self):
+        self.map.close(); self.file.close()
+
+class ChunkIndex:
+    def __init__(self, path, writable):
+        self.path = path; self.writable = writable
+        self.table = None; self.frozen = {}; self.recent = {}
+        self.generation = 0; self.journal_number = 0; self.journal = None
+        self._lock = threading.Lock(); self._merge_thread = None; self._merge_error = None
+        self._lock_file = None; self.bloom = None
+        # hits/misses of get(); a miss is a bloom negative (no table read) or a false positive
+        self.counters = {"hits": 0, "misses": 0, "bloom_negatives": 0, "bloom_false_positives": 0}
+
+    @classmethod
+    def open(cls, path, writable=False, bloom_fp_rate=BLOOM_FP_RATE, bloom_max_bytes=BLOOM_MAX_BYTES):
+        index = cls(path, writable)
+        if writable:
+            os.makedirs(path, exist_ok=True)
+            index._lock_file = open(os.path.join(path, "lock"), "a")
+            try: fcntl.flock(index._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError: index._lock_file.close(); raise RuntimeError(f"Chunk index {path} is in use by another backup")
+            for name in os.listdir(path):
+                if name.endswith(".tmp"): os.remove(os.path.join(path, name)) # an interrupted merge
+        index._load()
+        if writable: index._load_bloom(bloom_fp_rate, bloom_max_bytes)
+        return index
+
+    @staticmethod
+    def exists(path): return os.path.exists(os.path.join(path, "CURRENT"))
+
+    def _file(self, kind, number): return os.path.join(self.path, f"{kind}-{number}")
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.path, "CURRENT"), "r", encoding="utf-8") as f: self.generation = int(f.read().strip() or 0)
+        except FileNotFoundError: self.generation = 0
+        if os.path.exists(self._file("table", self.generation)): self.table = _Table(self._file("table", self.generation))
+        journals = sorted(int(n[8:]) for n in os.listdir(self.path) if n.startswith("journal-") and n[8:].isdigit()) \
+                   if os.path.isdir(self.path) else []
+        for number in (n for n in journals if n >= self.generation): self._replay(number)
+        self.journal_number = max([self.generation] + journals)
+
+    def _replay(self, number):
+        path = self._file("journal", number); size = SLOT.size + RECORD_CRC.size; good = 0
+        with open(path, "rb") as f: data = f.read()
+        for start in range(0, len(data) - size + 1, size):
+            record = data[start:start + SLOT.size]
+            if RECORD_CRC.unpack_from(data, start + SLOT.size)[0] != zlib.crc32(record): break
+            digest, value = _unpack_slot(record); good = start + size
+            # Already in the table: a merge inserted it but died before committing the count
+            if self.table is not None and self.table.find(digest) is not None: self.table.entries += 1
+            else: self.recent[digest] = value
+        if good != len(data) and self.writable:
+            print(f"Warning: Dropping {len(data) - good} bytes of torn chunk index journal {path}")
+            with open(path, "r+b") as f: f.truncate(good)
+
+    def _load_bloom(self, fp_rate, max_bytes):
+        path = os.path.join(self.path, "bloom")
+        try:
+            bloom = bloom_filter.BloomFilter.load(path)
+            # A filter missing entries would hide chunks the repository has
+            if len(bloom) == len(self) and (bloom.fp_rate, bloom.max_bytes) == (fp_rate, max_bytes): self.bloom = bloom; return
+        except FileNotFoundError: pass
+        except (OSError, ValueError, struct.error) as e: print(f"Warning: Rebuilding unreadable chunk index Bloom filter: {e}")
+        self.bloom = bloom_filter.BloomFilter(2 * len(self), fp_rate, max_bytes)
+        if self.table is not None:
+            for digest, _ in self.table.slots(): self.bloom.add(digest)
+        for digest in (*self.frozen, *self.recent): self.bloom.add(digest)
+
+    def __len__(self):
+        return (self.table.entries if self.table else 0) + len(self.frozen) + len(self.recent)
+
+    def _find(self, digest):
+        with self._lock: # a finished merge swaps (and closes) the table
+            value = self.recent.get(digest) or self.frozen.get(digest)
+            if value is None and self.table is not None: value = self.table.find(digest)
+        return value
+
+    def get(self, digest, default=None):
+        counters = self.counters
+        if self.bloom is not None and digest not in self.bloom:
+            counters["misses"] += 1; counters["bloom_negatives"] += 1; return default
+        value = self._find(digest)
+        if value is not None: counters["hits"] += 1; return value
+        counters["misses"] += 1
+        if self.bloom is not None: counters["bloom_false_positives"] += 1
+        return default
+
+    def __contains__(self, digest): return self.get(digest) is not None
+
+    def __getitem__(self, digest):
+        value = self.get(digest)
+        if value is None: raise KeyError(digest.hex())
+        return value
+
+    def lookup_many(self, digests):
+        # {digest: record or None}; probing in digest order walks the table front to back
+        return {digest: self.get(digest) for digest in sorted(set(digests))}
+
+    def add(self, digest, record):
+        if self._find(digest) is not None: return
+        if self.bloom is not None: self.bloom.add(digest)
+        if self.journal is None: self.journal = open(self._file("journal", self.journal_number), "ab")
+        packed = _pack_slot(digest, record)
+        self.journal.write(packed + RECORD_CRC.pack(zlib.crc32(packed)))
+        self.recent[digest] = record
+        if len(self.recent) >= MERGE_THRESHOLD:
+            self._reap_merge()
+            if self._merge_thread is None: self._start_merge()
+
+    def flush(self):
+        # Makes everything added so far durable
+        if self.journal is not None: self.journal.flush(); os.fsync(self.journal.fileno())
+        self._reap_merge()
+
+    def _start_merge(self):
+        self.flush()
+        if self.journal is not None: self.journal.close(); self.journal = None
+        # A failed earlier merge left its entries frozen; they go into this one
+        with self._lock: self.frozen.update(self.recent); self.recent = {}
+        frozen_upto = self.journal_number; self.journal_number += 1
+        self._merge_thread = threading.Thread(target=self._merge, args=(frozen_upto,), name="chunkindex-merge", daemon=True)
+        self._merge_thread.start()
+
+    def _merge(self, frozen_upto):
+        try:
+            target = self._file("table", frozen_upto + 1)
+            base = self.table; entries = (base.entries if base else 0) + len(self.frozen)
+            in_place = base is not None and entries <= base.capacity * MAX_LOAD
+            if in_place:
+                table = _Table(base.path, writable=True); table.entries = base.entries
+            else:
+                tmp_path = f"{target}.tmp"; table = _Table.create(tmp_path, _capacity_for(entries))
+                if base is not None:
+                    for digest, packed in base.slots(): table.insert(digest, packed)
+            for digest in sorted(self.frozen): table.insert(digest, _pack_slot(digest, self.frozen[digest])) # front to back
+            table.commit(); entries = table.entries; table.close()
+            if in_place:
+                if os.path.lexists(target): os.remove(target) # left by a merge that died before CURRENT
+                os.link(base.path, target)
+            else: os.replace(tmp_path, target)
+            current_tmp = os.path.join(self.path, "CURRENT.tmp")
+            with open(current_tmp, "w", encoding="utf-8") as f: f.write(f"{frozen_upto + 1}\n"); f.flush(); os.fsync(f.fileno())
+            os.replace(current_tmp, os.path.join(self.path, "CURRENT"))
+            fd = os.open(self.path, os.O_RDONLY)
+            try: os.fsync(fd)
+            finally: os.close(fd)
+            new_table = None if in_place else _Table(target)
+            with self._lock:
+                old = None if in_place else self.table
+                if in_place: self.table.entries = entries; self.table.path = target # same file, new name
+                else: self.table = new_table
+                self.frozen = {}; old_generation = self.generation; self.generation = frozen_upto + 1
+            if old is not None: old.close()
+            for number in range(old_generation, frozen_upto + 1):
+                for kind in ("table", "journal"):
+                    try: os.remove(self._file(kind, number))
+                    except FileNotFoundError: pass
+        except Exception as e: self._merge_error = e
+
+    def _reap_merge(self, wait=False):
+        if self._merge_thread is None or (self._merge_thread.is_alive() and not wait): return
+        self._merge_thread.join(); self._merge_thread = None
+        if self._merge_error is not None:
+            # The frozen entries are still in their journals; the next open replays them
+            error = self._merge_error; self._merge_error = None
+            print(f"Warning: Chunk index merge failed: {error}")
+
+    def merge(self):
+        # Fold the journals into a new table now (and wait for it)
+        self._reap_merge(wait=True)
+        if self.recent or not self.exists(self.path): self._start_merge(); self._reap_merge(wait=True)
+
+    def close(self):
+        if self.writable: self.flush(); self._reap_merge(wait=True)
+        if self.bloom is not None:
+            try: self.bloom.save(os.path.join(self.path, "bloom"))
+            except OSError as e: print(f"Warning: Could not save chunk index Bloom filter: {e}")
+            self.bloom = None
+        if self.journal is not None: self.journal.close(); self.journal = None
+        if self.table is not None: self.table.close(); self.table = None
+        if self._lock_file is not None: self._lock_file.close(); self._lock_file = None
@@ -0,0 +1,58 @@
+# backupvault_engine/compressibility.py
+# Which content is not worth compressing again: JPEGs, videos, zips, gzipped logs. Files
+# are recognised by their magic bytes or their extension, and anything else by the byte
+# entropy of a few samples (start, middle, end), so a run spends no deflate time on data
+# that would only shrink by a fraction of a percent. archive.py marks such files' bytes
+# as RawChunk in the tar stream (pgzip stores them as deflate "stored" blocks) or stores
+# them uncompressed in zip, and the repository keeps such chunks raw without trying.
+import math
+import os
+from collections import Counter
+
+MIN_SIZE = 256 * 1024 # smaller files are compressed anyway: switching costs more than it saves
+SAMPLE_SIZE = 4096
+ENTROPY_BITS = 7.5    # bits per byte above which a sample counts as incompressible
+EXTENSIONS = frozenset((
+    "jpg", "jpeg", "png", "gif", "webp", "heic", "heif", "avif", "jxl",
+    "mp4", "m4v", "mov", "mkv", "webm", "avi", "wmv", "flv", "mp3", "m4a", "aac", "ogg", "oga", "opus", "flac",
+    "zip", "gz", "tgz", "bz2", "tbz2", "xz", "txz", "zst", "lz4", "lzma", "7z", "rar", "cab",
+    "jar", "war", "apk", "ipa", "whl", "docx", "xlsx", "pptx", "odt", "ods", "odp", "epub",
+    "gpg", "pgp", "age", "deb", "rpm", "dmg", "squashfs"))
+# (offset, magic) pairs
+MAGIC = (
+    (0, b"\xff\xd8\xff"), (0, b"\x89PNG\r\n\x1a\n"), (0, b"GIF8"), (8, b"WEBP"), (4, b"ftyp"),
+    (0, b"\x1a\x45\xdf\xa3"), (0, b"OggS"), (0, b"fLaC"), (0, b"ID3"), (0, b"PK\x03\x04"), (0, b"\x1f\x8b"),
+    (0, b"BZh"), (0, b"\xfd7zXZ\x00"), (0, b"\x28\xb5\x2f\xfd"), (0, b"\x04\x22\x4d\x18"),
+    (0, b"7z\xbc\xaf\x27\x1c"), (0, b"Rar!\x1a\x07"), (0, b"hsqs"))
+
+class RawChunk(bytes):
+    # Stream data marked as not worth compressing; everything else treats it as bytes
+    pass
+
+def entropy(sample):
+    # Shannon entropy in bits per byte
+    n = len(sample)
+    if not n: return 0.0
+    return -sum(c / n * math.log2(c / n) for c in Counter(sample).values())
+
+def known_compressed(name, head):
+    if any(head[offset:offset + len(magic)] == magic for offset, magic in MAGIC): return True
+    return name.rpartition(".")[2].lower() in EXTENSIONS if "." in os.path.basename(name) else False
+
+def looks_incompressible(data):
+    # A buffer (e.g. a repository chunk) judged by up to three samples; all must be dense
+    n = len(data)
+    if n <= SAMPLE_SIZE: return entropy(data) >= ENTROPY_BITS
+    return all(entropy(data[o:o + SAMPLE_SIZE]) >= ENTROPY_BITS for o in (0, (n - SAMPLE_SIZE) // 2, n - SAMPLE_SIZE))
+
+def incompressible_file(name, fd, size):
+    # An open regular file of `size` bytes; reads at most three samples with pread
+    if size < MIN_SIZE: return False
+    head = os.pread(fd, SAMPLE_SIZE, 0)
+    if known_compressed(name, head): return True
+    return all(entropy(s) >= ENTROPY_BITS for s in
+               (head, os.pread(fd, SAMPLE_SIZE, size // 2), os.pread(fd, SAMPLE_SIZE, size - SAMPLE_SIZE)))
+
+def incompressible_data(name, data):
+    # The same for a file already read into memory (readahead.py's small files)
+    return len(data) >= MIN_SIZE and (known_compressed(name, data[:SAMPLE_SIZE]) or looks_incompressible(data))
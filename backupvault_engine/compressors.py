@@ -0,0 +1,164 @@
+# backupvault_engine/compressors.py
+# Stream compressors behind the tar.* COMPRESSION modes. gzip is built in (pgzip, on
+# one thread or more). zstd and lz4 use the 'zstandard' / 'lz4' modules when
+# they are installed and otherwise pipe through the zstd / lz4 command line tools, so
+# the artifacts are the same either way and readable by `tar -I zstd` / `lz4 -d`.
+# gzip stores the input marked compressibility.RawChunk without compressing it (see
+# pgzip.py); zstd and lz4 already detect incompressible blocks and store them at close to
+# copy speed, so they take it like any other input. For those the stats only count the
+# RawChunk bytes apart from the rest, and the CPU time where it is spent in this thread
+# or in our own pool (not in zstd's worker threads or the command line tools).
+import os
+import shutil
+import subprocess
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from backupvault_engine import pgzip
+from backupvault_engine.compressibility import RawChunk
+
+try: import zstandard
+except ImportError: zstandard = None
+try: import lz4.frame as lz4_frame
+except ImportError: lz4_frame = None
+
+READ_SIZE = 1024 * 1024
+DEFAULT_LEVELS = {"tar.gz": 6, "tar.zst": 3, "tar.lz4": 1}
+LEVEL_RANGES = {"tar.gz": (1, 9), "tar.zst": (1, 19), "tar.lz4": (1, 12)}
+ZSTD_LONG_WINDOW_LOG = 27   # 128 MiB long-distance window; zstd's default decoder limit
+ZSTD_MAX_WINDOW_LOG = 31    # accepted when reading, so older or hand-made artifacts still restore
+
+def backend(fmt):
+    # Which implementation a format would use here, or None when it cannot be written
+    if fmt == "tar.gz": return "zlib"
+    if fmt == "tar.zst": return "zstandard" if zstandard is not None else ("zstd-cli" if shutil.which("zstd") else None)
+    if fmt == "tar.lz4": return "lz4" if lz4_frame is not None else ("lz4-cli" if shutil.which("lz4") else None)
+    return None
+
+def resolve_level(fmt, level):
+    low, high = LEVEL_RANGES[fmt]
+    if not level: return DEFAULT_LEVELS[fmt]
+    return min(max(int(level), low), high)
+
+def pipe_through(command, chunks):
+    # Feed chunks to a filter process from a helper thread and yield what it writes back
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    feed_error = []
+    def feed():
+        try:
+            for chunk in chunks: proc.stdin.write(chunk)
+        except BrokenPipeError: pass
+        except BaseException as e: feed_error.append(e); proc.kill()
+        finally:
+            try: proc.stdin.close()
+            except BrokenPipeError: pass
+    feeder = threading.Thread(target=feed, name=f"{os.path.basename(command[0])}-feed", daemon=True)
+    feeder.start()
+    try:
+        while True:
+            data = proc.stdout.read1(READ_SIZE)
+            if not data: break
+            yield data
+    finally:
+        feeder.join(); proc.stdout.close(); returncode = proc.wait()
+    if feed_error: raise feed_error[0]
+    if returncode != 0: raise RuntimeError(f"{command[0]} exited with code {returncode}")
+
+def _gzip_chunks(chunks, level, threads, stats):
+    # Always pgzip's blocks (one worker on a single thread), which is what stores raw runs
+    yield from pgzip.compress_chunks(chunks, level, threads, stats=stats)
+
+def _counted(chunks, stats):
+    # Input as pgzip would split it: RawChunk bytes vs the rest
+    for chunk in chunks:
+        stats["bytes_raw" if isinstance(chunk, RawChunk) else "bytes_compressed"] += len(chunk)
+        yield chunk
+
+def _timed(stats, call, *args, **kwargs):
+    cpu = time.thread_time(); result = call(*args, **kwargs)
+    stats["compress_cpu_seconds"] += time.thread_time() - cpu
+    return result
+
+def _lz4_block(block, level):
+    cpu = time.thread_time(); data = lz4_frame.compress(block, compression_level=level)
+    return data, time.thread_time() - cpu
+
+def _zstd_chunks(chunks, level, threads, long_distance, stats):
+    if zstandard is not None:
+        # One thread compresses in this one (threads=0), where its CPU time can be measured
+        params = zstandard.ZstdCompressionParameters.from_level(
+            level, threads=threads if threads > 1 else 0, enable_ldm=long_distance,
+            **({"window_log": ZSTD_LONG_WINDOW_LOG} if long_distance else {}))
+        compressor = zstandard.ZstdCompressor(compression_params=params).compressobj()
+        for chunk in chunks:
+            data = _timed(stats, compressor.compress, chunk)
+            if data: yield data
+        yield _timed(stats, compressor.flush); return
+    command = ["zstd", "-q", "-c", f"-{level}", f"-T{threads}"] + ([f"--long={ZSTD_LONG_WINDOW_LOG}"] if long_distance else [])
+    yield from pipe_through(command, chunks)
+
+def _lz4_chunks(chunks, level, threads, stats):
+    if lz4_frame is None:
+        yield from pipe_through(["lz4", "-q", "-c", f"-{level}"], chunks); return
+    if threads <= 1:
+        compressor = lz4_frame.LZ4FrameCompressor(compression_level=level)
+        yield compressor.begin()
+        for chunk in chunks:
+            data = _timed(stats, compressor.compress, chunk)
+            if data: yield data
+        yield _timed(stats, compressor.flush); return
+    # lz4 has no shared state to chain, so parallel blocks are just independent frames;
+    # lz4 -d and lz4.frame read concatenated frames as one stream
+    def collect(future):
+        data, cpu = future.result(); stats["compress_cpu_seconds"] += cpu
+        return data
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="lz4") as pool:
+        pending = deque()
+        for block in pgzip.reblock(chunks, pgzip.BLOCK_SIZE):
+            pending.append(pool.submit(_lz4_block, block, level))
+            while len(pending) >= 2 * threads: yield collect(pending.popleft())
+        while pending: yield collect(pending.popleft())
+
+def compress_chunks(fmt, chunks, level=None, threads=0, long_distance=False, stats=None):
+    # stats (optional dict): bytes_raw / bytes_compressed in and compress_cpu_seconds. gzip
+    # stores the raw bytes; zstd and lz4 compress them too, so for them it is only a count
+    level = resolve_level(fmt, level); threads = threads or pgzip.default_workers()
+    if fmt == "tar.gz": return _gzip_chunks(chunks, level, threads, stats)
+    if backend(fmt) is None: raise RuntimeError(f"{fmt} needs the '{fmt[4:]}' command or Python module")
+    if stats is None: stats = {}
+    for key in ("bytes_raw", "bytes_compressed", "compress_cpu_seconds"): stats.setdefault(key, 0)
+    chunks = _counted(chunks, stats)
+    if fmt == "tar.zst": return _zstd_chunks(chunks, level, threads, long_distance, stats)
+    if fmt == "tar.lz4": return _lz4_chunks(chunks, level, threads, stats)
+    raise ValueError(f"Unsupported compression: {fmt}")
+
+def decompress_command(fmt):
+    # Filter command for reading an artifact back (restore, benchmarks)
+    return {"tar.gz": ["gzip", "-d", "-c"], "tar.zst": ["zstd", "-q", "-d", "-c", f"--long={ZSTD_MAX_WINDOW_LOG}"],
+            "tar.lz4": ["lz4", "-q", "-d", "-c"]}[fmt]
+
+def decompress_chunks(fmt, chunks):
+    if fmt == "tar.gz":
+        decompressor = zlib.decompressobj(31)
+        for chunk in chunks:
+            data = decompressor.decompress(chunk)
+            if data: yield data
+        return
+    if fmt == "tar.zst" and zstandard is not None:
+        decompressor = zstandard.ZstdDecompressor(max_window_size=2**ZSTD_MAX_WINDOW_LOG).decompressobj()
+        for chunk in chunks:
+            data = decompressor.decompress(chunk)
+            if data: yield data
+        return
+    if fmt == "tar.lz4" and lz4_frame is not None:
+        decompressor = lz4_frame.LZ4FrameDecompressor()
+        for chunk in chunks:
+            while chunk:
+                yield decompressor.decompress(chunk)
+                chunk = decompressor.unused_data
+                if decompressor.eof: decompressor = lz4_frame.LZ4FrameDecompressor() # next concatenated frame
+        return
+    yield from pipe_through(decompress_command(fmt), chunks)
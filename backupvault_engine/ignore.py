@@ -0,0 +1,104 @@
+# backupvault_engine/ignore.py
+# Per-job exclude rules (~/.backupvault/ignore/JOB_NAME.backupignore) with .gitignore
+# semantics, matched against paths relative to each source folder:
+#   # comment, blank lines ignored, "\#" / "\!" for literal leading characters
+#   !pattern      re-include what an earlier pattern excluded (the last matching line wins)
+#   pattern/      directories only
+#   a/b, /a       anchored at the source folder; a pattern without an inner "/" matches
+#                 the name at any depth
+#   *, ?, [a-z]   within one path component; "**/", "/**/" and "/**" span directories
+# plus two predicates from the job config: files larger than a size or not modified for a
+# number of days. The patterns are compiled into a few regexes (one per run of lines with
+# the same sign) and checked by the walk, so an excluded directory is never entered. As
+# with git, nothing inside an excluded directory can be re-included.
+import os
+import re
+import stat
+import time
+
+from backupvault_engine import APP_DIR_BASE
+
+IGNORE_DIR = os.path.join(APP_DIR_BASE, "ignore")
+
+def rules_path(job_name): return os.path.join(IGNORE_DIR, f"{job_name}.backupignore")
+
+def _translate(pattern):
+    # gitignore glob -> regex source for a full relative path
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/"); out = []; i = 0; n = len(pattern)
+    while i < n:
+        if pattern.startswith("**/", i) and (i == 0 or pattern[i - 1] == "/"): out.append("(?:.*/)?"); i += 3
+        elif pattern.startswith("/**", i) and i + 3 == n: out.append("/.*"); i += 3
+        elif pattern.startswith("**", i): out.append(".*"); i += 2
+        elif pattern[i] == "*": out.append("[^/]*"); i += 1
+        elif pattern[i] == "?": out.append("[^/]"); i += 1
+        elif pattern[i] == "[":
+            end = pattern.find("]", i + 2 if pattern[i + 1:i + 2] in ("!", "^") else i + 1)
+            if end == -1: out.append(re.escape("[")); i += 1; continue
+            body = pattern[i + 1:end]
+            if body[:1] in ("!", "^"): body = "^" + body[1:]
+            out.append("[" + body.replace("\\", "\\\\") + "]"); i = end + 1
+        elif pattern[i] == "\\" and i + 1 < n: out.append(re.escape(pattern[i + 1])); i += 2
+        else: out.append(re.escape(pattern[i])); i += 1
+    return ("" if anchored else "(?:.*/)?") + "".join(out)
+
+def parse(lines):
+    # -> [(negated, directory_only, regex source)]
+    rules = []
+    for line in lines:
+        line = line.rstrip("\n").rstrip("\r")
+        if not line.endswith("\\ "): line = line.rstrip(" ")
+        if not line or line.startswith("#"): continue
+        negated = line.startswith("!")
+        if negated or line.startswith("\\!") or line.startswith("\\#"): line = line[1:]
+        directory_only = line.endswith("/"); line = line.rstrip("/")
+        if line: rules.append((negated, directory_only, _translate(line)))
+    return rules
+
+class Rules:
+    def __init__(self, patterns=(), larger_than=None, older_than_days=None):
+        # Consecutive lines with the same sign and kind become one alternation; matching
+        # walks the groups from the last line up and the first group that matches decides
+        self.groups = []
+        for negated, directory_only, source in parse(patterns):
+            if self.groups and self.groups[-1][:2] == [negated, directory_only]: self.groups[-1][2].append(source)
+            else: self.groups.append([negated, directory_only, [source]])
+        self.groups = [(negated, directory_only, re.compile("(?:%s)\\Z" % "|".join(sources), re.DOTALL))
+                       for negated, directory_only, sources in reversed(self.groups)]
+        self.larger_than = larger_than
+        self.older_than = time.time() - older_than_days * 86400 if older_than_days else None
+        self.files_skipped = 0; self.bytes_skipped = 0; self.dirs_pruned = 0
+
+    @classmethod
+    def load(cls, path, larger_than=None, older_than_days=None):
+        patterns = []
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8", errors="surrogateescape") as f: patterns = f.readlines()
+            except FileNotFoundError: pass
+        return cls(patterns, larger_than, older_than_days)
+
+    def __bool__(self): return bool(self.groups) or self.larger_than is not None or self.older_than is not None
+
+    def _pattern_excludes(self, rel, is_dir):
+        for negated, directory_only, regex in self.groups:
+            if directory_only and not is_dir: continue
+            if regex.match(rel): return not negated
+        return False
+
+    def excluded(self, rel, st):
+        # rel: path below the source folder ("" for the folder itself, never excluded)
+        if not rel: return False
+        is_dir = stat.S_ISDIR(st.st_mode)
+        skip = self._pattern_excludes(rel, is_dir)
+        if not skip and stat.S_ISREG(st.st_mode):
+            skip = (self.larger_than is not None and st.st_size > self.larger_than) or \
+                   (self.older_than is not None and st.st_mtime < self.older_than)
+        if skip:
+            if is_dir: self.dirs_pruned += 1
+            else: self.files_skipped += 1; self.bytes_skipped += st.st_size if stat.S_ISREG(st.st_mode) else 0
+        return skip
+
+    def summary(self):
+        return (f"{self.files_skipped} files ({self.bytes_skipped} bytes) skipped, "
+                f"{self.dirs_pruned} directories not entered")
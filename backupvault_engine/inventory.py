@@ -0,0 +1,152 @@
+# backupvault_engine/inventory.py
+# Inventory of the backup artifacts in a DESTINATION_DIRECTORY:
+#   JOB_NAME-YYYYMMDD_HHMMSS.tar.{gz,zst,lz4}[.gpg] / .zip[.gpg] files, rsync snapshot directories
+#   and sharded archives (directories named like an archive plus .shards, see shards.py).
+# The destination is scanned once with os.scandir and the result persisted under
+# ~/.backupvault/cache/. Later calls only re-list the destination when its directory
+# mtime changed (an artifact was created, renamed or deleted), and only stat entries
+# that are new or changed.
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from backupvault_engine import CACHE_DIR, manifest, treesize
+
+INVENTORY_VERSION = 2
+# File suffixes perform_backup can produce; anything else in the destination is ignored
+ARTIFACT_SUFFIXES = (".tar.gz.gpg", ".tar.zst.gpg", ".tar.lz4.gpg", ".zip.gpg", ".tar.gz", ".tar.zst", ".tar.lz4", ".zip")
+SHARD_SUFFIX = ".shards"
+ARTIFACT_NAME_RE = re.compile(r"^(?P<job>.+)-(?P<stamp>\d{8}_\d{6})(?P<suffix>\.[A-Za-z0-9.]+)?$")
+
+def parse_artifact_name(name, is_dir):
+    match = ARTIFACT_NAME_RE.match(name)
+    if not match: return None
+    suffix = match.group("suffix") or ""; backup_mode = "full"
+    for mode, infix in manifest.MODE_INFIXES.items(): # JOB-STAMP.incr.tar.gz
+        if suffix.startswith(f".{infix}."): suffix = suffix[len(infix) + 1:]; backup_mode = mode
+    if is_dir:
+        if suffix.endswith(SHARD_SUFFIX) and suffix[:-len(SHARD_SUFFIX)] in ARTIFACT_SUFFIXES: artifact_type = suffix[1:]
+        elif suffix: return None
+        else: artifact_type = "rsync"
+    elif suffix in ARTIFACT_SUFFIXES: artifact_type = suffix[1:]
+    else: return None
+    try: created = datetime.strptime(match.group("stamp"), "%Y%m%d_%H%M%S")
+    except ValueError: return None
+    return {"job_name": match.group("job"), "type": artifact_type, "created": created.isoformat(),
+            "encrypted": ".gpg" in f"{artifact_type}.", "backup_mode": backup_mode}
+
+def inventory_path(destination):
+    key = hashlib.sha1(os.path.realpath(destination).encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"inventory-{key}.json")
+
+class ArtifactInventory:
+    def __init__(self, destination):
+        self.destination = os.path.abspath(destination)
+        self.path = inventory_path(self.destination)
+        self.dir_mtime_ns = None
+        self.artifacts = {} # name -> record
+        self.scanned_at = None
+        self._loaded_stamp = None
+        self._lock = threading.RLock()
+        self._load()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError: return None
+
+    def _load(self):
+        self._loaded_stamp = self._file_stamp()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f: data = json.load(f)
+        except (OSError, ValueError): return
+        if data.get("version") != INVENTORY_VERSION or data.get("destination") != self.destination: return
+        self.dir_mtime_ns = data.get("dir_mtime_ns"); self.artifacts = data.get("artifacts", {})
+        self.scanned_at = data.get("scanned_at")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INVENTORY_VERSION, "destination": self.destination, "dir_mtime_ns": self.dir_mtime_ns,
+                       "scanned_at": self.scanned_at, "artifacts": self.artifacts}, f)
+        os.replace(tmp_path, self.path) # readers never see a half-written inventory
+        self._loaded_stamp = self._file_stamp()
+
+    def refresh(self, force=False):
+        # Returns True when the destination listing had to be re-read
+        with self._lock: return self._refresh(force)
+
+    def _refresh(self, force):
+        if self._file_stamp() != self._loaded_stamp: self._load() # another process (e.g. backupvault.sh) saved it
+        try: dir_mtime_ns = os.stat(self.destination).st_mtime_ns
+        except OSError:
+            if self.artifacts: self._forget_deleted({}); self.artifacts = {}; self.dir_mtime_ns = None; self._save()
+            return True
+        if not force and dir_mtime_ns == self.dir_mtime_ns: return False
+        artifacts = {}
+        with os.scandir(self.destination) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    info = parse_artifact_name(entry.name, is_dir)
+                    if info is None: continue
+                    st = entry.stat(follow_symlinks=False)
+                    previous = self.artifacts.get(entry.name)
+                    if (not force and previous and previous["mtime_ns"] == st.st_mtime_ns
+                            and previous["inode"] == st.st_ino and (is_dir or previous["size_bytes"] == st.st_size)):
+                        artifacts[entry.name] = previous; continue
+                    artifacts[entry.name] = dict(info, name=entry.name, path=entry.path, inode=st.st_ino,
+                                                 mtime_ns=st.st_mtime_ns, mtime=datetime.fromtimestamp(st.st_mtime).isoformat(),
+                                                 size_bytes=treesize.measure(entry.path, changed=[]) if is_dir else st.st_size)
+                except OSError as e:
+                    print(f"Warning: Inventory could not stat {entry.path}: {e}")
+        self._forget_deleted(artifacts); self.artifacts = artifacts; self.dir_mtime_ns = dir_mtime_ns
+        self.scanned_at = datetime.now().astimezone().isoformat(timespec="seconds")
+        try: self._save()
+        except OSError as e: print(f"Warning: Could not persist inventory {self.path}: {e}")
+        return True
+
+    def _forget_deleted(self, artifacts):
+        # Directory artifacts that are gone take their treesize index with them
+        for name, record in self.artifacts.items():
+            if name not in artifacts and (record["type"] == "rsync" or record["type"].endswith(SHARD_SUFFIX)):
+                treesize.forget(record["path"])
+
+    def update_artifact(self, name):
+        # Re-stat one artifact, e.g. once a run has finished writing into an rsync directory
+        # whose top-level mtime no longer changes
+        with self._lock:
+            self.artifacts.pop(name, None); self.dir_mtime_ns = None
+        self.refresh()
+
+    def list(self, job_name=None, older_than_days=None, artifact_type=None):
+        cutoff = time.time() - older_than_days * 86400 if older_than_days is not None else None
+        records = [a for a in self.artifacts.values()
+                   if (job_name is None or a["job_name"] == job_name)
+                   and (artifact_type is None or a["type"] == artifact_type)
+                   and (cutoff is None or a["mtime_ns"] / 1e9 < cutoff)]
+        records.sort(key=lambda a: a["created"], reverse=True)
+        return records
+
+    def latest(self, job_name):
+        records = self.list(job_name)
+        return records[0] if records else None
+
+    def total_bytes(self, job_name=None):
+        return sum(a["size_bytes"] for a in self.list(job_name))
+
+_open_inventories = {}
+
+def get_inventory(destination, refresh=True):
+    # One in-memory inventory per destination per process; refresh() is a single stat when nothing changed
+    key = os.path.abspath(destination)
+    inventory = _open_inventories.get(key)
+    if inventory is None: inventory = _open_inventories[key] = ArtifactInventory(key)
+    if refresh: inventory.refresh()
+    return inventory
@@ -0,0 +1,119 @@
+# backupvault_engine/localcopy.py
+# Local file copies for rsync-mode snapshots (COMPRESSION="none", `sync`) and for restoring
+# them. copy_file() lets the kernel do the work where it can: a FICLONE reflink first
+# (btrfs, XFS, bcachefs: the copy shares the source's extents and takes no time or space),
+# then os.copy_file_range (the data stays in the kernel, and NFS/SMB servers may copy it
+# server-side), and only then a userspace copy, which keeps the holes of sparse files.
+# When a method fails because the two filesystems do not support it, it is not tried again
+# for that pair of devices. Under a throttle (throttle.py) a reflink is free and the
+# other two pay for what they read and write, copy_file_range in READ_SIZE pieces.
+# sync_tree() is what `rsync -a --link-dest=PREVIOUS SOURCES DEST/` did: each source
+# folder is copied into DEST (its contents when it ends in "/"), and a file that matches
+# its copy in the previous snapshot (size, mtime, mode, owner) is hardlinked to it. It
+# prints the same itemized lines as rsync --itemize-changes for treesize.py.
+import errno
+import fcntl
+import os
+import shutil
+import stat
+
+from backupvault_engine import archive, sparse, throttle
+
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409) # _IOW(0x94, 9, int), not in fcntl before Python 3.12
+COPY_RANGE_SIZE = 1 << 30
+# errnos meaning "not between these two filesystems", as opposed to a failing disk
+_UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EOPNOTSUPP, errno.ENOSYS, errno.EBADF, errno.EPERM}
+_no_reflink = set(); _no_copy_range = set() # (source dev, target dev)
+METHODS = ("reflink", "copy_file_range", "userspace")
+
+def _copy_range(src_fd, dst_fd, size):
+    # -> bytes copied; copy_file_range may stop short, e.g. at the end of a file that shrank
+    copied = 0; piece = COPY_RANGE_SIZE if throttle.current() is None else sparse.READ_SIZE
+    while copied < size:
+        n = os.copy_file_range(src_fd, dst_fd, min(size - copied, piece))
+        if n == 0: break
+        copied += n; throttle.read(n); throttle.write(n)
+    return copied
+
+def _copy_userspace(src, dst, st):
+    dst = throttle.wrap(dst)
+    extents = sparse.file_extents(src.fileno(), st)
+    if extents is not None: sparse.write_extents(dst, extents, sparse.iter_extents(src.fileno(), extents), st.st_size)
+    else: shutil.copyfileobj(throttle.wrap(src), dst, sparse.READ_SIZE)
+
+def copy_file(src_path, dst_path):
+    # Copies the content of src_path to a new dst_path (mode 0600 until the caller sets the
+    # metadata); returns the method used, one of METHODS
+    with open(src_path, "rb", opener=lambda p, flags: os.open(p, flags | os.O_NOFOLLOW | os.O_NONBLOCK)) as src:
+        st = os.fstat(src.fileno())
+        if not stat.S_ISREG(st.st_mode): raise OSError(errno.EINVAL, "Not a regular file", src_path)
+        with open(dst_path, "wb", opener=lambda p, flags: os.open(p, flags | os.O_EXCL, 0o600)) as dst:
+            devices = (st.st_dev, os.fstat(dst.fileno()).st_dev)
+            if devices not in _no_reflink:
+                try: fcntl.ioctl(dst.fileno(), FICLONE, src.fileno()); return "reflink"
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED: raise
+                    _no_reflink.add(devices)
+            if devices not in _no_copy_range and hasattr(os, "copy_file_range") and not sparse.might_have_holes(st):
+                try: copied = _copy_range(src.fileno(), dst.fileno(), st.st_size)
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED: raise
+                    _no_copy_range.add(devices); dst.seek(0); dst.truncate()
+                else:
+                    if copied >= st.st_size: return "copy_file_range"
+                    dst.seek(copied); src.seek(copied) # the rest the slow way
+            _copy_userspace(src, dst, st)
+            return "userspace"
+
+def copy_metadata(path, st):
+    # What rsync -a keeps: mode, times and (as root) the owner
+    follow = not stat.S_ISLNK(st.st_mode)
+    if os.geteuid() == 0:
+        try: os.chown(path, st.st_uid, st.st_gid, follow_symlinks=follow)
+        except OSError as e: print(f"Warning: Could not set the owner of {path}: {e}")
+    if follow: os.chmod(path, stat.S_IMODE(st.st_mode))
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns), follow_symlinks=follow)
+
+def same_file(st, previous):
+    return (previous is not None and stat.S_ISREG(previous.st_mode) and previous.st_size == st.st_size
+            and int(previous.st_mtime) == int(st.st_mtime) and previous.st_mode == st.st_mode
+            and previous.st_uid == st.st_uid and previous.st_gid == st.st_gid)
+
+def sync_tree(sources, dest, link_dest=None, exclude=(), rules=None):
+    # Copies the sources into dest (created if missing) and returns the run statistics
+    # skipped: entries that could not be copied or given their metadata (rsync's exit 23)
+    stats = {"files": 0, "bytes": 0, "hardlinked": 0, "bytes_hardlinked": 0, "skipped": 0, **{m: 0 for m in METHODS}}
+    exclude = list(exclude) + [dest]; dirs = []
+    os.makedirs(dest, exist_ok=True)
+    for source in sources:
+        base = "" if source.endswith("/") else os.path.basename(source.rstrip("/"))
+        for path, _, st in archive.iter_source_entries([source], exclude, rules):
+            rel = os.path.normpath(os.path.join(base, os.path.relpath(path, source)))
+            if rel == ".": rel = ""
+            target = os.path.join(dest, rel)
+            try:
+                if stat.S_ISDIR(st.st_mode):
+                    os.makedirs(target, exist_ok=True); dirs.append((target, st))
+                    if rel: print(f"cd+++++++++ {rel}/")
+                    continue
+                if stat.S_ISLNK(st.st_mode):
+                    link = os.readlink(path); os.symlink(link, target); print(f"cL+++++++++ {rel} -> {link}")
+                elif stat.S_ISREG(st.st_mode):
+                    previous_path = os.path.join(link_dest, rel) if link_dest else None
+                    try: previous = os.lstat(previous_path) if previous_path else None
+                    except OSError: previous = None
+                    if same_file(st, previous):
+                        os.link(previous_path, target); stats["hardlinked"] += 1; stats["bytes_hardlinked"] += st.st_size
+                        continue # unchanged: rsync does not itemize it either
+                    stats[copy_file(path, target)] += 1; stats["files"] += 1; stats["bytes"] += st.st_size
+                    print(f">f+++++++++ {rel}")
+                elif stat.S_ISFIFO(st.st_mode): os.mkfifo(target); print(f"cS+++++++++ {rel}")
+                elif os.geteuid() == 0: os.mknod(target, st.st_mode, st.st_rdev); print(f"cD+++++++++ {rel}")
+                else: print(f"Warning: Skipping special file {path}"); continue
+                copy_metadata(target, st)
+            except OSError as e: print(f"Warning: Skipping {path}: {e}"); stats["skipped"] += 1
+    # Directory times last, children first, so writing into them does not undo it
+    for target, st in reversed(dirs):
+        try: copy_metadata(target, st)
+        except OSError as e: print(f"Warning: Could not set the metadata of {target}: {e}"); stats["skipped"] += 1
+    return stats
@@ -0,0 +1,90 @@
+# backupvault_engine/manifest.py
+# Per-job file-state manifest behind BACKUP_MODE=incremental/differential. For the last
+# full run and the last run of any kind it keeps, per archive member, the lstat state
+# (size, mtime_ns, inode, ctime_ns). A file is archived again when its state differs from
+# the baseline (the last run for incremental, the last full for differential); members
+# of the baseline that are gone are written to a deletion list inside the artifact.
+# Manifests live in ~/.backupvault/manifests/ (not the cache): losing one only means the
+# next run is a full one.
+import hashlib
+import json
+import os
+import time
+
+from backupvault_engine import APP_DIR_BASE
+
+MANIFEST_DIR = os.path.join(APP_DIR_BASE, "manifests")
+MANIFEST_VERSION = 1
+MODES = ("full", "incremental", "differential")
+MODE_INFIXES = {"incremental": "incr", "differential": "diff"} # JOB-STAMP.incr.tar.gz
+DELETED_MEMBER = ".backupvault-deleted" # newline separated member names removed since the baseline
+
+def manifest_path(job_name):
+    key = hashlib.sha1(job_name.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return os.path.join(MANIFEST_DIR, f"{key}.json")
+
+def file_state(st): return [st.st_size, st.st_mtime_ns, st.st_ino, st.st_ctime_ns]
+
+class JobManifest:
+    def __init__(self, job_name):
+        self.job_name = job_name; self.path = manifest_path(job_name)
+        self.full = None; self.last = None # {"run_id", "artifact", "mode", "time", "sources", "entries": {member: state}}
+
+    @classmethod
+    def load(cls, job_name):
+        manifest = cls(job_name)
+        try:
+            with open(manifest.path, "r", encoding="utf-8") as f: data = json.load(f)
+        except (OSError, ValueError): return manifest
+        if data.get("version") == MANIFEST_VERSION and data.get("job_name") == job_name:
+            manifest.full = data.get("full"); manifest.last = data.get("last")
+        return manifest
+
+    def save(self):
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "job_name": self.job_name, "full": self.full, "last": self.last}, f)
+        os.replace(tmp_path, self.path)
+
+    def baseline(self, mode, sources):
+        # Snapshot a run in `mode` compares against, or None when it has to be a full run
+        # (first run, lost manifest, or SOURCE_FOLDERS changed since the last full)
+        if mode == "full" or not self.full or self.full.get("sources") != list(sources): return None
+        snapshot = self.last if mode == "incremental" else self.full
+        return snapshot if snapshot and snapshot.get("sources") == list(sources) else None
+
+    def effective_mode(self, mode, sources):
+        return mode if self.baseline(mode, sources) is not None else "full"
+
+    def record(self, run_id, artifact, mode, sources, entries):
+        snapshot = {"run_id": run_id, "artifact": artifact, "mode": mode, "time": time.time(),
+                    "sources": list(sources), "entries": entries}
+        if mode == "full": self.full = snapshot
+        self.last = snapshot
+        self.save()
+
+class Selection:
+    # Decides, entry by entry during the archive walk, what goes into the artifact, and
+    # collects the state the manifest records once the artifact is complete
+    def __init__(self, baseline=None):
+        self.baseline = baseline["entries"] if baseline else None
+        self.entries = {}; self.changed = 0; self.unchanged = 0
+
+    def wants(self, member, st):
+        state = file_state(st)
+        if self.baseline is not None and self.baseline.get(member) == state:
+            self.entries[member] = state; self.unchanged += 1
+            return False
+        return True
+
+    def archived(self, member, st):
+        self.entries[member] = file_state(st); self.changed += 1
+
+    def failed(self, member):
+        # Keep the baseline state (or none) so the next run tries this member again
+        if self.baseline is not None and member in self.baseline: self.entries[member] = self.baseline[member]
+
+    def deleted(self):
+        if self.baseline is None: return []
+        return sorted(m for m in self.baseline if m not in self.entries)
@@ -0,0 +1,75 @@
+# backupvault_engine/pgzip.py
+# Multi-core gzip in the style of pigz: the input is cut into fixed-size blocks, each
+# block is deflated on a thread pool (zlib releases the GIL while compressing) with the
+# last 32 KiB of the previous block as its preset dictionary, and the raw deflate
+# pieces are joined, in order, between one gzip header and trailer. Non-final blocks end
+# with a sync flush so the pieces concatenate into a single valid deflate stream that
+# plain gunzip reads. Input marked compressibility.RawChunk is cut into blocks of its own
+# and deflated at level 0 (stored blocks: a copy, no matching).
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from backupvault_engine.compressibility import RawChunk
+
+BLOCK_SIZE = 1024 * 1024
+DICT_SIZE = 32 * 1024      # deflate's window; a longer dictionary would be ignored
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff" # deflate, no name, mtime 0, OS unknown
+
+def default_workers(): return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+def _deflate_block(data, dictionary, level, last):
+    # -> (deflate piece, CPU seconds spent on it)
+    started = time.thread_time()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, zdict=dictionary) if dictionary else \
+                 zlib.compressobj(level, zlib.DEFLATED, -15, 9)
+    piece = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return piece, time.thread_time() - started
+
+def reblock(chunks, block_size):
+    # Blocks of block_size; a block never mixes RawChunk input with the rest, and a raw one
+    # comes out as a RawChunk
+    buffer = bytearray(); raw = False
+    for chunk in chunks:
+        if isinstance(chunk, RawChunk) != raw:
+            if buffer: yield RawChunk(buffer) if raw else bytes(buffer); buffer.clear()
+            raw = not raw
+        buffer += chunk
+        while len(buffer) >= block_size:
+            yield RawChunk(buffer[:block_size]) if raw else bytes(buffer[:block_size]); del buffer[:block_size]
+    if buffer: yield RawChunk(buffer) if raw else bytes(buffer)
+
+def compress_chunks(chunks, level=6, workers=None, block_size=BLOCK_SIZE, stats=None):
+    # Generator: iterable of bytes in, gzip stream pieces out (in order). At most
+    # 2 * workers blocks are in flight, so memory stays bounded however big the input is.
+    # stats (optional dict): bytes_raw / bytes_compressed in, compress_cpu_seconds.
+    workers = max(1, workers or default_workers())
+    crc = 0; size = 0; pending = deque()
+    if stats is None: stats = {}
+    for key in ("bytes_raw", "bytes_compressed", "compress_cpu_seconds"): stats.setdefault(key, 0)
+
+    def collect(future):
+        piece, cpu = future.result(); stats["compress_cpu_seconds"] += cpu
+        return piece
+
+    yield GZIP_HEADER
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pgzip") as pool:
+        previous = None; dictionary = None
+        for block in reblock(chunks, block_size):
+            if previous is not None:
+                # A block is only known not to be the last once the next one has arrived
+                pending.append(pool.submit(_deflate_block, previous, dictionary, 0 if isinstance(previous, RawChunk) else level, False))
+                dictionary = previous[-DICT_SIZE:]
+            crc = zlib.crc32(block, crc); size += len(block)
+            stats["bytes_raw" if isinstance(block, RawChunk) else "bytes_compressed"] += len(block)
+            previous = block
+            while len(pending) >= 2 * workers: yield collect(pending.popleft())
+        pending.append(pool.submit(_deflate_block, previous or b"", dictionary, 0 if isinstance(previous, RawChunk) else level, True))
+        while pending: yield collect(pending.popleft())
+    yield struct.pack("<II", crc & 0xffffffff, size & 0xffffffff)
+
+def compress(data, level=6, workers=None, block_size=BLOCK_SIZE):
+    return b"".join(compress_chunks([data], level, workers, block_size))
@@ -0,0 +1,123 @@
+# backupvault_engine/preflight.py
+# Capacity check run by perform_backup before anything is written to the destination.
+# The artifact size is estimated from the current source size and the artifact/source
+# ratio of earlier runs of the same job and format (backup_size_bytes in the runs log,
+# joined with the source size recorded here at preflight time). With the legacy tar/zip
+# path and GPG the plaintext archive and its encrypted copy exist side by side until the
+# plaintext is removed, so the peak need is about twice the artifact; the streaming
+# archive engine encrypts on the fly and only ever writes the final artifact.
+# Incremental and differential runs are sized by the files that changed since their
+# manifest baseline rather than by the whole source; rsync-mode runs against a
+# --link-dest snapshot by the files that cannot be hardlinked to it (localcopy's test).
+# Every estimate walks the sources as the archive does, with the job's exclude rules.
+import csv
+import hashlib
+import json
+import os
+import stat
+import time
+
+from backupvault_engine import APP_DIR_BASE, CACHE_DIR, archive, localcopy, manifest, storage_history
+
+RUNS_LOG_CSV = os.path.join(APP_DIR_BASE, "logs", "backup_runs.csv")
+OBSERVATIONS_KEPT = 50         # per job
+RATIO_RUNS = 5                 # use the largest ratio of this many recent comparable runs
+SAFETY_FACTOR = 1.10           # sources grow while they are being archived
+MIN_HEADROOM_BYTES = 256 * 1024**2 # keep the destination volume from being filled to the last block
+
+def observations_path(job_name):
+    key = hashlib.sha1(job_name.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"preflight-{key}.json")
+
+def artifact_kind(compression, encryption):
+    return compression + ("+gpg" if encryption == "gpg" and compression != "none" else "")
+
+def _exclude(destination):
+    # tar/zip/sync leave the destination out when it lives inside a source
+    return [destination] if destination and os.path.isdir(destination) else []
+
+def source_bytes(sources, destination=None, rules=None):
+    # The walk the archive makes, with the same exclude rules (ignore.Rules)
+    total = 0
+    for path, arcname, st in archive.iter_source_entries(sources, _exclude(destination), rules):
+        if not stat.S_ISDIR(st.st_mode): total += st.st_size
+    return total
+
+def changed_source_bytes(baseline, sources, destination=None, rules=None):
+    # What an incremental/differential run against `baseline` will actually read
+    selection = manifest.Selection(baseline); total = 0
+    for path, arcname, st in archive.iter_source_entries(sources, _exclude(destination), rules):
+        if stat.S_ISREG(st.st_mode) and selection.wants(arcname, st): total += st.st_size
+    return total
+
+def snapshot_changed_bytes(link_dest, sources, destination=None, rules=None):
+    # What a run against the `link_dest` snapshot copies: one walk of the sources, each
+    # regular file compared with its copy in the snapshot as localcopy.sync_tree does
+    total = 0; exclude = _exclude(destination)
+    for source in sources:
+        base = "" if source.endswith("/") else os.path.basename(source.rstrip("/"))
+        for path, _, st in archive.iter_source_entries([source], exclude, rules):
+            if not stat.S_ISREG(st.st_mode): continue
+            try: previous = os.lstat(os.path.join(link_dest, os.path.normpath(os.path.join(base, os.path.relpath(path, source)))))
+            except OSError: previous = None
+            if not localcopy.same_file(st, previous): total += st.st_size
+    return total
+
+def _load_observations(job_name):
+    try:
+        with open(observations_path(job_name), "r", encoding="utf-8") as f: return json.load(f).get("runs", [])
+    except (OSError, ValueError): return []
+
+def _save_observations(job_name, runs):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = observations_path(job_name); tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f: json.dump({"job_name": job_name, "runs": runs[-OBSERVATIONS_KEPT:]}, f)
+    os.replace(tmp_path, path)
+
+def _successful_run_sizes(job_name):
+    sizes = {}
+    if not os.path.exists(RUNS_LOG_CSV): return sizes
+    try:
+        with open(RUNS_LOG_CSV, "r", newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if row.get("job_name") != job_name or not (row.get("status") or "").lower().startswith("success"): continue
+                try: sizes[row["run_id"]] = int(row.get("backup_size_bytes") or 0)
+                except ValueError: continue
+    except (OSError, csv.Error) as e: print(f"Warning: Preflight could not read {RUNS_LOG_CSV}: {e}")
+    return sizes
+
+def estimate(job_name, sources, compression, encryption, destination=None, archive_engine="python", mode="full",
+             link_dest=None, rules=None):
+    kind = artifact_kind(compression, encryption)
+    baseline = manifest.JobManifest.load(job_name).baseline(mode, sources) \
+               if archive_engine == "python" and compression != "none" else None # link-dest snapshots have no manifest
+    snapshot = compression == "none" and link_dest and os.path.isdir(link_dest)
+    if baseline: src = changed_source_bytes(baseline, sources, destination, rules)
+    elif snapshot: src = snapshot_changed_bytes(link_dest, sources, destination, rules)
+    else: src = source_bytes(sources, destination, rules)
+    result = {"kind": kind, "mode": mode if baseline or snapshot else "full", "source_bytes": src, "ratio": 1.0,
+              "method": "source_size"}
+    if compression != "none":
+        # rsync mode copies every byte into a fresh directory, so it stays at ratio 1.0
+        sizes = _successful_run_sizes(job_name)
+        ratios = [sizes[o["run_id"]] / o["source_bytes"] for o in _load_observations(job_name)
+                  if o.get("kind") == kind and o.get("source_bytes") and sizes.get(o.get("run_id"))]
+        if ratios: result["ratio"] = max(ratios[-RATIO_RUNS:]); result["method"] = "history"
+    result["artifact_bytes"] = int(src * result["ratio"])
+    two_copies = kind.endswith("+gpg") and archive_engine == "legacy"
+    result["peak_bytes"] = result["artifact_bytes"] * (2 if two_copies else 1)
+    result["required_bytes"] = int(result["peak_bytes"] * SAFETY_FACTOR) + MIN_HEADROOM_BYTES
+    return result
+
+def check(destination, job_name, sources, compression, encryption, run_id=None, archive_engine="python", mode="full",
+          link_dest=None, rules=None):
+    result = estimate(job_name, sources, compression, encryption, destination, archive_engine, mode, link_dest, rules)
+    result["free_bytes"] = storage_history.volume_usage(destination).free
+    result["fits"] = result["required_bytes"] <= result["free_bytes"]
+    if run_id:
+        # Remembered so the next preflight can turn this run's backup_size_bytes into a ratio
+        runs = _load_observations(job_name)
+        runs.append({"run_id": run_id, "kind": result["kind"], "source_bytes": result["source_bytes"], "time": time.time()})
+        try: _save_observations(job_name, runs)
+        except OSError as e: print(f"Warning: Could not persist preflight observations: {e}")
+    return result
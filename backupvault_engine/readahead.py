@@ -0,0 +1,85 @@
+# backupvault_engine/readahead.py
+# Read-ahead for the archive writer. On NFS/SMB sources every open, stat and first read is
+# a round trip, and tar/zip pay them one file at a time. prefetch() takes the walk's
+# entries in order and has a thread pool open, fstat and read the small regular files
+# ahead of the writer, then hands everything back in the original order. The number of
+# files in flight follows Little's law: observed per-file latency divided by the time the
+# writer spends per entry (so a fast local disk keeps it at MIN_WINDOW and a slow mount
+# grows it up to max_workers), and the bytes held in memory stay under max_bytes.
+# Anything that cannot be prefetched (larger files, failures) comes back as None and the
+# writer opens it itself as before, reporting any error the usual way.
+import math
+import os
+import stat
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from backupvault_engine import throttle
+
+MAX_WORKERS = 32
+MIN_WINDOW = 2
+PREFETCH_FILE_SIZE = 1024 * 1024 # files up to this size are read whole
+READAHEAD_BYTES = 64 * 1024 * 1024
+EWMA_WEIGHT = 0.1
+
+class Prefetched:
+    # An open file with its fstat and content; the consumer closes it
+    def __init__(self, file, st, data):
+        self.file = file; self.st = st; self.data = data
+
+    def close(self): self.file.close()
+
+    def __enter__(self): return self
+
+    def __exit__(self, *exc_info): self.close()
+
+def _read(path):
+    # -> (Prefetched or None, seconds). O_NOFOLLOW/O_NONBLOCK: the entry may have been
+    # replaced by a symlink or a FIFO since the walk saw it
+    started = time.monotonic()
+    try: fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK)
+    except OSError: return None, time.monotonic() - started
+    f = os.fdopen(fd, "rb")
+    try:
+        st = os.fstat(fd)
+        if stat.S_ISREG(st.st_mode) and st.st_size <= PREFETCH_FILE_SIZE:
+            data = f.read(PREFETCH_FILE_SIZE + 1); throttle.read(len(data))
+            if len(data) <= PREFETCH_FILE_SIZE: return Prefetched(f, st, data), time.monotonic() - started
+    except OSError: pass
+    f.close(); return None, time.monotonic() - started
+
+def prefetch(entries, max_workers=MAX_WORKERS, max_bytes=READAHEAD_BYTES, stats=None):
+    # (path, arcname, lstat) in -> (path, arcname, lstat, Prefetched or None) out, same order.
+    # stats (optional dict) gets the peak window and the mean per-file latency.
+    entries = iter(entries); pending = deque(); held = 0; exhausted = False
+    window = MIN_WINDOW; peak = MIN_WINDOW; latency = None; per_entry = None; files = 0; total_latency = 0.0
+    pool = ThreadPoolExecutor(max(max_workers, 1), thread_name_prefix="readahead")
+    try:
+        while True:
+            while not exhausted and len(pending) < window and held < max_bytes:
+                entry = next(entries, None)
+                if entry is None: exhausted = True; break
+                st = entry[2]; future = None
+                if max_workers > 0 and stat.S_ISREG(st.st_mode) and st.st_size <= PREFETCH_FILE_SIZE:
+                    future = pool.submit(_read, entry[0]); held += st.st_size
+                pending.append((entry, future))
+            if not pending: break
+            (path, arcname, st), future = pending.popleft(); prefetched = None
+            if future is not None:
+                prefetched, seconds = future.result(); held -= st.st_size; files += 1; total_latency += seconds
+                latency = seconds if latency is None else latency + EWMA_WEIGHT * (seconds - latency)
+            handed_over = time.monotonic()
+            yield path, arcname, st, prefetched
+            spent = time.monotonic() - handed_over
+            per_entry = spent if per_entry is None else per_entry + EWMA_WEIGHT * (spent - per_entry)
+            if latency is not None:
+                window = max(MIN_WINDOW, min(max_workers, math.ceil(latency / max(per_entry, 1e-5)) + 1))
+                peak = max(peak, window)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        for _, future in pending: # the consumer stopped early
+            if future is not None and not future.cancelled() and future.result()[0] is not None: future.result()[0].close()
+        if stats is not None:
+            stats["readahead_window"] = peak
+            stats["file_latency_ms"] = round(1000 * total_latency / files, 3) if files else 0.0
@@ -0,0 +1,337 @@
+# backupvault_engine/repository.py
+# Deduplicating repository behind COMPRESSION="repo". Layout of DESTINATION/backupvault-repo/:
+#   config                          format version and chunker parameters
+#   packs/XX/ID.pack                ~PACK_SIZE of chunks (each zstd/zlib compressed or stored
+#                                   as is) followed by the pack's own index of them
+#   index/                          chunkindex.py's on-disk lookup table over all the packs
+#   snapshots/JOB-STAMP.snapshot    gzip JSON tree of one run: metadata and chunk ids per entry
+#                                   (plus the data extents of files with holes, see sparse.py)
+# Files are cut with chunker.py and chunks are named by the SHA-256 of their content. A
+# chunk the repository already has is never compressed or written again, and a file whose
+# lstat state matches the job's previous snapshot from this host is not even read. Several
+# jobs and hosts can share one repository. A run that dies leaves at most a .tmp pack:
+# snapshots only reference chunks whose pack and index are on disk.
+# However small the files, the repository grows by whole packs: one file created, one
+# fsync and one object for rclone per ~64 MiB instead of per source file. (Packs from
+# before the index moved into the pack have it next to them as ID.idx; both are read.)
+# Chunks whose sampled entropy says they are already compressed (compressibility.py) are
+# stored raw without a compression attempt.
+import gzip
+import hashlib
+import json
+import os
+import socket
+import stat
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from backupvault_engine import archive, chunker, chunkindex, compressibility, inventory, manifest, pgzip, sparse, throttle
+
+try: import zstandard
+except ImportError: zstandard = None
+
+REPO_DIR_NAME = "backupvault-repo"
+REPO_VERSION = 1
+PACK_MAGIC = b"BVPACK2\n"
+PACK_FOOTER = struct.Struct("<QII8s") # offset of the index records, record count, their CRC-32, magic
+PACK_FOOTER_MAGIC = b"BVPEND2\n"
+PACK_SIZE = 64 * 1024 * 1024 # a pack is closed once it is this big
+# hash, offset in the pack, stored length, plain length, codec
+IDX_RECORD = struct.Struct("<32sQIIB")
+CODEC_RAW, CODEC_ZLIB, CODEC_ZSTD = 0, 1, 2
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+SNAPSHOT_SUFFIX = ".snapshot"
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try: os.fsync(fd)
+    finally: os.close(fd)
+
+def _write_durably(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data); f.flush(); os.fsync(f.fileno())
+    os.replace(tmp_path, path); _fsync_dir(os.path.dirname(path))
+
+def _compress(data):
+    # (codec, blob, CPU seconds spent compressing or None if not tried); chunks that do not
+    # get smaller are stored as they are
+    if compressibility.looks_incompressible(data): return CODEC_RAW, data, None
+    started = time.thread_time()
+    if zstandard is not None: codec, blob = CODEC_ZSTD, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    else: codec, blob = CODEC_ZLIB, zlib.compress(data, ZLIB_LEVEL)
+    cpu = time.thread_time() - started
+    return (codec, blob, cpu) if len(blob) < len(data) else (CODEC_RAW, data, cpu)
+
+def _decompress(codec, blob):
+    if codec == CODEC_RAW: return blob
+    if codec == CODEC_ZLIB: return zlib.decompress(blob)
+    if codec == CODEC_ZSTD:
+        if zstandard is None: raise RuntimeError("This repository has zstd chunks; install the 'zstandard' module to read it")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    raise ValueError(f"Unknown chunk codec {codec}")
+
+class _PackWriter:
+    def __init__(self, repo):
+        self.repo = repo; self.pack_id = os.urandom(16).hex()
+        self.path = repo.pack_path(self.pack_id)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        self.file = open(self.tmp_path, "wb"); self.file.write(PACK_MAGIC)
+        self.records = []
+
+    def append(self, digest, codec, blob, plain_length):
+        offset = self.file.tell(); throttle.write(len(blob)); self.file.write(blob)
+        self.records.append((digest, offset, len(blob), plain_length, codec))
+        return offset
+
+    def size(self): return self.file.tell()
+
+    def finish(self):
+        # Chunks, their index and the footer go to disk as one file; the rename is what
+        # makes the pack exist, so a crash leaves either all of it or a .tmp
+        records = b"".join(IDX_RECORD.pack(*r) for r in self.records); records_offset = self.file.tell()
+        self.file.write(records + PACK_FOOTER.pack(records_offset, len(self.records), zlib.crc32(records), PACK_FOOTER_MAGIC))
+        self.file.flush(); os.fsync(self.file.fileno()); self.file.close()
+        os.replace(self.tmp_path, self.path); _fsync_dir(os.path.dirname(self.path))
+
+    def discard(self):
+        self.file.close()
+        try: os.remove(self.tmp_path)
+        except OSError: pass
+
+class Repository:
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.index = None # digest -> (pack id, offset, stored length, plain length, codec)
+        self._readers = {}
+
+    @classmethod
+    def open(cls, path, create=False, bloom_fp_rate=chunkindex.BLOOM_FP_RATE, bloom_max_bytes=chunkindex.BLOOM_MAX_BYTES):
+        repo = cls(path); config_path = os.path.join(repo.path, "config")
+        if not os.path.exists(config_path):
+            if not create: raise FileNotFoundError(f"No BackupVault repository at {repo.path}")
+            for sub in ("packs", "snapshots"): os.makedirs(os.path.join(repo.path, sub), exist_ok=True)
+            config = {"version": REPO_VERSION, "chunk_hash": "sha256", "chunker": {
+                "min_size": chunker.MIN_SIZE, "avg_size": chunker.AVG_SIZE, "max_size": chunker.MAX_SIZE}}
+            _write_durably(config_path, json.dumps(config, indent=2).encode())
+        with open(config_path, "r", encoding="utf-8") as f: repo.config = json.load(f)
+        if repo.config.get("version") != REPO_VERSION:
+            raise RuntimeError(f"Unsupported repository version {repo.config.get('version')} at {repo.path}")
+        repo._open_index(create, bloom_fp_rate, bloom_max_bytes)
+        return repo
+
+    def pack_path(self, pack_id, suffix=".pack"):
+        return os.path.join(self.path, "packs", pack_id[:2], pack_id + suffix)
+
+    def _read_pack_index(self, pack_id):
+        legacy_path = self.pack_path(pack_id, ".idx")
+        if os.path.exists(legacy_path):
+            with open(legacy_path, "rb") as f: return f.read()
+        with open(self.pack_path(pack_id), "rb") as f:
+            f.seek(0, os.SEEK_END); size = f.tell()
+            if size < len(PACK_MAGIC) + PACK_FOOTER.size: raise ValueError("too short")
+            f.seek(size - PACK_FOOTER.size); records_offset, count, crc, magic = PACK_FOOTER.unpack(f.read(PACK_FOOTER.size))
+            if magic != PACK_FOOTER_MAGIC or records_offset + count * IDX_RECORD.size != size - PACK_FOOTER.size:
+                raise ValueError("no pack footer")
+            f.seek(records_offset); records = f.read(count * IDX_RECORD.size)
+        if zlib.crc32(records) != crc: raise ValueError("pack index checksum mismatch")
+        return records
+
+    def pack_records(self):
+        # (digest, record) of every chunk, from the packs' own indexes
+        packs_dir = os.path.join(self.path, "packs")
+        for sub in sorted(os.listdir(packs_dir)):
+            for name in sorted(os.listdir(os.path.join(packs_dir, sub))):
+                if not name.endswith(".pack"): continue
+                pack_id = name[:-5]
+                try: data = self._read_pack_index(pack_id)
+                except (OSError, ValueError) as e: print(f"Warning: Skipping unreadable pack {name}: {e}"); continue
+                for digest, offset, length, plain_length, codec in IDX_RECORD.iter_unpack(data):
+                    yield digest, (pack_id, offset, length, plain_length, codec)
+
+    def _open_index(self, writable, bloom_fp_rate, bloom_max_bytes):
+        index_path = os.path.join(self.path, "index")
+        if chunkindex.ChunkIndex.exists(index_path) or writable:
+            rebuild = not chunkindex.ChunkIndex.exists(index_path)
+            self.index = chunkindex.ChunkIndex.open(index_path, writable, bloom_fp_rate, bloom_max_bytes)
+            if rebuild:
+                for digest, record in self.pack_records(): self.index.add(digest, record)
+                self.index.merge()
+        else: self.index = dict(self.pack_records()) # read-only and never indexed
+
+    def read_chunk(self, digest):
+        pack_id, offset, length, plain_length, codec = self.index[digest]
+        reader = self._readers.get(pack_id)
+        if reader is None: reader = self._readers[pack_id] = open(self.pack_path(pack_id), "rb")
+        reader.seek(offset); data = _decompress(codec, reader.read(length))
+        if len(data) != plain_length or hashlib.sha256(data).digest() != digest:
+            raise ValueError(f"Corrupt chunk {digest.hex()} in pack {pack_id}")
+        return data
+
+    def close(self):
+        for reader in self._readers.values(): reader.close()
+        self._readers = {}
+        if isinstance(self.index, chunkindex.ChunkIndex): self.index.close()
+
+    def snapshot_path(self, name): return os.path.join(self.path, "snapshots", name + SNAPSHOT_SUFFIX)
+
+    def snapshot_names(self, job_name=None):
+        names = [n[:-len(SNAPSHOT_SUFFIX)] for n in os.listdir(os.path.join(self.path, "snapshots")) if n.endswith(SNAPSHOT_SUFFIX)]
+        parsed = {n: inventory.parse_artifact_name(n, is_dir=True) for n in names}
+        names = [n for n, info in parsed.items() if info and (job_name is None or info["job_name"] == job_name)]
+        return sorted(names, key=lambda n: parsed[n]["created"], reverse=True)
+
+    def load_snapshot(self, name):
+        with gzip.open(self.snapshot_path(name), "rt", encoding="utf-8", errors="surrogateescape") as f: return json.load(f)
+
+    def write_snapshot(self, name, snapshot):
+        data = json.dumps(snapshot, separators=(",", ":"), ensure_ascii=False).encode("utf-8", "surrogateescape")
+        _write_durably(self.snapshot_path(name), gzip.compress(data, 6))
+
+class _ChunkStore:
+    # Hashes chunks on the calling thread and compresses only the new ones on a pool,
+    # appending them to the current pack in submission order
+    def __init__(self, repo, workers, stats):
+        self.repo = repo; self.stats = stats; self.workers = max(1, workers or pgzip.default_workers())
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="repo")
+        self.pending = deque(); self.in_flight = set() # digests not in the repository index yet
+        self.pack = None; self.unindexed = []
+
+    def add(self, data):
+        digest = hashlib.sha256(data).digest()
+        if digest in self.repo.index or digest in self.in_flight:
+            self.stats["chunks_deduplicated"] += 1; return digest
+        self.pending.append((digest, len(data), self.pool.submit(_compress, data))); self.in_flight.add(digest)
+        self.stats["chunks_new"] += 1; self.stats["bytes_new"] += len(data)
+        while len(self.pending) >= 2 * self.workers: self._write_next()
+        return digest
+
+    def _write_next(self):
+        digest, plain_length, future = self.pending.popleft(); codec, blob, cpu = future.result()
+        if cpu is None: self.stats["bytes_raw"] += plain_length
+        else: self.stats["bytes_compressed"] += plain_length; self.stats["compress_cpu_seconds"] += cpu
+        if self.pack is None: self.pack = _PackWriter(self.repo)
+        offset = self.pack.append(digest, codec, blob, plain_length)
+        self.unindexed.append((digest, (self.pack.pack_id, offset, len(blob), plain_length, codec)))
+        self.stats["bytes_stored"] += len(blob)
+        if self.pack.size() >= PACK_SIZE: self._finish_pack()
+
+    def _finish_pack(self):
+        self.pack.finish()
+        # Indexed only once the pack is durable
+        for digest, record in self.unindexed: self.repo.index.add(digest, record); self.in_flight.discard(digest)
+        self.repo.index.flush(); self.unindexed = []; self.pack = None
+
+    def flush(self):
+        while self.pending: self._write_next()
+        if self.pack is not None: self._finish_pack()
+
+    def close(self, ok):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        if not ok and self.pack is not None: self.pack.discard(); self.pack = None
+
+def _entry(arcname, st):
+    entry = {"path": arcname, "mode": st.st_mode, "uid": st.st_uid, "gid": st.st_gid, "mtime_ns": st.st_mtime_ns}
+    if stat.S_ISDIR(st.st_mode): entry["type"] = "dir"
+    elif stat.S_ISLNK(st.st_mode): entry["type"] = "symlink"
+    elif stat.S_ISREG(st.st_mode): entry.update(type="file", size=st.st_size, state=manifest.file_state(st))
+    else: return None
+    return entry
+
+def parent_snapshot(repo, job_name, host, sources):
+    # The job's newest snapshot taken on this host from the same sources: its lstat states
+    # are only meaningful for the same filesystems
+    for name in repo.snapshot_names(job_name):
+        try: snapshot = repo.load_snapshot(name)
+        except (OSError, ValueError) as e: print(f"Warning: Skipping unreadable snapshot {name}: {e}"); continue
+        if snapshot.get("host") == host and snapshot.get("sources") == list(sources): return name, snapshot
+    return None, None
+
+def backup(repo_path, name, job_name, sources, exclude=(), workers=0,
+           bloom_fp_rate=chunkindex.BLOOM_FP_RATE, bloom_max_bytes=chunkindex.BLOOM_MAX_BYTES, rules=None):
+    # Stores one snapshot of `sources` as `name` (JOB-STAMP) and returns the run statistics
+    started = time.monotonic(); host = socket.gethostname()
+    repo = Repository.open(repo_path, True, bloom_fp_rate, bloom_max_bytes)
+    parent_name, parent = parent_snapshot(repo, job_name, host, sources)
+    previous = {e["path"]: e for e in parent["entries"] if e.get("type") == "file"} if parent else {}
+    stats = {"files": 0, "files_unchanged": 0, "bytes_in": 0, "chunks_new": 0, "chunks_deduplicated": 0,
+             "bytes_new": 0, "bytes_stored": 0, "sparse_files": 0, "hole_bytes": 0,
+             "bytes_raw": 0, "bytes_compressed": 0, "compress_cpu_seconds": 0.0, "parent": parent_name}
+    store = _ChunkStore(repo, workers, stats); entries = []; ok = False
+    try:
+        for path, arcname, st in archive.iter_source_entries(sources, exclude, rules):
+            entry = _entry(arcname, st)
+            if entry is None: print(f"Warning: Skipping special file {path}"); continue
+            try:
+                if entry["type"] == "symlink": entry["target"] = os.readlink(path)
+                elif entry["type"] == "file":
+                    old = previous.get(arcname)
+                    if old and old["state"] == entry["state"] and all(repo.index.lookup_many(map(bytes.fromhex, old["chunks"])).values()):
+                        entry["chunks"] = old["chunks"]; stats["files_unchanged"] += 1
+                        if "sparse" in old: entry["sparse"] = old["sparse"]
+                    else:
+                        extents = None
+                        if sparse.might_have_holes(st):
+                            fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK)
+                            try: extents = sparse.file_extents(fd, os.fstat(fd))
+                            finally: os.close(fd)
+                        if extents is not None:
+                            entry["sparse"] = extents; stats["sparse_files"] += 1
+                            stats["hole_bytes"] += sparse.hole_bytes(extents, st.st_size)
+                        entry["chunks"] = [store.add(chunk).hex() for chunk in chunker.file_chunks(path, extents=extents)]
+                        stats["bytes_in"] += st.st_size if extents is None else st.st_size - sparse.hole_bytes(extents, st.st_size)
+                    stats["files"] += 1
+            except OSError as e: print(f"Warning: Skipping {path}: {e}"); continue
+            entries.append(entry)
+        store.flush()
+        repo.write_snapshot(name, {"version": REPO_VERSION, "name": name, "job_name": job_name, "host": host,
+                                   "time": time.time(), "sources": list(sources), "parent": parent_name, "entries": entries})
+        ok = True
+    finally:
+        store.close(ok)
+        stats.update({f"index_{k}" if k in ("hits", "misses") else k: v for k, v in repo.index.counters.items()})
+        stats["bloom_bytes"] = repo.index.bloom.memory_bytes()
+        stats["bloom_fp_rate"] = round(repo.index.bloom.estimated_fp_rate(), 6)
+        repo.close()
+    stats["seconds"] = round(time.monotonic() - started, 2)
+    return stats
+
+def _target_path(root, member):
+    path = os.path.realpath(os.path.join(root, member))
+    if path != root and not path.startswith(root + os.sep): raise ValueError(f"Snapshot member escapes the target: {member}")
+    return path
+
+def restore_snapshot(snapshot_file, target_dir, wanted=lambda name: True):
+    # Restores a repository snapshot (REPO/snapshots/NAME.snapshot); returns the entry count
+    repo = Repository.open(os.path.dirname(os.path.dirname(os.path.abspath(snapshot_file))))
+    snapshot = repo.load_snapshot(os.path.basename(snapshot_file)[:-len(SNAPSHOT_SUFFIX)])
+    root = os.path.realpath(target_dir); os.makedirs(root, exist_ok=True)
+    count = 0; dirs = []
+    try:
+        for entry in snapshot["entries"]:
+            if not wanted(entry["path"]): continue
+            path = _target_path(root, entry["path"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if entry["type"] == "dir":
+                os.makedirs(path, exist_ok=True); dirs.append((path, entry))
+            elif entry["type"] == "symlink":
+                if os.path.lexists(path): os.remove(path)
+                os.symlink(entry["target"], path)
+            else:
+                with open(path, "wb") as f:
+                    chunks = (repo.read_chunk(bytes.fromhex(chunk_id)) for chunk_id in entry["chunks"])
+                    if "sparse" in entry: sparse.write_extents(f, entry["sparse"], chunks, entry["size"])
+                    else:
+                        for chunk in chunks: f.write(chunk)
+                os.chmod(path, stat.S_IMODE(entry["mode"])); os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            count += 1
+        # Directory times last, children first, so writing into them does not undo it
+        for path, entry in reversed(dirs):
+            os.chmod(path, stat.S_IMODE(entry["mode"])); os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+    finally: repo.close()
+    return count
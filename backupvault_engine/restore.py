@@ -0,0 +1,142 @@
+# backupvault_engine/restore.py
+# Extracts any artifact perform_backup can produce into a target directory:
+#   .tar.{gz,zst,lz4}[.gpg] are streamed file -> gpg -d -> decompressor -> tar reader,
+#   .zip[.gpg] is read in place (decrypted to a temporary file first, zip needs to seek);
+#   zip stores holes as zeros, so runs of zeros are written back as holes (sparse.py),
+#   rsync snapshot directories are copied (reflinked where the filesystem can, see localcopy.py),
+#   repository snapshots (backupvault-repo/snapshots/NAME.snapshot) are rebuilt from their chunks,
+#   sharded archives (NAME.tar.zst.shards/) restore their shards in parallel.
+# Incremental/differential artifacts carry a list of members deleted since their baseline;
+# restoring them on top of the full (and, for incrementals, every earlier incremental)
+# removes those paths from the target as well.
+import io
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import zipfile
+
+from backupvault_engine import compressors, inventory, localcopy, manifest, repository, shards, sparse
+
+READ_SIZE = 1024 * 1024
+
+def artifact_format(path):
+    # ("tar.zst", True) for NAME.tar.zst.gpg; ("rsync", False) for a snapshot directory
+    if shards.is_sharded(path): return "shards", shards.load_manifest(path)["encrypted"]
+    if os.path.isdir(path): return "rsync", False
+    name = os.path.basename(path)
+    if name.endswith(repository.SNAPSHOT_SUFFIX): return "repo", False
+    for suffix in inventory.ARTIFACT_SUFFIXES:
+        if name.endswith(suffix):
+            encrypted = suffix.endswith(".gpg")
+            return suffix[1:-4] if encrypted else suffix[1:], encrypted
+    raise ValueError(f"Not a BackupVault artifact: {name}")
+
+class _ChunkReader(io.RawIOBase):
+    # Read-only file object over an iterator of byte chunks, for tarfile's stream mode
+    def __init__(self, chunks):
+        self._chunks = iter(chunks); self._pending = b""
+
+    def readable(self): return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            self._pending = next(self._chunks, None)
+            if self._pending is None: self._pending = b""; return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]; self._pending = self._pending[n:]
+        return n
+
+def _file_chunks(path):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk: return
+            yield chunk
+
+def _wanted(name, members):
+    name = name.rstrip("/")
+    return not members or any(name == m or name.startswith(m + "/") for m in members)
+
+def _apply_deletions(data, target_dir, members):
+    root = os.path.realpath(target_dir)
+    # Children before parents, so emptied directories can go too
+    for name in sorted(data.decode("utf-8", "surrogateescape").splitlines(), reverse=True):
+        if not name or not _wanted(name, members): continue
+        path = os.path.realpath(os.path.join(root, name))
+        if not path.startswith(root + os.sep): continue # never outside the target
+        try:
+            if os.path.isdir(path) and not os.path.islink(path): os.rmdir(path)
+            else: os.remove(path)
+        except FileNotFoundError: pass
+        except OSError as e: print(f"Warning: Could not remove deleted path {path}: {e}")
+
+def _extract_zip_member(zf, name, target_dir):
+    # zf.extract(name, target_dir), with the zeros of a file written back as holes
+    zinfo = zf.getinfo(name)
+    if zinfo.is_dir(): zf.extract(zinfo, target_dir); return
+    # The same path sanitizing as zipfile: no drive, no absolute path, no ".." components
+    parts = [p for p in os.path.splitdrive(name)[1].replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    if not parts: return
+    path = os.path.join(target_dir, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with zf.open(zinfo) as src, open(path, "wb") as dst:
+        sparse.write_holes(dst, iter(lambda: src.read(READ_SIZE), b""))
+
+def _restore_tree(artifact_path, target_dir, members):
+    # An rsync snapshot directory, copied back entry by entry (os.walk lists symlinks to
+    # directories with the directories, so they are picked out there)
+    count = 0; dirs = []
+    for root, subdirs, files in os.walk(artifact_path):
+        rel_root = os.path.relpath(root, artifact_path)
+        for name in subdirs + files:
+            rel = os.path.normpath(os.path.join(rel_root, name))
+            if not _wanted(rel, members): continue
+            src = os.path.join(root, name); dst = os.path.join(target_dir, rel); st = os.lstat(src)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if stat.S_ISDIR(st.st_mode): os.makedirs(dst, exist_ok=True); dirs.append((dst, st))
+            else:
+                if os.path.islink(dst) or (os.path.lexists(dst) and not os.path.isdir(dst)): os.remove(dst)
+                if stat.S_ISREG(st.st_mode): localcopy.copy_file(src, dst); localcopy.copy_metadata(dst, st)
+                else: shutil.copy2(src, dst, follow_symlinks=False)
+            count += 1
+    # Directory modes and times last, children first, so writing into them does not undo it
+    for dst, st in reversed(dirs):
+        try: localcopy.copy_metadata(dst, st)
+        except OSError as e: print(f"Warning: Could not set the metadata of {dst}: {e}")
+    return count
+
+def restore(artifact_path, target_dir, members=()):
+    # Returns the number of entries restored. members: archive paths (as listed by
+    # `tar -t`, without a leading "/") to restore, with everything below them.
+    fmt, encrypted = artifact_format(artifact_path)
+    members = [m.strip("/") for m in members]
+    os.makedirs(target_dir, exist_ok=True)
+    if fmt == "rsync": return _restore_tree(artifact_path, target_dir, members)
+    if fmt == "shards": return shards.restore_sharded(artifact_path, target_dir, members)
+    if fmt == "repo": return repository.restore_snapshot(artifact_path, target_dir, lambda name: _wanted(name, members))
+    chunks = _file_chunks(artifact_path)
+    if encrypted: chunks = compressors.pipe_through(["gpg", "--batch", "--quiet", "--decrypt"], chunks)
+    if fmt == "zip":
+        with tempfile.TemporaryFile(dir=target_dir) as plain:
+            for chunk in chunks: plain.write(chunk)
+            plain.seek(0)
+            with zipfile.ZipFile(plain) as zf:
+                names = [n for n in zf.namelist() if n != manifest.DELETED_MEMBER and _wanted(n, members)]
+                for name in names: _extract_zip_member(zf, name, target_dir)
+                if manifest.DELETED_MEMBER in zf.namelist():
+                    _apply_deletions(zf.read(manifest.DELETED_MEMBER), target_dir, members)
+                return len(names)
+    reader = io.BufferedReader(_ChunkReader(compressors.decompress_chunks(fmt, chunks)), READ_SIZE)
+    count = 0
+    with tarfile.open(fileobj=reader, mode="r|") as tar:
+        for member in tar:
+            if member.name == manifest.DELETED_MEMBER:
+                _apply_deletions(tar.extractfile(member).read(), target_dir, members); continue
+            if not _wanted(member.name, members): continue
+            # "tar" filter (where available): no absolute paths or members escaping target_dir
+            if hasattr(tarfile, "tar_filter"): tar.extract(member, target_dir, filter="tar")
+            else: tar.extract(member, target_dir)
+            count += 1
+    return count
@@ -0,0 +1,147 @@
+# backupvault_engine/shards.py
+# Sharded archives (ARCHIVE_SHARDS > 1): one logical backup written as N archives by N
+# worker processes, so the walk, tar/zip, compression and gpg of each shard run on their
+# own core. The artifact is a directory:
+#   JOB-STAMP.tar.zst[.gpg].shards/shard-01-of-04.tar.zst[.gpg] ... shards.json
+# and shards.json, written last, is what makes it a complete backup.
+# plan() splits the sources into N shards of about the same size. Sizes come from
+# treesize.py's cached per-directory index (a stale index only unbalances the shards, it
+# never loses files): a source or directory bigger than half a shard's share is replaced
+# by its subdirectories and big files until the pieces are small enough, then the pieces
+# are dealt out largest first to the least loaded shard. Every worker walks all the
+# sources but only enters the pieces it owns; the directories that were split are
+# archived by every shard (so each shard restores on its own) and the small files
+# directly inside them are spread by hash.
+# Restore and upload take the shards in parallel as well. A throttled run splits its
+# bandwidth and IOPS limits evenly between the shard processes.
+import json
+import os
+import shutil
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from backupvault_engine import archive, inventory, pgzip, readahead, throttle, treesize
+
+SHARD_SUFFIX = inventory.SHARD_SUFFIX
+MANIFEST_NAME = "shards.json"
+SHARDS_VERSION = 1
+MAX_PIECES_PER_SHARD = 64 # stop splitting once there are this many pieces per shard
+
+def _subtree_sizes(source):
+    # {directory path: bytes below it} from the cached treesize index (scanned once if missing)
+    index = treesize.TreeSizeIndex.load(source)
+    if index is None:
+        index = treesize.TreeSizeIndex(source).scan([(source, os.lstat(source), True)])
+        try: index.save()
+        except OSError as e: print(f"Warning: Could not persist treesize index for {source}: {e}")
+    sizes = {}
+    for rel, size in index.dirs.items():
+        while True:
+            sizes[rel] = sizes.get(rel, 0) + size
+            if not rel: break
+            rel = os.path.dirname(rel)
+    return {os.path.join(source, rel) if rel else source: size for rel, size in sizes.items()}
+
+def plan(sources, count):
+    # -> {"count", "split": [directory paths], "pieces": {path: shard}, "loads": [bytes per shard]}
+    sizes = {}; pieces = {}; split = []
+    for source in sources:
+        if os.path.isdir(source) and not os.path.islink(source):
+            sizes.update(_subtree_sizes(source)); pieces[source] = sizes.get(source, 0)
+        else:
+            try: pieces[source] = os.lstat(source).st_size
+            except OSError as e: print(f"Warning: Skipping {source}: {e}")
+    share = sum(pieces.values()) / count; loose = 0 # bytes of small files directly inside split directories
+    while len(pieces) < MAX_PIECES_PER_SHARD * count:
+        path = max((p for p in pieces if p in sizes), key=pieces.get, default=None)
+        if path is None or pieces[path] <= share / 2: break
+        children = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False): children[entry.path] = sizes.get(entry.path, 0); continue
+                    try: size = entry.stat(follow_symlinks=False).st_size
+                    except OSError: continue
+                    # Big files are placed like subdirectories, the rest are spread by hash
+                    if size >= share / MAX_PIECES_PER_SHARD: children[entry.path] = size
+                    else: loose += size
+        except OSError: sizes.pop(path); continue # unlistable: keep it whole
+        del pieces[path]; split.append(path); sizes.pop(path); pieces.update(children)
+    loads = [loose // count] * count; owners = {}
+    for path in sorted(pieces, key=pieces.get, reverse=True):
+        shard = loads.index(min(loads)); owners[path] = shard; loads[shard] += pieces[path]
+    return {"count": count, "split": split, "pieces": owners, "loads": loads}
+
+class ShardFilter:
+    # Used by archive.iter_source_entries: which entries of the walk belong to one shard
+    def __init__(self, shard_plan, shard):
+        self.count = shard_plan["count"]; self.shard = shard
+        self.split = set(shard_plan["split"]); self.pieces = shard_plan["pieces"]
+
+    def owns(self, path):
+        if path in self.split: return True
+        owner = self.pieces.get(path)
+        if owner is not None: return owner == self.shard
+        if os.path.dirname(path) in self.split: # a file next to split subdirectories, or new since the plan
+            return zlib.crc32(os.fsencode(path)) % self.count == self.shard
+        return True # inside a piece this shard entered
+
+def shard_name(shard, count, suffix): return f"shard-{shard + 1:02d}-of-{count:02d}{suffix}"
+
+def _build_shard(output_path, archive_format, sources, exclude, gpg_recipient, threads, level, long_distance,
+                 readahead_workers, rules, shard_plan, shard, throttle_settings):
+    if throttle_settings: throttle.install(throttle.Throttle(**throttle_settings, share=shard_plan["count"]))
+    stats = archive.create_archive(output_path, archive_format, sources, exclude, gpg_recipient, threads, level,
+                                   long_distance, None, readahead_workers, rules, ShardFilter(shard_plan, shard))
+    if rules: stats["ignored"] = (rules.files_skipped, rules.bytes_skipped, rules.dirs_pruned)
+    if throttle_settings: stats["throttle_waited"] = throttle.current().waited
+    return stats
+
+def create_sharded(output_dir, archive_format, sources, count, exclude=(), gpg_recipient=None, threads=0, level=None,
+                   long_distance=False, readahead_workers=readahead.MAX_WORKERS, rules=None):
+    # Writes output_dir (NAME.FORMAT[.gpg].shards) and returns the run statistics; like
+    # create_archive, nothing is left behind when a shard fails
+    started = time.monotonic(); shard_plan = plan(sources, count)
+    suffix = f".{archive_format}" + (".gpg" if gpg_recipient else "")
+    # The cores are shared out between the shards' compressors
+    shard_threads = max(1, (threads or pgzip.default_workers()) // count)
+    throttle_settings = throttle.current().settings() if throttle.current() is not None else None
+    part_dir = output_dir + ".part"; shutil.rmtree(part_dir, ignore_errors=True); os.makedirs(part_dir)
+    try:
+        with ProcessPoolExecutor(max_workers=count) as pool:
+            futures = [pool.submit(_build_shard, os.path.join(part_dir, shard_name(k, count, suffix)), archive_format, sources,
+                                   exclude, gpg_recipient, shard_threads, level, long_distance, readahead_workers,
+                                   rules, shard_plan, k, throttle_settings) for k in range(count)]
+            results = [f.result() for f in futures]
+        manifest = {"version": SHARDS_VERSION, "format": archive_format, "encrypted": bool(gpg_recipient),
+                    "sources": list(sources), "created": time.time(),
+                    "shards": [{"file": shard_name(k, count, suffix), "files": r["files"], "bytes_in": r["bytes_in"],
+                                "bytes_out": r["bytes_out"], "planned_bytes": shard_plan["loads"][k]} for k, r in enumerate(results)]}
+        with open(os.path.join(part_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2); f.flush(); os.fsync(f.fileno())
+        shutil.rmtree(output_dir, ignore_errors=True); os.replace(part_dir, output_dir)
+    except BaseException:
+        shutil.rmtree(part_dir, ignore_errors=True); raise
+    if throttle_settings:
+        for r in results: throttle.current().add_waited(r.pop("throttle_waited"))
+    if rules: # each worker counted into its own copy of the rules
+        for r in results:
+            files, size, dirs = r.pop("ignored"); rules.files_skipped += files; rules.bytes_skipped += size; rules.dirs_pruned += dirs
+    stats = {key: sum(r[key] for r in results) for key in ("files", "bytes_in", "bytes_out", "sparse_files", "hole_bytes",
+                                                          "bytes_raw", "bytes_compressed", "compress_cpu_seconds")}
+    stats.update(seconds=round(time.monotonic() - started, 3), shards=results)
+    return stats
+
+def is_sharded(path): return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST_NAME))
+
+def load_manifest(path):
+    with open(os.path.join(path, MANIFEST_NAME), "r", encoding="utf-8") as f: return json.load(f)
+
+def restore_sharded(artifact_dir, target_dir, members=(), workers=0):
+    # Each shard restores on its own (split directories are in all of them), so they run in parallel
+    from backupvault_engine import restore
+    files = [os.path.join(artifact_dir, s["file"]) for s in load_manifest(artifact_dir)["shards"]]
+    os.makedirs(target_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=max(1, min(len(files), workers or pgzip.default_workers()))) as pool:
+        return sum(pool.map(restore.restore, files, [target_dir] * len(files), [list(members)] * len(files)))
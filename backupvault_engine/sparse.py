@@ -0,0 +1,101 @@
+# backupvault_engine/sparse.py
+# Sparse files (thin-provisioned VM images, database files) for the archive writer and the
+# repository. A regular file with fewer blocks allocated than its size may have holes;
+# data_extents() asks the filesystem where its data is (lseek SEEK_DATA / SEEK_HOLE) and
+# only those extents are ever read. tar stores them as a GNU sparse member (PAX format
+# 1.0, extracted back into holes by GNU tar and by Python's tarfile), repository snapshots
+# keep the extent list next to the chunks, and restore seeks over the gaps instead of
+# writing zeros. Filesystems without SEEK_DATA, or files whose missing blocks are only
+# compression, are read as before.
+import errno
+import io
+import os
+import stat
+
+from backupvault_engine import throttle
+
+READ_SIZE = 1024 * 1024
+MIN_HOLE_BYTES = 64 * 1024 # files with less than this unallocated are not worth the lseeks
+
+def might_have_holes(st):
+    return (stat.S_ISREG(st.st_mode) and hasattr(st, "st_blocks") and hasattr(os, "SEEK_DATA")
+            and st.st_size - st.st_blocks * 512 >= MIN_HOLE_BYTES)
+
+def data_extents(fd, size):
+    # -> [(offset, length)] of the data in the first `size` bytes, or None when the
+    # filesystem cannot tell (no holes are assumed then)
+    extents = []; offset = 0
+    while offset < size:
+        try: start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO: break # only a hole up to the end
+            return None
+        if start >= size: break
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        extents.append((start, end - start)); offset = end
+    return extents
+
+def file_extents(fd, st):
+    # The data extents of an open file if it really has holes, else None
+    if not might_have_holes(st): return None
+    extents = data_extents(fd, st.st_size)
+    if extents is None or extents == [(0, st.st_size)]: return None
+    return extents
+
+def hole_bytes(extents, size): return size - sum(length for _, length in extents)
+
+def iter_extents(fd, extents):
+    # The extents' data back to back, in blocks of at most READ_SIZE. A file that shrank
+    # since the extents were taken reads as zeros, so the length never changes under a
+    # writer that has already announced it.
+    for offset, length in extents:
+        while length:
+            data = os.pread(fd, min(length, READ_SIZE), offset)
+            if not data: data = bytes(min(length, READ_SIZE))
+            else: throttle.read(len(data))
+            yield data; offset += len(data); length -= len(data)
+
+class ExtentReader(io.RawIOBase):
+    # Read-only stream of `header` followed by the extents' data (for tarfile.addfile)
+    def __init__(self, fd, extents, header=b""):
+        self._blocks = iter_extents(fd, extents); self._pending = memoryview(header)
+
+    def readable(self): return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            block = next(self._blocks, None)
+            if block is None: return 0
+            self._pending = memoryview(block)
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]; self._pending = self._pending[n:]
+        return n
+
+def write_holes(f, blocks):
+    # Writes the blocks back to back into the file opened as f, seeking over every
+    # MIN_HOLE_BYTES window that is all zeros, so it becomes a hole again (for formats
+    # that store holes as zeros, like zip); returns the size written
+    zeros = bytes(MIN_HOLE_BYTES); size = 0
+    for block in blocks:
+        view = memoryview(block)
+        for start in range(0, len(view), MIN_HOLE_BYTES):
+            window = view[start:start + MIN_HOLE_BYTES]
+            if window == zeros[:len(window)]: f.seek(len(window), os.SEEK_CUR)
+            else: f.write(window)
+        size += len(block)
+    f.truncate(size)
+    return size
+
+def write_extents(f, extents, blocks, size):
+    # Writes the extents' data (an iterable of byte blocks, back to back) at their offsets
+    # in the file opened as f and sets its size; what lies between them stays a hole
+    blocks = iter(blocks); pending = memoryview(b"")
+    for offset, length in extents:
+        f.seek(offset)
+        while length:
+            if not pending:
+                block = next(blocks, None)
+                if block is None: raise ValueError("Sparse file data is shorter than its extents")
+                pending = memoryview(block)
+            n = min(length, len(pending)); f.write(pending[:n]); pending = pending[n:]; length -= n
+    f.truncate(size)
@@ -0,0 +1,146 @@
+# backupvault_engine/storage_history.py
+# Fixed-size time series of destination volume usage, plus a days-until-full forecast.
+# One file per destination under ~/.backupvault/cache/ holds two ring buffers of
+# (timestamp, total, used, free) slots: one per minute for a day and one per hour for a
+# year. Recording a sample is one statvfs and two 32-byte pwrites, and the file never grows.
+import hashlib
+import os
+import shutil
+import struct
+import threading
+import time
+
+from backupvault_engine import CACHE_DIR
+
+MAGIC = b"BVSTOR01"
+HEADER = struct.Struct("<8sII") # magic, minute slots, hour slots
+SLOT = struct.Struct("<dQQQ")   # unix time, total, used, free (bytes)
+MINUTE_SLOTS = 24 * 60
+HOUR_SLOTS = 365 * 24
+SAMPLE_INTERVAL_SECONDS = 60
+TREND_WINDOW_DAYS = 30          # regression window for the disk-usage trend
+MIN_TREND_SPAN_HOURS = 6        # shorter histories fall back to backup sizes from the runs log
+
+def history_path(destination):
+    key = hashlib.sha1(os.path.realpath(destination).encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"storage-{key}.ring")
+
+def volume_usage(path):
+    # Same parent-directory fallback as data_parser.get_storage_usage for a not-yet-created destination
+    while path and not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path: break
+        path = parent
+    return shutil.disk_usage(path or "/")
+
+class StorageHistory:
+    def __init__(self, destination):
+        self.destination = destination
+        self.path = history_path(destination)
+        self._lock = threading.Lock()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        header = os.pread(fd, HEADER.size, 0)
+        if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, MINUTE_SLOTS, HOUR_SLOTS):
+            # New or incompatible file: lay out header and zeroed slots once
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, HEADER.pack(MAGIC, MINUTE_SLOTS, HOUR_SLOTS), 0)
+            os.ftruncate(fd, HEADER.size + (MINUTE_SLOTS + HOUR_SLOTS) * SLOT.size)
+        return fd
+
+    def record(self, now=None, usage=None):
+        now = time.time() if now is None else now
+        total, used, free = usage if usage is not None else volume_usage(self.destination)
+        slot = SLOT.pack(now, total, used, free)
+        minute_offset = HEADER.size + (int(now // 60) % MINUTE_SLOTS) * SLOT.size
+        hour_offset = HEADER.size + (MINUTE_SLOTS + int(now // 3600) % HOUR_SLOTS) * SLOT.size
+        with self._lock:
+            fd = self._open()
+            try:
+                os.pwrite(fd, slot, minute_offset)
+                os.pwrite(fd, slot, hour_offset) # the hourly slot keeps the latest sample of its hour
+            finally: os.close(fd)
+        return {"time": now, "total": total, "used": used, "free": free}
+
+    def samples(self, resolution="hour", since=None):
+        if not os.path.exists(self.path): return []
+        with self._lock:
+            with open(self.path, "rb") as f: data = f.read()
+        if len(data) < HEADER.size or HEADER.unpack_from(data, 0) != (MAGIC, MINUTE_SLOTS, HOUR_SLOTS): return []
+        if resolution == "minute": start, count, max_age = HEADER.size, MINUTE_SLOTS, MINUTE_SLOTS * 60
+        else: start, count, max_age = HEADER.size + MINUTE_SLOTS * SLOT.size, HOUR_SLOTS, HOUR_SLOTS * 3600
+        cutoff = time.time() - max_age # slots older than one lap of the ring are left-overs
+        if since is not None: cutoff = max(cutoff, since)
+        points = []
+        for timestamp, total, used, free in SLOT.iter_unpack(data[start:start + count * SLOT.size]):
+            if timestamp and timestamp >= cutoff:
+                points.append({"time": timestamp, "total": total, "used": used, "free": free})
+        points.sort(key=lambda p: p["time"])
+        return points
+
+def _linear_slope(xs, ys):
+    n = len(xs)
+    mean_x = sum(xs) / n; mean_y = sum(ys) / n
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0: return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+
+def forecast(samples, backup_events=(), now=None):
+    # samples: dicts from StorageHistory.samples(); backup_events: (unix_time, bytes) of successful
+    # runs. Returns the growth rate and projected days until the volume is full.
+    now = time.time() if now is None else now
+    result = {"method": None, "growth_bytes_per_day": None, "days_until_full": None, "projected_full_time": None}
+    if not samples: return result
+    latest = samples[-1]
+    window = [s for s in samples if s["time"] >= now - TREND_WINDOW_DAYS * 86400]
+    slope = None
+    if len(window) >= 3 and window[-1]["time"] - window[0]["time"] >= MIN_TREND_SPAN_HOURS * 3600:
+        slope = _linear_slope([s["time"] for s in window], [s["used"] for s in window])
+        if slope is not None: result["method"] = "disk_trend"
+    if slope is None:
+        recent = [(t, b) for t, b in backup_events if t >= now - TREND_WINDOW_DAYS * 86400 and b > 0]
+        if len(recent) >= 2:
+            span = max(now - min(t for t, _ in recent), 86400)
+            slope = sum(b for _, b in recent) / span # retention does not delete yet, so every run adds up
+            result["method"] = "backup_sizes"
+    if slope is None: return result
+    result["growth_bytes_per_day"] = slope * 86400
+    if slope > 0:
+        seconds_left = latest["free"] / slope
+        result["days_until_full"] = round(seconds_left / 86400, 1)
+        result["projected_full_time"] = latest["time"] + seconds_left
+    return result
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+def get_history(destination):
+    key = os.path.abspath(destination)
+    with _histories_lock:
+        if key not in _histories: _histories[key] = StorageHistory(key)
+        return _histories[key]
+
+class StorageSampler:
+    # Background thread recording one sample per minute for whatever destination
+    # destination_fn() currently returns (it may change when the config is edited)
+    def __init__(self, destination_fn, interval=SAMPLE_INTERVAL_SECONDS):
+        self.destination_fn = destination_fn; self.interval = interval
+        self._thread = None; self._stop = threading.Event()
+
+    def start(self):
+        if self._thread: return
+        self._thread = threading.Thread(target=self._run, name="storage-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self): self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                destination = self.destination_fn()
+                if destination: get_history(destination).record()
+            except Exception as e: print(f"Warning: storage sample failed: {e}")
+            # Align to minute boundaries so each sample lands in its own minute slot
+            if self._stop.wait(self.interval - time.time() % self.interval): return
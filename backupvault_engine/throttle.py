@@ -0,0 +1,240 @@
+# backupvault_engine/throttle.py
+# Resource limits for a backup run (THROTTLE_* in the job config), so the nightly run
+# leaves disk and cores to the production workload on the same host. Every read of
+# source data and every write of artifact or repository data pays into token buckets:
+# MiB per second each way and I/O operations per second, an operation being what the
+# device sees of a sequential stream (one per OP_SIZE, at least one per call). A caller
+# that takes more than the bucket holds sleeps until it is paid off, so a limit holds on
+# average over about a second, and the time slept is reported per bucket (summed over
+# the threads that slept).
+# The limits can be changed while a run is in progress: the job's control file
+# (~/.backupvault/throttle/JOB_NAME.limits, READ_MBPS= / WRITE_MBPS= / IOPS= lines) is
+# checked once a second. A key it sets overrides the job config, empty or 0 lifts that
+# limit, and a key that is left out (or a missing file) goes back to the job config.
+# Priorities are set once at start, before any thread exists, so every thread and gpg
+# inherit them: nice, an ionice class, and cgroup v2 cpu.weight / io.weight in a
+# cgroup of the run's own (backupvault-JOB-PID, next to the engine's) when the cgroup tree
+# is writable. The process moves back and removes that cgroup when it exits.
+# install() makes a Throttle the process's; read(), write() and wrap() do nothing without one.
+import atexit
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+from backupvault_engine import APP_DIR_BASE
+
+THROTTLE_DIR = os.path.join(APP_DIR_BASE, "throttle")
+CONTROL_INTERVAL = 1.0 # seconds between checks of the control file
+OP_SIZE = 128 * 1024
+PIECE_SIZE = 1024 * 1024 # a throttled big read is paid for in pieces of this, not in one burst
+KINDS = ("read", "write", "iops")
+CONTROL_KEYS = {"READ_MBPS": "read", "WRITE_MBPS": "write", "IOPS": "iops"}
+IONICE_CLASSES = {"best-effort": "2", "idle": "3"}
+CGROUP_ROOT = "/sys/fs/cgroup"
+CGROUP_PREFIX = "backupvault"
+
+_current = None
+
+def control_path(job_name): return os.path.join(THROTTLE_DIR, f"{job_name}.limits")
+
+class TokenBucket:
+    # `rate` tokens per second with up to one second's worth saved up; no rate = no limit
+    def __init__(self, rate=None):
+        self.lock = threading.Lock(); self.rate = None; self.tokens = 0.0; self.stamp = time.monotonic()
+        self.set_rate(rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate: self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill(); self.rate = rate or None
+            self.tokens = min(self.tokens, self.rate) if self.rate else 0.0
+
+    def take(self, amount):
+        # -> seconds the caller has to sleep. The tokens are taken at once, into debt if
+        # need be, so callers in other threads queue behind the debt
+        with self.lock:
+            if not self.rate: return 0.0
+            self._refill(); self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+def read_control(path):
+    # -> {kind: limit or None} for the keys the control file sets
+    limits = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"): continue
+            key, sep, value = line.partition("=")
+            if not sep or key.strip() not in CONTROL_KEYS: raise ValueError(f"Unknown line: {line}")
+            value = value.strip().strip('"').strip("'")
+            limits[CONTROL_KEYS[key.strip()]] = (float(value) or None) if value else None
+    return limits
+
+def describe(limits):
+    mib = lambda value: f"{value:g} MiB/s" if value else "no limit"
+    iops = f"{limits['iops']:g} IOPS" if limits["iops"] else "no IOPS limit"
+    return f"read {mib(limits['read'])}, write {mib(limits['write'])}, {iops}"
+
+class Throttle:
+    def __init__(self, read_mbps=None, write_mbps=None, iops=None, control_file=None, share=1):
+        # share: the number of processes splitting these limits (one per shard)
+        self.configured = {"read": read_mbps or None, "write": write_mbps or None, "iops": iops or None}
+        self.control_file = control_file; self.share = share
+        self.buckets = {kind: TokenBucket() for kind in KINDS}
+        self.waited = {kind: 0.0 for kind in KINDS}; self.limits = None
+        self._lock = threading.Lock(); self._control_lock = threading.Lock()
+        self._control_state = None; self._checked = 0.0
+        self._apply(self.configured); self._check_control()
+
+    def settings(self):
+        # What another process needs to enforce its share of the same limits
+        return {"read_mbps": self.configured["read"], "write_mbps": self.configured["write"],
+                "iops": self.configured["iops"], "control_file": self.control_file}
+
+    def _apply(self, limits):
+        self.limits = limits
+        for kind in KINDS:
+            rate = limits[kind] * (1 if kind == "iops" else 1024 * 1024) if limits[kind] else None
+            self.buckets[kind].set_rate(rate / self.share if rate else None)
+
+    def _check_control(self):
+        now = time.monotonic()
+        if self.control_file is None or now - self._checked < CONTROL_INTERVAL: return
+        if not self._control_lock.acquire(blocking=False): return # another thread is at it
+        try:
+            self._checked = now
+            try: st = os.stat(self.control_file); state = (st.st_mtime_ns, st.st_size)
+            except OSError: state = None
+            if state == self._control_state: return
+            self._control_state = state; limits = dict(self.configured)
+            if state is not None:
+                try: limits.update(read_control(self.control_file))
+                except (OSError, ValueError) as e:
+                    print(f"Warning: Ignoring throttle control file {self.control_file}: {e}"); return
+            if limits != self.limits:
+                self._apply(limits); print(f"INFO: Throttle limits now {describe(limits)}")
+        finally: self._control_lock.release()
+
+    def _take(self, kind, nbytes):
+        self._check_control()
+        # Both buckets are paid at once and the caller sleeps for the one further behind
+        wait = self.buckets[kind].take(nbytes); wait_ops = self.buckets["iops"].take(max(1, -(-nbytes // OP_SIZE)))
+        if wait or wait_ops:
+            time.sleep(max(wait, wait_ops))
+            with self._lock: self.waited[kind if wait >= wait_ops else "iops"] += max(wait, wait_ops)
+
+    def read(self, nbytes): self._take("read", nbytes)
+
+    def write(self, nbytes): self._take("write", nbytes)
+
+    def add_waited(self, waited):
+        # Folds in what a shard's process waited
+        with self._lock:
+            for kind in KINDS: self.waited[kind] += waited.get(kind, 0.0)
+
+    def __bool__(self):
+        return any(self.limits.values()) or any(self.configured.values()) or any(self.waited.values())
+
+    def summary(self):
+        return (f"waited {self.waited['read']:.2f}s for read bandwidth, {self.waited['write']:.2f}s for write "
+                f"bandwidth, {self.waited['iops']:.2f}s for IOPS ({describe(self.limits)})")
+
+class _Throttled:
+    # File wrapper that pays for its reads and writes; everything else is the file's own
+    def __init__(self, f, throttle): self._f = f; self._throttle = throttle
+
+    def read(self, n=-1):
+        if n is None or n < 0 or n <= PIECE_SIZE:
+            data = self._f.read(n); self._throttle.read(len(data)); return data
+        out = bytearray()
+        while len(out) < n:
+            piece = self._f.read(min(n - len(out), PIECE_SIZE))
+            if not piece: break
+            self._throttle.read(len(piece)); out += piece
+        return bytes(out)
+
+    def write(self, data):
+        self._throttle.write(len(data)); return self._f.write(data)
+
+    def __getattr__(self, name): return getattr(self._f, name)
+
+def install(throttle):
+    global _current
+    _current = throttle; return throttle
+
+def current(): return _current
+
+def read(nbytes):
+    if _current is not None: _current.read(nbytes)
+
+def write(nbytes):
+    if _current is not None: _current.write(nbytes)
+
+def wrap(f): return f if _current is None else _Throttled(f, _current)
+
+def _leave_cgroup(original, group):
+    # atexit: back to the cgroup the process started in, so its own can be removed
+    try:
+        with open(os.path.join(original, "cgroup.procs"), "w") as f: f.write(str(os.getpid()))
+        os.rmdir(group)
+    except OSError as e: print(f"Warning: Could not remove cgroup {group}: {e}")
+
+def _join_cgroup(cpu_weight, io_weight, name):
+    # -> the cgroup directory this process was moved into; OSError when the tree is not writable
+    with open("/proc/self/cgroup", "r", encoding="utf-8") as f:
+        own = next((line[3:].strip() for line in f if line.startswith("0::")), None)
+    if own is None or not os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers")):
+        raise OSError("cgroup v2 is not mounted at " + CGROUP_ROOT)
+    original = os.path.join(CGROUP_ROOT, own.lstrip("/")).rstrip("/")
+    # A sibling, not a child: a cgroup with processes in it cannot hand controllers down
+    parent = os.path.dirname(original)
+    label = re.sub(r"[^A-Za-z0-9_.-]", "_", name) if name else "run"
+    group = os.path.join(parent, f"{CGROUP_PREFIX}-{label}-{os.getpid()}")
+    os.makedirs(group, exist_ok=True)
+    try:
+        for controller, weight, files, value in (("cpu", cpu_weight, ("cpu.weight",), f"{cpu_weight}"),
+                                                 ("io", io_weight, ("io.weight", "io.bfq.weight"), f"default {io_weight}")):
+            if weight is None: continue
+            found = lambda: next((os.path.join(group, f) for f in files if os.path.exists(os.path.join(group, f))), None)
+            if found() is None: # the controller is not enabled below the parent yet
+                try:
+                    with open(os.path.join(parent, "cgroup.subtree_control"), "w") as f: f.write(f"+{controller}")
+                except OSError: pass
+            path = found()
+            if path is None: print(f"Warning: The cgroup {controller} controller is not available; {files[0]} not set"); continue
+            with open(path, "w") as f: f.write(value)
+        with open(os.path.join(group, "cgroup.procs"), "w") as f: f.write(str(os.getpid()))
+    except OSError:
+        try: os.rmdir(group)
+        except OSError: pass
+        raise
+    atexit.register(_leave_cgroup, original, group)
+    return group
+
+def set_priority(nice=None, ionice=None, cpu_weight=None, io_weight=None, name=None):
+    # name: the job, for the cgroup's name
+    # Best effort: what cannot be applied is a warning, never a failed run
+    if nice is not None:
+        try:
+            current_nice = os.nice(0)
+            if nice > current_nice: os.nice(nice - current_nice)
+        except OSError as e: print(f"Warning: Could not set nice {nice}: {e}")
+    if ionice:
+        command = shutil.which("ionice")
+        if command is None: print("Warning: ionice not found; I/O class not set")
+        else:
+            args = [command, "-c", IONICE_CLASSES[ionice]]
+            # best-effort takes its level from the CPU niceness, as the kernel does by default
+            if ionice == "best-effort": args += ["-n", str(min(7, max(0, (os.nice(0) + 20) // 5)))]
+            result = subprocess.run(args + ["-p", str(os.getpid())], capture_output=True, text=True)
+            if result.returncode != 0: print(f"Warning: Could not set I/O class {ionice}: {result.stderr.strip()}")
+    if cpu_weight is not None or io_weight is not None:
+        try: print(f"INFO: Running in cgroup {_join_cgroup(cpu_weight, io_weight, name)}")
+        except OSError as e: print(f"Warning: cgroup weights not applied: {e}")
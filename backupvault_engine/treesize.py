@@ -0,0 +1,221 @@
+# backupvault_engine/treesize.py
+# Tree sizing for rsync-mode artifacts, replacing `du -sb`. Directories are scanned by a
+# pool of os.scandir workers (the syscalls release the GIL), every entry is stat'ed once,
+# and files with more than one link are counted once per inode, as du does. The result is
+# kept as a per-directory index (bytes and mtime of each directory) in ~/.backupvault/cache/.
+# A new --link-dest snapshot starts from the index of the snapshot it was linked against:
+# only the directories holding files rsync itemized, and those whose mtime moved (entries
+# added, removed or renamed), are rescanned. The index only remembers inodes that are
+# linked from more than one place inside its own tree, not the links between snapshots.
+# reclaimable_bytes() answers the retention question for hardlink (--link-dest) snapshots:
+# how much space deleting a set of them actually gives back.
+import hashlib
+import json
+import os
+import re
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from backupvault_engine import CACHE_DIR
+
+INDEX_VERSION = 2
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 4) * 4) # I/O bound: more threads than cores
+MAX_SAVED_LINKS = 200000 # a tree with more shared inodes than this is not indexed
+# Lines of rsync --itemize-changes output, e.g. ">f+++++++++ src/a.txt", "cd+++++++++ src/dir/",
+# "*deleting   src/old.txt"
+RSYNC_ITEM_RE = re.compile(r"^(?:(?P<item>[<>ch.][fdLDS][^ ]{9})|(?P<deleting>\*deleting)) +(?P<path>.+)$")
+
+def index_path(root):
+    key = hashlib.sha1(os.path.realpath(root).encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"treesize-{key}.json")
+
+def forget(root):
+    # Drops the index of a tree that has been deleted
+    try: os.remove(index_path(root))
+    except FileNotFoundError: pass
+    except OSError as e: print(f"Warning: Could not remove treesize index for {root}: {e}")
+
+def _scan_dir(path):
+    # Direct children only: returns (bytes of non-directory entries with a single link,
+    # [(subdir path, subdir's lstat)], [((dev, ino), size) for multiply-linked files])
+    direct = 0; subdirs = []; links = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                st = entry.stat(follow_symlinks=False)
+                if entry.is_dir(follow_symlinks=False): subdirs.append((entry.path, st))
+                elif st.st_nlink > 1: links.append(((st.st_dev, st.st_ino), st.st_size))
+                else: direct += st.st_size
+            except OSError: pass
+    return direct, subdirs, links
+
+class TreeSizeIndex:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.dirs = {}   # relative dir -> bytes attributed to it (own size + files + first-seen hardlinks)
+        self.mtimes = {} # relative dir -> st_mtime_ns when it was scanned
+        self.links = {}  # "dev:ino" -> [relative dir that counted it, size]
+        self.shared = set() # keys of `links` met in more than one directory entry; only these are saved
+
+    @property
+    def total_bytes(self): return sum(self.dirs.values())
+
+    def _rel(self, path):
+        rel = os.path.relpath(path, self.root)
+        return "" if rel == "." else rel
+
+    def _forget(self, rel, recursive):
+        prefix = rel + os.sep
+        doomed = [d for d in self.dirs if d == rel or (recursive and (rel == "" or d.startswith(prefix)))]
+        doomed_set = set(doomed)
+        for d in doomed: del self.dirs[d]; self.mtimes.pop(d, None)
+        for key in [k for k, (owner, _) in self.links.items() if owner in doomed_set]: del self.links[key]
+
+    def scan(self, start_paths, workers=DEFAULT_WORKERS):
+        # Scan each start path's direct entries; recurse into subdirectories that are not
+        # indexed yet (all of them on a first scan). start_paths: [(path, lstat, recursive)]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            pending = {}
+            for path, st, recursive in start_paths:
+                pending[pool.submit(_scan_dir, path)] = (path, st, recursive)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, st, recursive = pending.pop(future)
+                    rel = self._rel(path)
+                    try: direct, subdirs, links = future.result()
+                    except OSError as e:
+                        print(f"Warning: treesize could not scan {path}: {e}"); continue
+                    # Links counted from this directory before are re-attributed from scratch
+                    if rel in self.dirs:
+                        for key in [k for k, (owner, _) in self.links.items() if owner == rel]: del self.links[key]
+                    total = st.st_size + direct
+                    for (dev, ino), size in links:
+                        key = f"{dev}:{ino}"
+                        if key not in self.links: self.links[key] = [rel, size]; total += size
+                        else: self.shared.add(key)
+                    self.dirs[rel] = total; self.mtimes[rel] = st.st_mtime_ns
+                    for sub_path, sub_st in subdirs:
+                        if recursive or self._rel(sub_path) not in self.dirs:
+                            pending[pool.submit(_scan_dir, sub_path)] = (sub_path, sub_st, True)
+        return self
+
+    def apply_changes(self, changed, workers=DEFAULT_WORKERS, check_dirs=False):
+        # changed: (path relative to root, is_deletion, is_dir) from rsync's itemized output.
+        # check_dirs: the index was taken from the --link-dest snapshot. rsync itemizes every
+        # directory of the new tree as created and never lists what it left out, so directory
+        # lines are ignored and each indexed directory is lstat'ed instead: a moved mtime
+        # gets it rescanned, a missing one is dropped
+        dirty = {}
+        if check_dirs:
+            gone = set()
+            for rel in list(self.dirs):
+                try: st = os.lstat(os.path.join(self.root, rel) if rel else self.root)
+                except OSError: gone.add(rel); continue
+                if not stat.S_ISDIR(st.st_mode): gone.add(rel)
+                elif st.st_mtime_ns != self.mtimes.get(rel): dirty[rel] = False
+            for rel in gone: del self.dirs[rel]; self.mtimes.pop(rel, None)
+            for key in [k for k, (owner, _) in self.links.items() if owner in gone]: del self.links[key]
+        for rel, deleting, is_dir in changed:
+            if check_dirs and is_dir: continue
+            rel = rel.rstrip("/").rstrip(os.sep)
+            parent = os.path.dirname(rel)
+            if deleting and is_dir: self._forget(rel, recursive=True)
+            if is_dir and not deleting: dirty[rel] = rel not in self.dirs # new dir: walk all of it
+            dirty.setdefault(parent, False)
+        starts = []; walked = []
+        for rel in sorted(dirty, key=lambda r: (r.count(os.sep), r)):
+            if any(rel.startswith(w + os.sep) or w == "" for w in walked): continue # inside a full walk
+            path = os.path.join(self.root, rel) if rel else self.root
+            # a parent that is new or vanished gets (re)walked recursively
+            if rel and not os.path.isdir(path): self._forget(rel, recursive=True); continue
+            try: st = os.lstat(path)
+            except OSError: continue
+            recursive = dirty[rel] or rel not in self.dirs
+            if recursive: self._forget(rel, recursive=True); walked.append(rel)
+            starts.append((path, st, recursive))
+        return self.scan(starts, workers)
+
+    def save(self):
+        links = {key: self.links[key] for key in self.shared if key in self.links}
+        if len(links) > MAX_SAVED_LINKS:
+            print(f"Warning: {self.root} has {len(links)} hard-linked inodes; treesize index not kept")
+            forget(self.root); return
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = index_path(self.root); tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "root": self.root, "dirs": self.dirs, "mtimes": self.mtimes,
+                       "links": links}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, root):
+        index = cls(root)
+        try:
+            with open(index_path(index.root), "r", encoding="utf-8") as f: data = json.load(f)
+        except (OSError, ValueError): return None
+        if data.get("version") != INDEX_VERSION or data.get("root") != index.root: return None
+        index.dirs = data.get("dirs", {}); index.mtimes = data.get("mtimes", {})
+        index.links = data.get("links", {}); index.shared = set(index.links)
+        return index
+
+def parse_rsync_changes(lines):
+    changed = []
+    for line in lines:
+        match = RSYNC_ITEM_RE.match(line.rstrip("\n"))
+        if not match: continue
+        path = match.group("path")
+        item = match.group("item") or ""
+        if item[1:2] == "L" and " -> " in path: path = path.split(" -> ", 1)[0]   # symlink target
+        elif item[:1] == "h" and " => " in path: path = path.split(" => ", 1)[0]  # hardlink source
+        is_dir = path.endswith("/") or item[1:2] == "d"
+        changed.append((path, bool(match.group("deleting")), is_dir))
+    return changed
+
+def reclaimable_bytes(paths):
+    # Bytes that deleting all of `paths` would free. Hardlink snapshots share unchanged
+    # files with their neighbours, so an inode only counts when every one of its links
+    # is inside `paths`.
+    total = 0; seen = {} # (dev, ino) -> [links found, st_nlink, size]
+    stack = []
+    for path in paths:
+        try: st = os.lstat(path)
+        except OSError as e: print(f"Warning: treesize could not stat {path}: {e}"); continue
+        if os.path.isdir(path) and not os.path.islink(path): total += st.st_size; stack.append(path)
+        elif st.st_nlink > 1: seen.setdefault((st.st_dev, st.st_ino), [0, st.st_nlink, st.st_size])[0] += 1
+        else: total += st.st_size
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try: st = entry.stat(follow_symlinks=False)
+                    except OSError: continue
+                    if entry.is_dir(follow_symlinks=False): total += st.st_size; stack.append(entry.path)
+                    elif st.st_nlink > 1: seen.setdefault((st.st_dev, st.st_ino), [0, st.st_nlink, st.st_size])[0] += 1
+                    else: total += st.st_size
+        except OSError as e: print(f"Warning: treesize could not scan {directory}: {e}")
+    return total + sum(size for found, nlink, size in seen.values() if found >= nlink)
+
+_index_locks = {}
+_index_locks_guard = threading.Lock()
+
+def measure(root, changed=None, workers=DEFAULT_WORKERS, persist=True, link_dest=None):
+    # Size of `root` in bytes (du -sb semantics). With `changed` and an existing index only
+    # the affected directories are rescanned; a snapshot without an index of its own starts
+    # from the index of `link_dest`, the snapshot rsync hardlinked it against. Otherwise
+    # the whole tree is walked.
+    root = os.path.abspath(root)
+    with _index_locks_guard: lock = _index_locks.setdefault(root, threading.Lock())
+    with lock:
+        index = TreeSizeIndex.load(root) if persist else None; seeded = False
+        if index is None and persist and link_dest and changed is not None:
+            index = TreeSizeIndex.load(link_dest); seeded = index is not None
+            if seeded: index.root = root
+        if index is not None and changed is not None: index.apply_changes(changed, workers, check_dirs=seeded)
+        else: index = TreeSizeIndex(root).scan([(root, os.lstat(root), True)], workers)
+        if persist:
+            try: index.save()
+            except OSError as e: print(f"Warning: Could not persist treesize index for {root}: {e}")
+        return index.total_bytes
@@ -1,20 +1,35 @@
 # backupvault_web/app.py
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context
 import os
+import sys
+import threading
 from datetime import datetime
 import csv # Ensure csv is imported
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # project root, for backupvault_engine
+from backupvault_engine import inventory, storage_history
+
 import data_parser 
+import assets
+import events
+import fleet
+import profiling
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
+profiling.init_profiling(app) # no-op unless BACKUPVAULT_PROFILE_* is set
+assets.init_assets(app)
 
-@app.route('/api/backup_summary', methods=['GET'])
-def get_backup_summary_api():
+def build_backup_summary():
     config = data_parser.get_backup_config()
     history = data_parser.get_backup_history()
-    job_name = "N/A"
-    if config: job_name = config.get('JOB_NAME', 'Default Backup Job')
+    job_name = "N/A"; backup_format = "N/A"
+    if config:
+        job_name = config.get('JOB_NAME', 'Default Backup Job')
+        backup_format = config.get('COMPRESSION', 'tar.gz')
+        if backup_format != 'none' and config.get('COMPRESSION_LEVEL'): backup_format += f" -{config['COMPRESSION_LEVEL']}"
+        if backup_format.startswith('tar.zst') and config.get('ZSTD_LONG') == 'yes': backup_format += " --long"
+        if config.get('ENCRYPTION') == 'gpg': backup_format += " + gpg"
     last_run_status = history[0]['status'] if history and history[0].get('status') else "N/A"
     total_backup_size_bytes = sum(run.get('backup_size_bytes', 0) for run in history if run.get('status', '').lower() == 'success')
     total_backup_storage_gb = round(total_backup_size_bytes / (1024**3), 2)
@@ -25,21 +40,84 @@ def get_backup_summary_api():
             last_run_time_iso = history[0]['start_time'].isoformat()
         next_run_display = data_parser.calculate_next_run_time(
             last_run_time_iso, config.get('FREQUENCY'), config.get('CUSTOM_CRON_SCHEDULE'))
-    return jsonify({'job_name': job_name, 'total_active_jobs': 1 if config else 0, 
-                    'last_backup_status': last_run_status, 
-                    'total_backup_storage_gb': total_backup_storage_gb,
-                    'next_scheduled_run': next_run_display})
+    return {'job_name': job_name, 'backup_format': backup_format, 'total_active_jobs': 1 if config else 0, 
+            'last_backup_status': last_run_status, 
+            'total_backup_storage_gb': total_backup_storage_gb,
+            'next_scheduled_run': next_run_display}
+
+def serialize_run(run):
+    run_copy = run.copy()
+    if isinstance(run_copy.get('start_time'), datetime): run_copy['start_time'] = run_copy['start_time'].isoformat()
+    if isinstance(run_copy.get('end_time'), datetime): run_copy['end_time'] = run_copy['end_time'].isoformat()
+    return run_copy
+
+def build_backup_history():
+    return [serialize_run(run) for run in data_parser.get_backup_history()]
+
+STORAGE_CHART_MAX_POINTS = 200
+FORECAST_HORIZON_DAYS = 90
+
+def build_storage_usage_chart():
+    config = data_parser.get_backup_config()
+    if not config or not config.get('DESTINATION_DIRECTORY'):
+        return {"error": "Backup destination directory not found in backupvault.conf"}, 404
+    dest_path = config['DESTINATION_DIRECTORY']
+    usage_data = data_parser.get_storage_usage(dest_path)
+    if "error" in usage_data: return usage_data, 500
+    artifacts_gb = None
+    try: artifacts_gb = round(inventory.get_inventory(dest_path).total_bytes() / (1024**3), 2)
+    except OSError as e: print(f"Warning: Could not read artifact inventory for {dest_path}: {e}")
+
+    history = storage_history.get_history(dest_path)
+    samples = history.samples('hour')
+    if len(samples) < 48: samples = history.samples('minute') or samples # first days: minute detail
+    if not samples:
+        try: samples = [history.record()]
+        except OSError as e: print(f"Warning: Could not sample storage usage for {dest_path}: {e}")
+    backup_events = [(run['start_time'].timestamp(), run.get('backup_size_bytes', 0))
+                     for run in data_parser.get_backup_history()
+                     if run.get('start_time') and run.get('status', '').lower().startswith('success')]
+    forecast = storage_history.forecast(samples, backup_events)
+
+    step = max(1, len(samples) // STORAGE_CHART_MAX_POINTS)
+    points = samples[::step]
+    if samples and points[-1] is not samples[-1]: points.append(samples[-1])
+    gb = lambda n: round(n / (1024**3), 2)
+    labels = [datetime.fromtimestamp(p['time']).strftime('%Y-%m-%d %H:%M') for p in points]
+    used_series = [gb(p['used']) for p in points]
+    capacity_series = [gb(p['total']) for p in points]
+    forecast_series = [None] * len(points)
+    if points and forecast['growth_bytes_per_day'] and forecast['growth_bytes_per_day'] > 0:
+        # Project from the last sample until the volume is full (or the horizon), in ~10 steps
+        last = points[-1]
+        horizon_days = min(forecast['days_until_full'] or FORECAST_HORIZON_DAYS, FORECAST_HORIZON_DAYS)
+        forecast_series[-1] = used_series[-1]
+        for i in range(1, 11):
+            t = last['time'] + horizon_days * 86400 * i / 10
+            labels.append(datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M'))
+            used_series.append(None); capacity_series.append(gb(last['total']))
+            forecast_series.append(gb(min(last['used'] + forecast['growth_bytes_per_day'] * (t - last['time']) / 86400, last['total'])))
+    if forecast['projected_full_time']:
+        forecast['projected_full_date'] = datetime.fromtimestamp(forecast['projected_full_time']).strftime('%Y-%m-%d')
+    if forecast['growth_bytes_per_day'] is not None: forecast['growth_gb_per_day'] = round(forecast['growth_bytes_per_day'] / (1024**3), 3)
+    return {'labels': labels,
+        'datasets': [{'label': 'Used GB', 'data': used_series},
+                     {'label': 'Forecast Used GB', 'data': forecast_series},
+                     {'label': 'Capacity GB', 'data': capacity_series}],
+        'current': usage_data, 'artifacts_gb': artifacts_gb, 'forecast': forecast}, 200
+
+event_hub = events.DashboardEventHub(build_backup_summary, build_backup_history,
+                                     lambda: build_storage_usage_chart()[0])
+
+@app.route('/api/backup_summary', methods=['GET'])
+def get_backup_summary_api():
+    # ETag lets fleet aggregators (and browsers) revalidate with a cheap 304
+    response = jsonify(build_backup_summary())
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route('/api/backup_history', methods=['GET'])
-def get_backup_history_api():
-    history = data_parser.get_backup_history()
-    serializable_history = []
-    for run in history:
-        run_copy = run.copy()
-        if isinstance(run_copy.get('start_time'), datetime): run_copy['start_time'] = run_copy['start_time'].isoformat()
-        if isinstance(run_copy.get('end_time'), datetime): run_copy['end_time'] = run_copy['end_time'].isoformat()
-        serializable_history.append(run_copy)
-    return jsonify(serializable_history)
+def get_backup_history_api(): return jsonify(build_backup_history())
 
 @app.route('/api/backup_log/<path:log_filename>', methods=['GET'])
 def get_backup_log_api(log_filename):
@@ -50,22 +128,67 @@ def get_backup_log_api(log_filename):
 
 @app.route('/api/storage_usage', methods=['GET'])
 def get_storage_usage_api():
+    chart_data, status_code = build_storage_usage_chart()
+    return jsonify(chart_data), status_code
+
+@app.route('/api/artifacts', methods=['GET'])
+def get_artifacts_api():
     config = data_parser.get_backup_config()
     if not config or not config.get('DESTINATION_DIRECTORY'):
         return jsonify({"error": "Backup destination directory not found in backupvault.conf"}), 404
-    dest_path = config['DESTINATION_DIRECTORY']
-    usage_data = data_parser.get_storage_usage(dest_path)
-    if "error" in usage_data: return jsonify(usage_data), 500
-    return jsonify({'labels': [f"Volume: {usage_data.get('path_checked', dest_path)}"],
-        'datasets': [{'label': 'Used GB', 'data': [usage_data.get('used_gb',0)], 
-                      'backgroundColor': 'rgba(255, 99, 132, 0.7)', 'borderColor': 'rgba(255, 99, 132, 1)', 'borderWidth': 1}, 
-                     {'label': 'Free GB', 'data': [usage_data.get('free_gb',0)], 
-                      'backgroundColor': 'rgba(75, 192, 192, 0.7)', 'borderColor': 'rgba(75, 192, 192, 1)', 'borderWidth': 1}]})
+    try: inv = inventory.get_inventory(config['DESTINATION_DIRECTORY'])
+    except OSError as e: return jsonify({"error": f"Could not scan destination: {e}"}), 500
+    job_name = request.args.get('job') or None
+    artifacts = inv.list(job_name)
+    return jsonify({'destination': inv.destination, 'scanned_at': inv.scanned_at, 'count': len(artifacts),
+                    'total_bytes': sum(a['size_bytes'] for a in artifacts), 'artifacts': artifacts})
+
+@app.route('/api/events', methods=['GET'])
+def dashboard_events_api():
+    # EventSource resends the last id it saw on reconnect; replay from there or ask for a resync
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else None
+    return Response(stream_with_context(event_hub.stream(last_event_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats_api(): return jsonify(data_parser.get_cache_stats())
+
+fleet_aggregator = None # set when started with --fleet
+_background_pid = None    # process that started the background threads
+_background_lock = threading.Lock()
+
+@app.before_request
+def start_background_threads():
+    # Once per serving process, however it is served: the debug reloader's child, flask run
+    # or a (forking) WSGI server. Threads do not survive a fork, hence the pid
+    global _background_pid
+    if _background_pid == os.getpid(): return
+    with _background_lock:
+        if _background_pid == os.getpid(): return
+        _background_pid = os.getpid()
+    if fleet_aggregator is not None: fleet_aggregator.start()
+    storage_history.StorageSampler(lambda: (data_parser.get_backup_config() or {}).get('DESTINATION_DIRECTORY')).start()
+
+@app.route('/api/fleet', methods=['GET'])
+def get_fleet_api():
+    if fleet_aggregator is None: return jsonify({"error": "Fleet mode is not enabled (start app.py with --fleet)."}), 404
+    return jsonify(fleet_aggregator.snapshot())
+
+@app.route('/fleet')
+def fleet_page():
+    if fleet_aggregator is None: return "Fleet mode is not enabled (start app.py with --fleet).", 404
+    return render_template('fleet.html', fleet=fleet_aggregator.snapshot())
 
 @app.route('/')
 def dashboard_page(): return render_template('dashboard.html')
 
 if __name__ == '__main__':
+    if '--fleet' in sys.argv[1:]:
+        fleet_hosts = fleet.load_fleet_hosts()
+        if not fleet_hosts: print(f"ERROR: --fleet given but no hosts in BACKUPVAULT_FLEET_HOSTS or {fleet.FLEET_HOSTS_FILE}"); sys.exit(1)
+        fleet_aggregator = fleet.FleetAggregator(fleet_hosts)
+        print(f"INFO: Fleet mode: polling {len(fleet_hosts)} hosts every {fleet_aggregator.poll_interval}s (view at /fleet)")
     print(f"INFO: Reading config from: {data_parser.BACKUP_CONFIG_FILE}")
     print(f"INFO: Reading runs log from: {data_parser.BACKUP_RUNS_LOG_FILE}")
     print(f"INFO: Detailed logs dir: {data_parser.DETAILED_LOGS_DIR}")
@@ -85,4 +208,5 @@ if __name__ == '__main__':
             print(f"INFO: Created empty runs log with headers: {runs_log_path}")
         except IOError as e: print(f"ERROR: Could not create dummy runs log {runs_log_path}: {e}")
     
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    # The sampler and the fleet poller start with the first request (start_background_threads)
+    app.run(debug=True, host='0.0.0.0', port=5001, threaded=True)
\ No newline at end of file
@@ -0,0 +1,53 @@
+# backupvault_web/assets.py
+# Serves the output of build_assets.py: fingerprinted files under /assets/, picking the
+# precompressed .br/.gz variant the browser accepts, with year-long immutable caching.
+# Templates call asset_url('css/style.css'); without a build it falls back to /static/.
+import json
+import mimetypes
+import os
+
+from flask import abort, request, send_from_directory, url_for
+
+import build_assets
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ENCODING_SUFFIXES = (("br", ".br"), ("gzip", ".gz")) # preference order
+
+def load_manifest():
+    if not os.path.exists(build_assets.MANIFEST_PATH): return {}
+    try:
+        with open(build_assets.MANIFEST_PATH, "r", encoding="utf-8") as f: return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not read asset manifest {build_assets.MANIFEST_PATH}: {e}")
+        return {}
+
+def init_assets(app):
+    manifest = load_manifest()
+    by_hashed_path = {entry["path"]: entry for entry in manifest.values()}
+    if manifest: print(f"INFO: Serving {len(manifest)} fingerprinted assets from {build_assets.DIST_DIR}")
+    else: print("INFO: No asset manifest; serving unversioned /static files (run build_assets.py).")
+
+    def asset_url(logical_path, fallback=None):
+        entry = manifest.get(logical_path)
+        if entry: return url_for("fingerprinted_asset", filename=entry["path"])
+        if fallback and not os.path.exists(os.path.join(app.static_folder, logical_path)): return fallback
+        return url_for("static", filename=logical_path)
+
+    @app.route("/assets/<path:filename>")
+    def fingerprinted_asset(filename):
+        entry = by_hashed_path.get(filename)
+        if entry is None: abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        for encoding, suffix in ENCODING_SUFFIXES:
+            if encoding in entry["encodings"] and request.accept_encodings.quality(encoding) > 0:
+                response = send_from_directory(build_assets.DIST_DIR, filename + suffix, mimetype=mimetype)
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(build_assets.DIST_DIR, filename, mimetype=mimetype)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add("Accept-Encoding")
+        return response
+
+    app.jinja_env.globals["asset_url"] = asset_url
+    return manifest
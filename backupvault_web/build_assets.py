@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# backupvault_web/build_assets.py
+# Static asset build step for the dashboard:
+#   1. vendors Chart.js into static/vendor/ (downloaded once, or copied from --chart-js FILE
+#      on air-gapped machines) so first paint never waits on a CDN,
+#   2. copies every asset into static/dist/ under a content-hashed filename,
+#   3. writes .gz and .br (when the 'brotli' module or CLI is available) next to each file,
+#   4. writes static/dist/manifest.json, which app.py uses to emit fingerprinted URLs.
+# Re-run after editing style.css or main.js:  python3 build_assets.py
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import urllib.request
+
+try: import brotli
+except ImportError: brotli = None
+
+WEB_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(WEB_DIR, "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+CHART_JS_VERSION = "4.4.9"
+CHART_JS_URL = f"https://cdn.jsdelivr.net/npm/chart.js@{CHART_JS_VERSION}/dist/chart.umd.min.js"
+CHART_JS_VENDOR_PATH = "vendor/chart.umd.min.js"
+ASSETS = ["css/style.css", "js/main.js", CHART_JS_VENDOR_PATH]
+MIN_COMPRESS_BYTES = 256 # below this the encoded variant is rarely worth a separate file
+
+def vendor_chart_js(source_file=None):
+    target = os.path.join(STATIC_DIR, CHART_JS_VENDOR_PATH)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if source_file:
+        shutil.copyfile(source_file, target); print(f"INFO: Vendored Chart.js from {source_file}")
+    elif os.path.exists(target):
+        print(f"INFO: Chart.js already vendored at {target}")
+    else:
+        print(f"INFO: Downloading Chart.js {CHART_JS_VERSION} from {CHART_JS_URL}")
+        try:
+            with urllib.request.urlopen(CHART_JS_URL, timeout=30) as response, open(target + ".tmp", "wb") as f:
+                shutil.copyfileobj(response, f)
+            os.replace(target + ".tmp", target)
+        except OSError as e:
+            print(f"ERROR: Could not download Chart.js ({e}). Copy chart.umd.min.js here and pass --chart-js FILE.")
+            return False
+    return True
+
+def brotli_compress(data):
+    if brotli is not None: return brotli.compress(data, quality=11)
+    if shutil.which("brotli"):
+        result = subprocess.run(["brotli", "-c", "-q", "11", "-"], input=data, stdout=subprocess.PIPE, check=True)
+        return result.stdout
+    return None
+
+def build(chart_js_file=None):
+    if not vendor_chart_js(chart_js_file): return 1
+    if os.path.isdir(DIST_DIR): shutil.rmtree(DIST_DIR)
+    manifest = {}; brotli_missing = False
+    for logical_path in ASSETS:
+        with open(os.path.join(STATIC_DIR, logical_path), "rb") as f: data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(logical_path)
+        if stem.endswith(".min"): stem, ext = stem[:-4], ".min" + ext
+        hashed_path = f"{stem}.{digest}{ext}"
+        out_path = os.path.join(DIST_DIR, hashed_path)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, "wb") as f: f.write(data)
+        variants = []
+        if len(data) >= MIN_COMPRESS_BYTES:
+            gz_data = gzip.compress(data, compresslevel=9, mtime=0) # mtime=0 keeps builds reproducible
+            if len(gz_data) < len(data):
+                with open(out_path + ".gz", "wb") as f: f.write(gz_data)
+                variants.append("gzip")
+            br_data = brotli_compress(data)
+            if br_data is None: brotli_missing = True
+            elif len(br_data) < len(data):
+                with open(out_path + ".br", "wb") as f: f.write(br_data)
+                variants.append("br")
+        manifest[logical_path] = {"path": hashed_path, "encodings": variants}
+        print(f"INFO: {logical_path} -> dist/{hashed_path} ({len(data)} bytes; {', '.join(variants) or 'uncompressed only'})")
+    if brotli_missing: print("WARNING: No 'brotli' module or CLI found; only .gz variants were written.")
+    with open(MANIFEST_PATH, "w", encoding="utf-8") as f: json.dump(manifest, f, indent=2, sort_keys=True)
+    print(f"INFO: Wrote {MANIFEST_PATH}")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vendor, fingerprint and precompress dashboard assets.")
+    parser.add_argument("--chart-js", metavar="FILE", help="use this chart.umd.min.js instead of downloading it")
+    args = parser.parse_args()
+    sys.exit(build(args.chart_js))
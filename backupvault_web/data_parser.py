@@ -3,6 +3,12 @@ import os
 import csv
 from datetime import datetime, timedelta, timezone # Ensure timezone is imported
 import shutil 
+import struct
+import threading
+import time
+import ctypes
+import ctypes.util
+from collections import OrderedDict
 
 USER_HOME = os.path.expanduser("~")
 APP_DIR_BASE = os.path.join(USER_HOME, ".backupvault")
@@ -10,7 +16,215 @@ BACKUP_CONFIG_FILE = os.path.join(APP_DIR_BASE, "backupvault.conf")
 BACKUP_RUNS_LOG_FILE = os.path.join(APP_DIR_BASE, "logs", "backup_runs.csv")
 DETAILED_LOGS_DIR = os.path.join(APP_DIR_BASE, "logs", "details")
 
+# --- Reader Cache ---
+# Every reader below is memoized. Entries are dropped when an inotify watch on the
+# directory holding their source file fires; if the directory is not watched
+# (no inotify, directory created later) the entry is re-validated by mtime/size.
+STORAGE_USAGE_TTL_SECONDS = 30              # disk usage changes without file events
+LOG_CONTENT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+class _CacheRegion:
+    def __init__(self, name, ttl=None, max_bytes=None):
+        self.name = name; self.ttl = ttl; self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key -> (value, stamps, expires_at, nbytes)
+        self.total_bytes = 0
+        self.hits = 0; self.misses = 0; self.invalidations = 0; self.evictions = 0
+
+    def drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry: self.total_bytes -= entry[3]
+        return entry is not None
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries),
+                "bytes": self.total_bytes, "max_bytes": self.max_bytes, "ttl_seconds": self.ttl,
+                "invalidations": self.invalidations, "evictions": self.evictions}
+
+_cache_lock = threading.RLock()
+_cache_generation = 0 # bumped on every invalidation so racing loads are not cached
+_cache_regions = {
+    "config": _CacheRegion("config"),
+    "history": _CacheRegion("history"),
+    "storage_usage": _CacheRegion("storage_usage", ttl=STORAGE_USAGE_TTL_SECONDS),
+    "log_content": _CacheRegion("log_content", max_bytes=LOG_CONTENT_CACHE_MAX_BYTES),
+}
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError: return None
+
+def _stamps_still_valid(stamps):
+    for path, stamp in stamps:
+        if _watcher.is_watching(os.path.dirname(path)): continue
+        if _file_stamp(path) != stamp: return False
+    return True
+
+def _cached(region_name, key, paths, loader, size_of=None):
+    _watcher.ensure_started()
+    region = _cache_regions[region_name]
+    now = time.monotonic()
+    with _cache_lock:
+        entry = region.entries.get(key)
+        if entry is not None:
+            value, stamps, expires_at, _ = entry
+            if (expires_at is None or now < expires_at) and _stamps_still_valid(stamps):
+                region.entries.move_to_end(key); region.hits += 1
+                return value
+            region.drop(key); region.invalidations += 1
+        region.misses += 1
+        generation = _cache_generation
+    # Stamp before loading so a write racing with the read invalidates on the next call
+    stamps = [(path, _file_stamp(path)) for path in paths]
+    value = loader()
+    nbytes = size_of(value) if size_of else 0
+    if region.max_bytes is not None and nbytes > region.max_bytes: return value
+    with _cache_lock:
+        if generation != _cache_generation: return value
+        region.drop(key)
+        region.entries[key] = (value, stamps, now + region.ttl if region.ttl else None, nbytes)
+        region.total_bytes += nbytes
+        while region.max_bytes is not None and region.total_bytes > region.max_bytes:
+            oldest_key = next(iter(region.entries))
+            region.drop(oldest_key); region.evictions += 1
+    return value
+
+def invalidate_caches(path=None):
+    """Drop cached entries that depend on `path`, or every entry when no path is given."""
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        for region in _cache_regions.values():
+            for key, entry in list(region.entries.items()):
+                if path is None or any(p == path or os.path.dirname(p) == path for p, _ in entry[1]):
+                    region.drop(key); region.invalidations += 1
+
+def get_cache_stats():
+    with _cache_lock:
+        stats = {name: region.stats() for name, region in _cache_regions.items()}
+    stats["invalidation_mode"] = "inotify" if _watcher.active else "mtime"
+    stats["watched_dirs"] = sorted(_watcher.watched_dirs())
+    return stats
+
+class _InotifyWatcher:
+    IN_MODIFY = 0x002; IN_ATTRIB = 0x004; IN_CLOSE_WRITE = 0x008; IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080; IN_CREATE = 0x100; IN_DELETE = 0x200; IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800; IN_Q_OVERFLOW = 0x4000; IN_IGNORED = 0x8000
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, dirs):
+        self.dirs = dirs
+        self.active = False
+        self._fd = None; self._libc = None
+        self._wd_to_dir = {}
+        self._watched = frozenset()
+        self._started = False
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def is_watching(self, dir_path):
+        return self.active and dir_path in self._watched
+
+    def watched_dirs(self):
+        return list(self._watched)
+
+    def ensure_started(self):
+        if self._started: return
+        with self._lock:
+            if self._started: return
+            self._started = True
+            try:
+                libc_name = ctypes.util.find_library("c")
+                if not libc_name or not hasattr(ctypes.CDLL(libc_name), "inotify_init1"):
+                    print("INFO: inotify unavailable; reader cache falls back to mtime checks.")
+                    return
+                self._libc = ctypes.CDLL(libc_name, use_errno=True)
+                fd = self._libc.inotify_init1(os.O_CLOEXEC)
+                if fd < 0:
+                    print(f"Warning: inotify_init1 failed (errno {ctypes.get_errno()}); using mtime checks.")
+                    return
+                self._fd = fd
+                for dir_path in self.dirs: self._add_watch(dir_path)
+                self.active = True
+                threading.Thread(target=self._run, name="data-parser-inotify", daemon=True).start()
+            except Exception as e:
+                print(f"Warning: Could not start inotify watcher: {e}; using mtime checks.")
+
+    def _add_watch(self, dir_path):
+        if not os.path.isdir(dir_path): return
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_path), self.WATCH_MASK)
+        if wd < 0: print(f"Warning: Could not watch {dir_path} (errno {ctypes.get_errno()}).")
+        else:
+            self._wd_to_dir[wd] = dir_path; self._watched = frozenset(self._wd_to_dir.values())
+
+    def _run(self):
+        while True:
+            try: buf = os.read(self._fd, 64 * 1024)
+            except OSError as e:
+                print(f"Warning: inotify read failed: {e}; falling back to mtime checks.")
+                self.active = False; invalidate_caches(); return
+            offset = 0
+            while offset + self.EVENT_HEADER.size <= len(buf):
+                wd, mask, _cookie, name_len = self.EVENT_HEADER.unpack_from(buf, offset)
+                offset += self.EVENT_HEADER.size
+                name = buf[offset:offset + name_len].rstrip(b"\0"); offset += name_len
+                self._handle_event(wd, mask, os.fsdecode(name))
+
+    def _handle_event(self, wd, mask, name):
+        if mask & self.IN_Q_OVERFLOW:
+            invalidate_caches(); self._notify(None); return
+        dir_path = self._wd_to_dir.get(wd)
+        if dir_path is None: return
+        if mask & (self.IN_IGNORED | self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+            self._wd_to_dir.pop(wd, None); self._watched = frozenset(self._wd_to_dir.values())
+            invalidate_caches(dir_path); self._notify(dir_path); return
+        path = os.path.join(dir_path, name) if name else dir_path
+        if path in self.dirs and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+            self._add_watch(path) # e.g. logs/details created after the dashboard started
+        invalidate_caches(path)
+        self._notify(path)
+
+    def _notify(self, path):
+        for callback in self._listeners:
+            try: callback(path)
+            except Exception as e: print(f"Warning: change listener failed: {e}")
+
+_watcher = _InotifyWatcher([APP_DIR_BASE, os.path.dirname(BACKUP_RUNS_LOG_FILE), DETAILED_LOGS_DIR])
+
+def add_change_listener(callback):
+    """Call `callback(path)` from the watcher thread whenever a watched file changes.
+    `path` is None after an event-queue overflow. Returns False when inotify is not
+    active, in which case callers have to poll."""
+    _watcher.ensure_started()
+    _watcher.add_listener(callback)
+    return _watcher.active
+
 def get_backup_config():
+    config = _cached("config", BACKUP_CONFIG_FILE, [BACKUP_CONFIG_FILE], _read_backup_config)
+    return dict(config) if config is not None else None
+
+def get_backup_history():
+    history = _cached("history", BACKUP_RUNS_LOG_FILE, [BACKUP_RUNS_LOG_FILE], _read_backup_history)
+    return [dict(run) for run in history]
+
+def get_detailed_log_content(log_file_name):
+    if not log_file_name or ".." in log_file_name or "/" in log_file_name or "\\" in log_file_name:
+        print(f"Warning: Invalid log file name requested: {log_file_name}")
+        return "Error: Invalid log file name."
+    full_log_path = os.path.join(DETAILED_LOGS_DIR, log_file_name)
+    return _cached("log_content", log_file_name, [full_log_path],
+                   lambda: _read_detailed_log_content(log_file_name, full_log_path), size_of=len)
+
+def get_storage_usage(path_to_check):
+    return dict(_cached("storage_usage", path_to_check, [], lambda: _read_storage_usage(path_to_check)))
+
+def _read_backup_config():
     config = {}
     if not os.path.exists(BACKUP_CONFIG_FILE):
         print(f"Warning: Config file not found at {BACKUP_CONFIG_FILE}")
@@ -31,7 +245,7 @@ def get_backup_config():
         return None
     return config
 
-def get_backup_history():
+def _read_backup_history():
     history = []
     if not os.path.exists(BACKUP_RUNS_LOG_FILE):
         print(f"Warning: Backup runs log not found at {BACKUP_RUNS_LOG_FILE}")
@@ -53,11 +267,7 @@ def get_backup_history():
     history.sort(key=lambda x: x.get('start_time') or datetime.min.replace(tzinfo=timezone.utc), reverse=True)
     return history
 
-def get_detailed_log_content(log_file_name):
-    if not log_file_name or ".." in log_file_name or "/" in log_file_name or "\\" in log_file_name:
-        print(f"Warning: Invalid log file name requested: {log_file_name}")
-        return "Error: Invalid log file name."
-    full_log_path = os.path.join(DETAILED_LOGS_DIR, log_file_name)
+def _read_detailed_log_content(log_file_name, full_log_path):
     if not os.path.exists(full_log_path):
         print(f"Warning: Detailed log file not found: {full_log_path}")
         return f"Error: Log file '{log_file_name}' not found."
@@ -119,7 +329,7 @@ def calculate_next_run_time(last_run_time_iso, frequency, custom_schedule_str=""
     else: return "N/A (Unsupported)"
     return next_run_candidate.strftime("%Y-%m-%d %H:%M:%S %Z%z") if next_run_candidate else "N/A"
 
-def get_storage_usage(path_to_check):
+def _read_storage_usage(path_to_check):
     if not path_to_check: return {"path": "N/A", "error": "Path not configured"}
     actual_path_for_df = path_to_check
     if not os.path.isdir(actual_path_for_df):
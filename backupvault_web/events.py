@@ -0,0 +1,119 @@
+# backupvault_web/events.py
+# Server-sent event hub for the dashboard. A background thread re-reads the (cached)
+# summary, history and storage data when the runs-log watcher fires, diffs it against
+# the last snapshot and fans out only the deltas to every connected EventSource. While
+# nobody is connected the snapshot is left alone; the first subscriber after such a gap
+# takes a new one before anything is diffed, and what changed in the gap is a resync.
+import json
+import queue
+import threading
+from collections import deque
+
+import data_parser
+
+POLL_INTERVAL_SECONDS = 5         # storage refresh, and change detection without inotify
+KEEPALIVE_SECONDS = 20
+BACKLOG_SIZE = 256                # events kept for Last-Event-ID replay after a reconnect
+SUBSCRIBER_QUEUE_SIZE = 512
+
+class DashboardEventHub:
+    def __init__(self, summary_fn, history_fn, storage_fn):
+        self.summary_fn = summary_fn; self.history_fn = history_fn; self.storage_fn = storage_fn
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock() # one refresh at a time, so no delta is sent twice
+        self._wake = threading.Event()
+        self._subscribers = set()
+        self._backlog = deque(maxlen=BACKLOG_SIZE)
+        self._next_id = 1
+        self._runs = None; self._summary = None; self._storage = None
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started: return
+            self._started = True
+        self._take_snapshot(emit=False)
+        data_parser.add_change_listener(self._on_file_change)
+        threading.Thread(target=self._run, name="dashboard-events", daemon=True).start()
+
+    def _on_file_change(self, path):
+        if path is None or path in (data_parser.BACKUP_RUNS_LOG_FILE, data_parser.BACKUP_CONFIG_FILE):
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(POLL_INTERVAL_SECONDS); self._wake.clear()
+            if not self._subscribers: continue # nobody listening; the next subscriber re-snapshots first
+            try: self._take_snapshot(emit=True)
+            except Exception as e: print(f"Warning: dashboard event refresh failed: {e}")
+
+    def _take_snapshot(self, emit):
+        # Returns True when the data differs from the previous snapshot
+        with self._snapshot_lock:
+            runs = {run['run_id']: run for run in self.history_fn() if run.get('run_id')}
+            summary = self.summary_fn()
+            storage = self.storage_fn()
+            events = []
+            if self._runs is not None:
+                # history_fn() is newest first; emit additions oldest first so clients can prepend
+                for run_id, run in reversed(list(runs.items())):
+                    previous = self._runs.get(run_id)
+                    if previous is None: events.append(('run_added', run))
+                    elif previous != run: events.append(('run_updated', run))
+                if summary != self._summary: events.append(('summary', summary))
+                if storage != self._storage: events.append(('storage', storage))
+            self._runs = runs; self._summary = summary; self._storage = storage
+            if emit:
+                for event_type, payload in events: self._publish(event_type, payload)
+        return bool(events)
+
+    def _catch_up(self):
+        # The snapshot went stale while nobody listened. Page loads since then already show
+        # the current data; a client reconnecting from the old last id is sent a resync
+        try:
+            if self._take_snapshot(emit=False): self._publish('resync', {})
+        except Exception as e: print(f"Warning: dashboard event refresh failed: {e}")
+
+    def _publish(self, event_type, payload):
+        with self._lock:
+            event = (self._next_id, event_type, json.dumps(payload))
+            self._next_id += 1
+            self._backlog.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try: subscriber.put_nowait(event)
+            except queue.Full: # slow client: make it resync instead of growing without bound
+                with self._lock: self._subscribers.discard(subscriber)
+
+    def stream(self, last_event_id=None):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        if not self._started: self.start()
+        else:
+            with self._lock: idle = not self._subscribers
+            if idle: self._catch_up()
+        with self._lock:
+            replay = []
+            if last_event_id is not None:
+                if self._backlog and self._backlog[0][0] - 1 <= last_event_id < self._next_id:
+                    replay = [event for event in self._backlog if event[0] > last_event_id]
+                elif last_event_id != self._next_id - 1: # missed too much, or the server restarted
+                    replay = [(self._next_id - 1, 'resync', '{}')]
+            self._subscribers.add(subscriber)
+        self._wake.set()
+        try:
+            yield "retry: 3000\n\n"
+            for event in replay: yield _format_event(*event)
+            while True:
+                try: event = subscriber.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    with self._lock:
+                        if subscriber not in self._subscribers: # dropped as a slow consumer
+                            yield _format_event(self._next_id - 1, 'resync', '{}'); return
+                    continue
+                yield _format_event(*event)
+        finally:
+            with self._lock: self._subscribers.discard(subscriber)
+
+def _format_event(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
@@ -0,0 +1,262 @@
+# backupvault_web/fleet.py
+# Aggregator ("fleet") mode: poll the /api/backup_summary endpoint of many BackupVault
+# dashboards concurrently and merge them into one view with per-host staleness.
+#
+# Hosts are read from BACKUPVAULT_FLEET_HOSTS (comma separated URLs) or from
+# ~/.backupvault/fleet_hosts.conf, one host per line:
+#     NAME  URL  [TIMEOUT_SECONDS]
+# e.g. "db01  http://db01.internal:5001  3". Lines starting with '#' are ignored.
+#
+# All hosts are polled in one asyncio loop on a background thread. Every host has its
+# own timeout and a small keep-alive connection pool, and sends If-None-Match so an
+# unchanged summary costs a 304. Web requests only read the last merged snapshot, so a
+# slow or dead host never delays the fleet view.
+import asyncio
+import json
+import os
+import ssl
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import data_parser
+
+FLEET_HOSTS_FILE = os.path.join(data_parser.APP_DIR_BASE, "fleet_hosts.conf")
+SUMMARY_PATH = "/api/backup_summary"
+POLL_INTERVAL_SECONDS = 15
+DEFAULT_HOST_TIMEOUT_SECONDS = 5
+STALE_AFTER_SECONDS = POLL_INTERVAL_SECONDS * 3
+MAX_IDLE_CONNECTIONS_PER_HOST = 2
+MAX_RESPONSE_BYTES = 1024 * 1024
+
+class FleetHTTPError(Exception):
+    pass
+
+def load_fleet_hosts():
+    hosts = []
+    env_hosts = os.environ.get('BACKUPVAULT_FLEET_HOSTS', '')
+    if env_hosts:
+        for url in (u.strip() for u in env_hosts.split(',')):
+            if url: hosts.append({'name': urlsplit(url).netloc or url, 'url': url.rstrip('/'), 'timeout': DEFAULT_HOST_TIMEOUT_SECONDS})
+        return hosts
+    if not os.path.exists(FLEET_HOSTS_FILE): return hosts
+    try:
+        with open(FLEET_HOSTS_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if not parts or parts[0].startswith('#'): continue
+                if len(parts) < 2:
+                    print(f"Warning: Skipping malformed fleet host line: {line.strip()}"); continue
+                try: timeout = float(parts[2]) if len(parts) > 2 else DEFAULT_HOST_TIMEOUT_SECONDS
+                except ValueError: timeout = DEFAULT_HOST_TIMEOUT_SECONDS
+                hosts.append({'name': parts[0], 'url': parts[1].rstrip('/'), 'timeout': timeout})
+    except Exception as e:
+        print(f"Error reading fleet hosts file {FLEET_HOSTS_FILE}: {e}")
+    return hosts
+
+class _ConnectionPool:
+    # Keep-alive HTTP/1.1 connections to one host, reused across polls
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme or 'http'
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or (443 if self.scheme == 'https' else 80)
+        self.base_path = parts.path.rstrip('/')
+        self.ssl_context = ssl.create_default_context() if self.scheme == 'https' else None
+        self.idle = []
+
+    async def acquire(self):
+        while self.idle:
+            reader, writer = self.idle.pop()
+            if not writer.is_closing() and not reader.at_eof(): return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl_context)
+        return reader, writer, False
+
+    def release(self, reader, writer, reusable):
+        if reusable and len(self.idle) < MAX_IDLE_CONNECTIONS_PER_HOST: self.idle.append((reader, writer))
+        else: writer.close()
+
+    def close(self):
+        for _, writer in self.idle: writer.close()
+        self.idle = []
+
+    async def get(self, path, headers):
+        # One retry on a fresh connection: the server may have closed an idle one
+        for attempt in range(2):
+            reader, writer, reused = await self.acquire()
+            try:
+                status, response_headers, body, keep_alive = await self._exchange(reader, writer, path, headers)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                if reused and attempt == 0: continue
+                raise FleetHTTPError(f"connection failed: {e}")
+            except BaseException:
+                writer.close(); raise # includes timeout cancellation
+            self.release(reader, writer, keep_alive)
+            return status, response_headers, body
+
+    async def _exchange(self, reader, writer, path, headers):
+        host_header = self.host if self.port in (80, 443) else f"{self.host}:{self.port}"
+        lines = [f"GET {self.base_path}{path} HTTP/1.1", f"Host: {host_header}",
+                 "Accept: application/json", "Connection: keep-alive"]
+        lines += [f"{key}: {value}" for key, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line: raise ConnectionResetError("connection closed before response")
+        parts = status_line.decode('latin-1').split(None, 2)
+        if len(parts) < 2 or not parts[1].isdigit(): raise FleetHTTPError(f"bad status line {status_line!r}")
+        http_version, status = parts[0], int(parts[1])
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""): break
+            key, _, value = line.decode('latin-1').partition(":")
+            response_headers[key.strip().lower()] = value.strip()
+        keep_alive = http_version == "HTTP/1.1" and response_headers.get('connection', '').lower() != 'close'
+
+        body = b""
+        if status in (204, 304) or 100 <= status < 200: pass
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""): pass # trailers
+                    break
+                chunks.append(await reader.readexactly(size)); await reader.readexactly(2)
+                if sum(map(len, chunks)) > MAX_RESPONSE_BYTES: raise FleetHTTPError("response too large")
+            body = b"".join(chunks)
+        elif 'content-length' in response_headers:
+            length = int(response_headers['content-length'])
+            if length > MAX_RESPONSE_BYTES: raise FleetHTTPError("response too large")
+            body = await reader.readexactly(length)
+        else:
+            body = await reader.read(MAX_RESPONSE_BYTES); keep_alive = False
+        return status, response_headers, body, keep_alive
+
+class FleetAggregator:
+    def __init__(self, hosts, poll_interval=POLL_INTERVAL_SECONDS, stale_after=STALE_AFTER_SECONDS):
+        self.poll_interval = poll_interval; self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._hosts = {host['name']: dict(host, summary=None, etag=None, last_success=None,
+                                          last_attempt=None, last_error=None, latency_ms=None, polls=0, not_modified=0)
+                       for host in hosts}
+        self._pools = {host['name']: _ConnectionPool(host['url']) for host in hosts}
+        self._thread = None
+
+    def start(self):
+        if self._thread or not self._hosts: return
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._poll_forever()), name="fleet-poller", daemon=True)
+        self._thread.start()
+
+    async def _poll_forever(self):
+        while True:
+            started = time.monotonic()
+            await self.poll_once()
+            await asyncio.sleep(max(0.0, self.poll_interval - (time.monotonic() - started)))
+
+    async def poll_once(self):
+        # Each host is bounded by its own timeout; gather never waits longer than the slowest timeout
+        await asyncio.gather(*(self._poll_host(name) for name in list(self._hosts)), return_exceptions=True)
+
+    async def _poll_host(self, name):
+        host = self._hosts[name]
+        headers = {'If-None-Match': host['etag']} if host['etag'] and host['summary'] is not None else {}
+        started = time.monotonic()
+        error = None; summary = None; etag = None; not_modified = False
+        try:
+            status, response_headers, body = await asyncio.wait_for(self._pools[name].get(SUMMARY_PATH, headers), host['timeout'])
+            if status == 304: not_modified = True
+            elif status == 200:
+                summary = json.loads(body.decode('utf-8'))
+                etag = response_headers.get('etag')
+            else: error = f"HTTP {status}"
+        except asyncio.TimeoutError: error = f"timed out after {host['timeout']}s"
+        except (OSError, FleetHTTPError, ValueError) as e: error = str(e) or e.__class__.__name__
+        with self._lock:
+            host['polls'] += 1; host['last_attempt'] = time.time()
+            host['latency_ms'] = round((time.monotonic() - started) * 1000, 1)
+            host['last_error'] = error
+            if error is None:
+                host['last_success'] = host['last_attempt']
+                if not_modified: host['not_modified'] += 1
+                else: host['summary'] = summary; host['etag'] = etag
+
+    def snapshot(self):
+        now = time.time()
+        hosts = []
+        with self._lock:
+            for name, host in self._hosts.items():
+                age = round(now - host['last_success'], 1) if host['last_success'] else None
+                if host['summary'] is None: state = 'unreachable' if host['last_error'] else 'pending'
+                elif host['last_error'] or age is None or age > self.stale_after: state = 'stale'
+                else: state = 'ok'
+                hosts.append({'name': name, 'url': host['url'], 'state': state, 'summary': host['summary'],
+                              'age_seconds': age, 'last_error': host['last_error'], 'latency_ms': host['latency_ms'],
+                              'last_success': _iso(host['last_success']), 'polls': host['polls'],
+                              'not_modified_responses': host['not_modified']})
+        summaries = [h['summary'] for h in hosts if h['summary']]
+        return {'generated_at': _iso(now), 'hosts': sorted(hosts, key=lambda h: h['name']),
+                'totals': {'hosts': len(hosts), 'ok': sum(h['state'] == 'ok' for h in hosts),
+                           'stale': sum(h['state'] == 'stale' for h in hosts),
+                           'unreachable': sum(h['state'] == 'unreachable' for h in hosts),
+                           'failing_jobs': sum('fail' in str(s.get('last_backup_status', '')).lower() for s in summaries),
+                           'total_backup_storage_gb': round(sum(s.get('total_backup_storage_gb') or 0 for s in summaries), 2)}}
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp else None
+
+# --- Local stand-ins (tests / demos) ---
+# start_standin_fleet() runs N fake dashboards on 127.0.0.1 that answer SUMMARY_PATH with
+# an ETag, optionally after a delay or with an error, so the aggregator can be exercised
+# without real hosts:  python3 fleet.py --standins 5 --slow 1
+def start_standin_fleet(count, delays=None, failing=()):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    servers = []
+    for index in range(count):
+        delay = (delays or {}).get(index, 0)
+        summary = {'job_name': f"standin-{index}", 'total_active_jobs': 1,
+                   'last_backup_status': 'failed_rsync' if index in failing else 'success',
+                   'total_backup_storage_gb': float(index + 1), 'next_scheduled_run': 'N/A'}
+        body = json.dumps(summary).encode('utf-8'); etag = f'"standin-{index}-{len(body)}"'
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def do_GET(self, body=body, etag=etag, delay=delay):
+                if delay: time.sleep(delay)
+                if self.path != SUMMARY_PATH:
+                    self.send_response(404); self.send_header('Content-Length', '0'); self.end_headers(); return
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304); self.send_header('ETag', etag); self.end_headers(); return
+                self.send_response(200); self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body))); self.send_header('ETag', etag)
+                self.end_headers(); self.wfile.write(body)
+            def log_message(self, *args): pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    hosts = [{'name': f"standin-{i}", 'url': f"http://127.0.0.1:{s.server_address[1]}", 'timeout': 1.0}
+             for i, s in enumerate(servers)]
+    return hosts, servers
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Poll BackupVault hosts once and print the fleet view.")
+    parser.add_argument('--standins', type=int, default=0, help="spin up N local stand-in dashboards instead of reading the host list")
+    parser.add_argument('--slow', type=int, default=0, help="make this many stand-ins slower than their timeout")
+    args = parser.parse_args()
+    if args.standins:
+        hosts, _ = start_standin_fleet(args.standins, delays={i: 3 for i in range(args.slow)})
+    else: hosts = load_fleet_hosts()
+    aggregator = FleetAggregator(hosts)
+    started = time.monotonic()
+    async def poll_twice():
+        await aggregator.poll_once(); await aggregator.poll_once()
+    asyncio.run(poll_twice())
+    print(json.dumps(aggregator.snapshot(), indent=2))
+    print(f"INFO: Two polling rounds over {len(hosts)} hosts took {time.monotonic() - started:.2f}s")
@@ -0,0 +1,167 @@
+# backupvault_web/profiling.py
+# Opt-in per-request profiling. Nothing is registered on the app unless a token or a
+# sampling rate is configured, so a disabled profiler costs nothing per request.
+#
+#   BACKUPVAULT_PROFILE_TOKEN        admin token; send it as the X-BackupVault-Profile header
+#                                    or ?profile=<token> to profile that request
+#   BACKUPVAULT_PROFILE_SAMPLE_RATE  fraction (0..1) of requests to profile automatically
+#   BACKUPVAULT_PROFILE_SLOW_MS      only keep profiles of requests slower than this (default 0)
+#   BACKUPVAULT_PROFILE_DIR          where .prof / .collapsed files go (default ~/.backupvault/profiles)
+#
+# Each profiled request gets a cProfile dump (<request_id>.prof, for pstats/snakeviz) and a
+# sampled, flamegraph-ready collapsed-stack file (<request_id>.collapsed, for flamegraph.pl
+# or speedscope). The interpreter has one profiler slot (sys.monitoring on 3.12+) and a
+# profile must only hold its own request, so one request is profiled at a time: a request
+# that comes in while another is being profiled is served unprofiled.
+import cProfile
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from urllib.parse import urlencode
+
+from flask import g, request, jsonify, send_from_directory, abort
+
+import data_parser
+
+MAX_STORED_PROFILES = 100
+STACK_SAMPLE_INTERVAL_SECONDS = 0.002
+EXCLUDED_PATH_PREFIXES = ('/api/events', '/api/profiles', '/static/')
+
+_active = threading.Lock() # held by the request being profiled
+
+class _StackSampler:
+    # Periodically captures the request thread's Python stack; folds them into counts
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self): self._thread.start()
+
+    def stop(self):
+        self._stop.set(); self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(STACK_SAMPLE_INTERVAL_SECONDS):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if frames: self.stacks[";".join(reversed(frames))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+def _recorded_path():
+    # The request's path and query, without ?profile=<token>: records are served by /api/profiles
+    query = urlencode([(k, v) for k, v in request.args.items(multi=True) if k != 'profile'])
+    return f"{request.path}?{query}" if query else request.path
+
+class RequestProfiler:
+    def __init__(self, token, sample_rate, slow_ms, profile_dir):
+        self.token = token; self.sample_rate = sample_rate; self.slow_ms = slow_ms
+        self.profile_dir = profile_dir
+        self.recent = deque(maxlen=MAX_STORED_PROFILES)
+        self._lock = threading.Lock()
+
+    def is_admin(self):
+        supplied = request.headers.get('X-BackupVault-Profile') or request.args.get('profile', '')
+        if self.token: return hmac.compare_digest(supplied.encode(), self.token.encode())
+        return request.remote_addr in ('127.0.0.1', '::1') # no token configured: local only
+
+    def should_profile(self):
+        if request.path.startswith(EXCLUDED_PATH_PREFIXES): return False
+        if self.token and (request.headers.get('X-BackupVault-Profile') or request.args.get('profile')):
+            return self.is_admin()
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def before_request(self):
+        if not self.should_profile() or not _active.acquire(blocking=False): return
+        profiler = cProfile.Profile()
+        try: profiler.enable()
+        except ValueError: _active.release(); return # another profiling tool holds the slot
+        g.profile_request_id = uuid.uuid4().hex[:16]
+        g.profile_sampler = _StackSampler(threading.get_ident()); g.profile_sampler.start()
+        g.profile_started = time.perf_counter()
+        g.profiler = profiler
+
+    def _finish(self):
+        # -> (profiler, sampler, duration in ms) of this request's profile, or None
+        profiler = g.pop('profiler', None)
+        if profiler is None: return None
+        try:
+            profiler.disable()
+            duration_ms = (time.perf_counter() - g.pop('profile_started')) * 1000
+            sampler = g.pop('profile_sampler'); sampler.stop()
+        finally: _active.release()
+        return profiler, sampler, duration_ms
+
+    def teardown_request(self, exc):
+        self._finish() # a request that failed before after_request ran
+
+    def after_request(self, response):
+        finished = self._finish()
+        if finished is None: return response
+        profiler, sampler, duration_ms = finished
+        request_id = g.pop('profile_request_id')
+        response.headers['X-Request-ID'] = request_id
+        if duration_ms < self.slow_ms: return response
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, f"{request_id}.prof"))
+            with open(os.path.join(self.profile_dir, f"{request_id}.collapsed"), 'w', encoding='utf-8') as f:
+                f.write(sampler.collapsed())
+        except OSError as e:
+            print(f"Warning: Could not store profile {request_id}: {e}"); return response
+        record = {'request_id': request_id, 'method': request.method, 'path': _recorded_path(),
+                  'status': response.status_code, 'duration_ms': round(duration_ms, 2),
+                  'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'stack_samples': sum(sampler.stacks.values()),
+                  'files': {'prof': f"{request_id}.prof", 'collapsed': f"{request_id}.collapsed"}}
+        with self._lock:
+            if len(self.recent) == self.recent.maxlen: self._remove_files(self.recent[0])
+            self.recent.append(record)
+        return response
+
+    def _remove_files(self, record):
+        for filename in record['files'].values():
+            try: os.remove(os.path.join(self.profile_dir, filename))
+            except OSError: pass
+
+    def list_profiles(self):
+        if not self.is_admin(): abort(403)
+        with self._lock: records = list(self.recent)
+        records.sort(key=lambda r: r['duration_ms'], reverse=True)
+        return jsonify({'slow_ms_threshold': self.slow_ms, 'sample_rate': self.sample_rate, 'profiles': records})
+
+    def get_profile_file(self, filename):
+        if not self.is_admin(): abort(403)
+        if not (filename.endswith('.prof') or filename.endswith('.collapsed')): abort(404)
+        return send_from_directory(self.profile_dir, filename, as_attachment=filename.endswith('.prof'),
+                                   mimetype='application/octet-stream' if filename.endswith('.prof') else 'text/plain')
+
+def init_profiling(app):
+    token = os.environ.get('BACKUPVAULT_PROFILE_TOKEN', '')
+    try: sample_rate = float(os.environ.get('BACKUPVAULT_PROFILE_SAMPLE_RATE', '0') or 0)
+    except ValueError: print("Warning: BACKUPVAULT_PROFILE_SAMPLE_RATE is not a number; sampling disabled."); sample_rate = 0.0
+    try: slow_ms = float(os.environ.get('BACKUPVAULT_PROFILE_SLOW_MS', '0') or 0)
+    except ValueError: slow_ms = 0.0
+    profile_dir = os.environ.get('BACKUPVAULT_PROFILE_DIR') or os.path.join(data_parser.APP_DIR_BASE, "profiles")
+    if not token and sample_rate <= 0: return None # disabled: no hooks, no routes
+
+    profiler = RequestProfiler(token, min(sample_rate, 1.0), slow_ms, profile_dir)
+    app.before_request(profiler.before_request)
+    app.after_request(profiler.after_request)
+    app.teardown_request(profiler.teardown_request)
+    app.add_url_rule('/api/profiles', 'list_profiles_api', profiler.list_profiles, methods=['GET'])
+    app.add_url_rule('/api/profiles/<path:filename>', 'get_profile_file_api', profiler.get_profile_file, methods=['GET'])
+    print(f"INFO: Request profiling enabled (sample rate {profiler.sample_rate}, "
+          f"{'token' if token else 'no token; profile list restricted to localhost'}). Profiles in {profile_dir}")
+    return profiler
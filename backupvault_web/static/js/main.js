@@ -50,20 +50,24 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // --- Summary Cards ---
+    function renderSummary(data) {
+        setTextContent('job-name', data.job_name);
+        setTextContent('job-format', data.backup_format);
+        setTextContent('last-backup-status', data.last_backup_status);
+        setTextContent('total-backup-storage', data.total_backup_storage_gb !== undefined ? data.total_backup_storage_gb.toFixed(2) : '0.00');
+        setTextContent('next-scheduled-run', data.next_scheduled_run);
+
+        // Also update the simpler "Next Backup Task" section if present
+        const nextJobNameDisplay = document.getElementById('next-job-name-display');
+        const nextRunTimeDisplay = document.getElementById('next-run-time-display');
+        if(nextJobNameDisplay) setTextContent('next-job-name-display', data.job_name);
+        if(nextRunTimeDisplay) setTextContent('next-run-time-display', data.next_scheduled_run);
+    }
+
     // --- API Call: Backup Summary ---
     fetchData('/api/backup_summary', "Failed to load summary statistics.")
-        .then(data => {
-            setTextContent('job-name', data.job_name);
-            setTextContent('last-backup-status', data.last_backup_status);
-            setTextContent('total-backup-storage', data.total_backup_storage_gb !== undefined ? data.total_backup_storage_gb.toFixed(2) : '0.00');
-            setTextContent('next-scheduled-run', data.next_scheduled_run);
-
-            // Also update the simpler "Next Backup Task" section if present
-            const nextJobNameDisplay = document.getElementById('next-job-name-display');
-            const nextRunTimeDisplay = document.getElementById('next-run-time-display');
-            if(nextJobNameDisplay) setTextContent('next-job-name-display', data.job_name);
-            if(nextRunTimeDisplay) setTextContent('next-run-time-display', data.next_scheduled_run);
-        })
+        .then(renderSummary)
         .catch(error => {
             // Set error states for summary cards
             setTextContent('job-name', 'Error');
@@ -72,167 +76,297 @@ document.addEventListener('DOMContentLoaded', function() {
             setTextContent('next-scheduled-run', 'Error');
         });
 
-    // --- API Call: Backup History ---
-    fetchData('/api/backup_history', "Failed to load backup history.")
-        .then(data => {
-            const historyTableBody = document.querySelector('#backup-history-table tbody');
-            if (!historyTableBody) {
-                console.warn("Backup history table body not found.");
-                return;
+    // --- Backup History Rows ---
+    // Rows carry data-run-id so pushed events can patch a single row in place.
+    function buildHistoryRow(run) {
+        const row = document.createElement('tr');
+        row.dataset.runId = run.run_id || '';
+        row.insertCell().textContent = run.run_id || 'N/A';
+        row.insertCell().textContent = run.job_name || 'N/A';
+        row.insertCell().textContent = run.start_time ? new Date(run.start_time).toLocaleString() : 'N/A';
+        row.insertCell().textContent = run.end_time ? new Date(run.end_time).toLocaleString() : 'N/A';
+        
+        const statusCell = row.insertCell();
+        statusCell.textContent = run.status || 'N/A';
+        if (run.status) {
+            const statusText = run.status.toLowerCase();
+            if (statusText.includes('success')) {
+                statusCell.style.color = 'var(--success-color)'; // Use CSS variable
+                statusCell.style.fontWeight = 'bold';
+            } else if (statusText.includes('fail')) {
+                statusCell.style.color = 'var(--error-color)'; // Use CSS variable
+                statusCell.style.fontWeight = 'bold';
+            } else if (statusText.includes('running')) {
+                statusCell.style.color = 'var(--accent-color-1)'; // Or another appropriate color
+                statusCell.style.fontStyle = 'italic';
             }
-            historyTableBody.innerHTML = ''; // Clear existing rows (like "Loading history...")
+        }
 
-            if (!data || data.length === 0) {
-                historyTableBody.innerHTML = '<tr><td colspan="8" style="text-align:center; color: var(--text-muted-color);">No backup history found. Run a backup using backupvault.sh!</td></tr>';
-                return;
-            }
+        row.insertCell().textContent = run.backup_size_bytes ? (run.backup_size_bytes / (1024*1024)).toFixed(2) + ' MB' : '0.00 MB';
+        
+        const summaryCell = row.insertCell();
+        summaryCell.textContent = run.summary_message ? (run.summary_message.length > 45 ? run.summary_message.substring(0, 42) + '...' : run.summary_message) : '-';
+        if(run.summary_message) summaryCell.title = run.summary_message; // Show full summary on hover
 
-            data.forEach(run => {
-                const row = historyTableBody.insertRow();
-                row.insertCell().textContent = run.run_id || 'N/A';
-                row.insertCell().textContent = run.job_name || 'N/A';
-                row.insertCell().textContent = run.start_time ? new Date(run.start_time).toLocaleString() : 'N/A';
-                row.insertCell().textContent = run.end_time ? new Date(run.end_time).toLocaleString() : 'N/A';
-                
-                const statusCell = row.insertCell();
-                statusCell.textContent = run.status || 'N/A';
-                if (run.status) {
-                    const statusText = run.status.toLowerCase();
-                    if (statusText.includes('success')) {
-                        statusCell.style.color = 'var(--success-color)'; // Use CSS variable
-                        statusCell.style.fontWeight = 'bold';
-                    } else if (statusText.includes('fail')) {
-                        statusCell.style.color = 'var(--error-color)'; // Use CSS variable
-                        statusCell.style.fontWeight = 'bold';
-                    } else if (statusText.includes('running')) {
-                        statusCell.style.color = 'var(--accent-color-1)'; // Or another appropriate color
-                        statusCell.style.fontStyle = 'italic';
-                    }
-                }
+        const logCell = row.insertCell();
+        if (run.detailed_log_file_path) {
+            const logLink = document.createElement('a');
+            logLink.href = "#";
+            logLink.textContent = "View Log";
+            logLink.className = "log-link"; 
+            logLink.dataset.logFile = run.detailed_log_file_path;
+            logLink.addEventListener('click', function(e) {
+                e.preventDefault();
+                viewLog(this.dataset.logFile);
+            });
+            logCell.appendChild(logLink);
+        } else {
+            logCell.textContent = "No Details";
+            logCell.style.color = 'var(--text-muted-color)';
+        }
+        return row;
+    }
 
-                row.insertCell().textContent = run.backup_size_bytes ? (run.backup_size_bytes / (1024*1024)).toFixed(2) + ' MB' : '0.00 MB';
-                
-                const summaryCell = row.insertCell();
-                summaryCell.textContent = run.summary_message ? (run.summary_message.length > 45 ? run.summary_message.substring(0, 42) + '...' : run.summary_message) : '-';
-                if(run.summary_message) summaryCell.title = run.summary_message; // Show full summary on hover
+    function renderHistory(data) {
+        const historyTableBody = document.querySelector('#backup-history-table tbody');
+        if (!historyTableBody) {
+            console.warn("Backup history table body not found.");
+            return;
+        }
+        historyTableBody.innerHTML = ''; // Clear existing rows (like "Loading history...")
 
-                const logCell = row.insertCell();
-                if (run.detailed_log_file_path) {
-                    const logLink = document.createElement('a');
-                    logLink.href = "#";
-                    logLink.textContent = "View Log";
-                    logLink.className = "log-link"; 
-                    logLink.dataset.logFile = run.detailed_log_file_path;
-                    logLink.addEventListener('click', function(e) {
-                        e.preventDefault();
-                        viewLog(this.dataset.logFile);
-                    });
-                    logCell.appendChild(logLink);
-                } else {
-                    logCell.textContent = "No Details";
-                    logCell.style.color = 'var(--text-muted-color)';
-                }
+        if (!data || data.length === 0) {
+            historyTableBody.innerHTML = '<tr class="empty-history-row"><td colspan="8" style="text-align:center; color: var(--text-muted-color);">No backup history found. Run a backup using backupvault.sh!</td></tr>';
+            return;
+        }
+        data.forEach(run => historyTableBody.appendChild(buildHistoryRow(run)));
+    }
+
+    // Insert a new run at the top, or replace its existing row; touches nothing else.
+    function upsertHistoryRow(run) {
+        const historyTableBody = document.querySelector('#backup-history-table tbody');
+        if (!historyTableBody || !run.run_id) return;
+        const newRow = buildHistoryRow(run);
+        const existingRow = historyTableBody.querySelector(`tr[data-run-id="${CSS.escape(run.run_id)}"]`);
+        if (existingRow) {
+            existingRow.replaceWith(newRow);
+            return;
+        }
+        const placeholderRow = historyTableBody.querySelector('tr.empty-history-row');
+        if (placeholderRow) placeholderRow.remove();
+        historyTableBody.insertBefore(newRow, historyTableBody.firstChild);
+    }
+
+    function loadHistory() {
+        return fetchData('/api/backup_history', "Failed to load backup history.")
+            .then(renderHistory)
+            .catch(error => {
+                const historyTableBody = document.querySelector('#backup-history-table tbody');
+                if (historyTableBody) historyTableBody.innerHTML = '<tr><td colspan="8" style="text-align:center; color: var(--error-color);">Error loading backup history.</td></tr>';
             });
-        })
-        .catch(error => {
-            const historyTableBody = document.querySelector('#backup-history-table tbody');
-            if (historyTableBody) historyTableBody.innerHTML = '<tr><td colspan="8" style="text-align:center; color: var(--error-color);">Error loading backup history.</td></tr>';
+    }
+
+    // --- API Call: Backup History ---
+    loadHistory();
+
+    // --- Backup Artifacts ---
+    // Sizes come from the server-side inventory; rsync snapshot directories are sized by
+    // the engine's tree index, so this stays cheap even for large snapshots.
+    function renderArtifacts(data) {
+        const artifactsTableBody = document.querySelector('#backup-artifacts-table tbody');
+        if (!artifactsTableBody) return;
+        artifactsTableBody.innerHTML = '';
+        if (!data || !data.artifacts || data.artifacts.length === 0) {
+            artifactsTableBody.innerHTML = '<tr><td colspan="5" style="text-align:center; color: var(--text-muted-color);">No backup artifacts found in the destination directory.</td></tr>';
+            return;
+        }
+        data.artifacts.forEach(artifact => {
+            const row = artifactsTableBody.insertRow();
+            row.insertCell().textContent = artifact.name;
+            row.insertCell().textContent = artifact.job_name || 'N/A';
+            const mode = artifact.backup_mode && artifact.backup_mode !== 'full' ? ` (${artifact.backup_mode})` : '';
+            row.insertCell().textContent = artifact.type + (artifact.type === 'rsync' ? ' (directory)' : mode);
+            row.insertCell().textContent = artifact.created ? new Date(artifact.created).toLocaleString() : 'N/A';
+            row.insertCell().textContent = (artifact.size_bytes / (1024*1024)).toFixed(2) + ' MB';
         });
+    }
 
-    // --- API Call: Storage Usage Chart ---
-    let storageChartInstance = null; 
-    fetchData('/api/storage_usage', "Failed to load storage usage data.")
-        .then(chartData => {
-            const chartCanvas = document.getElementById('storageUsageChart');
-            if (!chartCanvas) {
-                 console.warn("Storage usage chart canvas not found.");
-                 return;
-            }
-            const chartContainer = chartCanvas.parentElement; // Assuming canvas is wrapped
-            if (chartData.error) {
-                console.error("Error from /api/storage_usage: ", chartData.error);
-                if(chartContainer) chartContainer.innerHTML = `<p style="color:var(--error-color); text-align:center; padding: 20px 0;">Could not load storage data: ${chartData.error}</p>`;
-                return;
-            }
-            if (window.storageChartInstance) { window.storageChartInstance.destroy(); }
+    function loadArtifacts() {
+        return fetchData('/api/artifacts', "Failed to load backup artifacts.")
+            .then(renderArtifacts)
+            .catch(error => {
+                const artifactsTableBody = document.querySelector('#backup-artifacts-table tbody');
+                if (artifactsTableBody) artifactsTableBody.innerHTML = '<tr><td colspan="5" style="text-align:center; color: var(--error-color);">Error loading backup artifacts.</td></tr>';
+            });
+    }
 
-            // Updated colors to match our new theme
-            const colorUsed = 'rgba(244, 114, 182, 0.7)'; // Pink accent
-            const borderUsed = 'rgba(244, 114, 182, 1)';
-            const colorFree = 'rgba(56, 189, 248, 0.7)';  // Blue accent
-            const borderFree = 'rgba(56, 189, 248, 1)';
-            const gridColor = 'rgba(148, 163, 184, 0.1)'; 
-            const textColor = getComputedStyle(document.body).getPropertyValue('--text-color').trim() || '#e2e8f0';
+    loadArtifacts();
 
-            window.storageChartInstance = new Chart(chartCanvas.getContext('2d'), {
-                type: 'bar',
-                data: {
-                    labels: chartData.labels || ["Storage Volume"],
-                    datasets: [
-                        {
-                            label: 'Used GB',
-                            data: chartData.datasets && chartData.datasets[0] ? chartData.datasets[0].data : [],
-                            backgroundColor: colorUsed,
-                            borderColor: borderUsed,
-                            borderWidth: 1,
-                            barPercentage: 0.6,
-                            categoryPercentage: 0.7
-                        }, 
-                        {
-                            label: 'Free GB',
-                            data: chartData.datasets && chartData.datasets[1] ? chartData.datasets[1].data : [],
-                            backgroundColor: colorFree,
-                            borderColor: borderFree,
-                            borderWidth: 1,
-                            barPercentage: 0.6,
-                            categoryPercentage: 0.7
-                        }
-                    ]
+    // --- Storage Usage Chart ---
+    // Used space over time (from the server-side sampler), with the days-until-full
+    // projection drawn as a dashed continuation of the line.
+    function renderStorageForecast(chartData) {
+        const forecast = chartData.forecast || {};
+        let text = 'Forecast: not enough history yet';
+        if (forecast.days_until_full !== null && forecast.days_until_full !== undefined) {
+            text = `Forecast: full in ~${forecast.days_until_full} days (${forecast.projected_full_date || 'N/A'}), growing ${forecast.growth_gb_per_day} GB/day`;
+        } else if (forecast.growth_gb_per_day !== undefined && forecast.growth_gb_per_day !== null) {
+            text = `Forecast: not filling up (${forecast.growth_gb_per_day} GB/day)`;
+        }
+        if (forecast.method === 'backup_sizes') text += ' — estimated from backup sizes';
+        if (chartData.current) text += ` · Free now: ${chartData.current.free_gb} of ${chartData.current.total_gb} GB`;
+        if (chartData.artifacts_gb !== null && chartData.artifacts_gb !== undefined) text += ` · Backup artifacts: ${chartData.artifacts_gb} GB`;
+        setTextContent('storage-forecast', text);
+    }
+
+    function renderStorageChart(chartData) {
+        const chartCanvas = document.getElementById('storageUsageChart');
+        if (!chartCanvas) {
+             console.warn("Storage usage chart canvas not found.");
+             return;
+        }
+        const chartContainer = chartCanvas.parentElement; // Assuming canvas is wrapped
+        if (chartData.error) {
+            console.error("Error from /api/storage_usage: ", chartData.error);
+            if(chartContainer) chartContainer.innerHTML = `<p style="color:var(--error-color); text-align:center; padding: 20px 0;">Could not load storage data: ${chartData.error}</p>`;
+            return;
+        }
+        renderStorageForecast(chartData);
+        // Pushed updates only swap the numbers on the existing chart
+        if (window.storageChartInstance) {
+            const chart = window.storageChartInstance;
+            chart.data.labels = chartData.labels || [];
+            chart.data.datasets.forEach((dataset, i) => {
+                dataset.data = chartData.datasets && chartData.datasets[i] ? chartData.datasets[i].data : [];
+            });
+            chart.update('none');
+            return;
+        }
+
+        // Updated colors to match our new theme
+        const colorUsed = 'rgba(244, 114, 182, 0.25)'; // Pink accent
+        const borderUsed = 'rgba(244, 114, 182, 1)';
+        const borderForecast = 'rgba(250, 204, 21, 1)'; // Yellow, as in --warning-color
+        const borderCapacity = 'rgba(56, 189, 248, 1)';  // Blue accent
+        const gridColor = 'rgba(148, 163, 184, 0.1)'; 
+        const textColor = getComputedStyle(document.body).getPropertyValue('--text-color').trim() || '#e2e8f0';
+        const datasetData = i => chartData.datasets && chartData.datasets[i] ? chartData.datasets[i].data : [];
+
+        window.storageChartInstance = new Chart(chartCanvas.getContext('2d'), {
+            type: 'line',
+            data: {
+                labels: chartData.labels || [],
+                datasets: [
+                    {
+                        label: 'Used GB',
+                        data: datasetData(0),
+                        borderColor: borderUsed,
+                        backgroundColor: colorUsed,
+                        fill: true,
+                        borderWidth: 2,
+                        pointRadius: 0,
+                        tension: 0.2
+                    }, 
+                    {
+                        label: 'Forecast Used GB',
+                        data: datasetData(1),
+                        borderColor: borderForecast,
+                        borderDash: [6, 4],
+                        borderWidth: 2,
+                        pointRadius: 0,
+                        spanGaps: false
+                    },
+                    {
+                        label: 'Capacity GB',
+                        data: datasetData(2),
+                        borderColor: borderCapacity,
+                        borderWidth: 1,
+                        pointRadius: 0
+                    }
+                ]
+            },
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                interaction: { mode: 'index', intersect: false },
+                scales: {
+                    x: { 
+                        ticks: { color: textColor, font: { size: 11 }, maxTicksLimit: 8, maxRotation: 0 },
+                        grid: { display: false }
+                    },
+                    y: { 
+                        beginAtZero: true,
+                        title: { display: true, text: 'Gigabytes (GB)', color: textColor, font: { size: 13, weight: '500' } },
+                        ticks: { color: textColor, font: { size: 11 } },
+                        grid: { color: gridColor, borderColor: gridColor, drawBorder: false }
+                     }
                 },
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: false,
-                    indexAxis: 'y', 
-                    scales: {
-                        x: { 
-                            beginAtZero: true,
-                            title: { display: true, text: 'Gigabytes (GB)', color: textColor, font: { size: 13, weight: '500' } },
-                            ticks: { color: textColor, font: { size: 11 } },
-                            grid: { color: gridColor, borderColor: gridColor, drawBorder: false }
-                        },
-                        y: { 
-                             ticks: { color: textColor, font: { size: 11 } },
-                             grid: { display: false } // Often cleaner for horizontal bars
-                         }
+                plugins: {
+                    legend: { 
+                        display: true, 
+                        position: 'top', 
+                        labels: { color: textColor, font: { size: 12}, boxWidth: 15, padding: 20 }
                     },
-                    plugins: {
-                        legend: { 
-                            display: true, 
-                            position: 'top', 
-                            labels: { color: textColor, font: { size: 12}, boxWidth: 15, padding: 20 }
-                        },
-                        tooltip: {
-                            backgroundColor: 'rgba(15, 23, 42, 0.9)', // Darker tooltip for contrast
-                            titleColor: textColor,
-                            bodyColor: textColor,
-                            borderColor: 'rgba(148, 163, 184, 0.2)',
-                            borderWidth: 1,
-                            padding: 10,
-                            callbacks: {
-                                label: function(context) {
-                                    return ` ${context.dataset.label || ''}: ${context.parsed.x !== null ? context.parsed.x.toFixed(2) : 'N/A'} GB`;
-                                }
+                    tooltip: {
+                        backgroundColor: 'rgba(15, 23, 42, 0.9)', // Darker tooltip for contrast
+                        titleColor: textColor,
+                        bodyColor: textColor,
+                        borderColor: 'rgba(148, 163, 184, 0.2)',
+                        borderWidth: 1,
+                        padding: 10,
+                        callbacks: {
+                            label: function(context) {
+                                return ` ${context.dataset.label || ''}: ${context.parsed.y !== null ? context.parsed.y.toFixed(2) : 'N/A'} GB`;
                             }
                         }
                     }
                 }
-            });
-        })
+            }
+        });
+    }
+
+    // --- API Call: Storage Usage Chart ---
+    fetchData('/api/storage_usage', "Failed to load storage usage data.")
+        .then(renderStorageChart)
         .catch(error => {
             const chartCanvas = document.getElementById('storageUsageChart');
             if (chartCanvas) chartCanvas.parentElement.innerHTML = '<p style="color:var(--error-color); text-align:center; padding: 20px 0;">Error loading storage usage chart.</p>';
         });
 
+    // --- Live Updates (Server-Sent Events) ---
+    // The server watches the runs log and pushes only what changed; each event patches
+    // the matching card, row or chart instead of reloading the page.
+    if (window.EventSource) {
+        const eventSource = new EventSource('/api/events');
+        function parseEventData(event) {
+            try { return JSON.parse(event.data); }
+            catch (e) { console.error("Malformed dashboard event:", event.data); return null; }
+        }
+        eventSource.addEventListener('summary', event => {
+            const data = parseEventData(event);
+            if (data) renderSummary(data);
+        });
+        eventSource.addEventListener('run_added', event => {
+            const run = parseEventData(event);
+            if (run) upsertHistoryRow(run);
+        });
+        eventSource.addEventListener('run_updated', event => {
+            const run = parseEventData(event);
+            if (run) { upsertHistoryRow(run); loadArtifacts(); }
+        });
+        eventSource.addEventListener('storage', event => {
+            const data = parseEventData(event);
+            if (data) renderStorageChart(data);
+        });
+        // Sent when the server could not replay everything we missed while disconnected
+        eventSource.addEventListener('resync', () => {
+            fetchData('/api/backup_summary').then(renderSummary).catch(() => {});
+            loadHistory();
+            loadArtifacts();
+            fetchData('/api/storage_usage').then(renderStorageChart).catch(() => {});
+        });
+    }
+
     // --- Log Viewer Modal Logic ---
     const logModal = document.getElementById('logModal');
     const logModalContent = document.getElementById('logModalContent');